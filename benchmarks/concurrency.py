@@ -0,0 +1,223 @@
+"""
+Сравнение WSGI и ASGI при большом числе одновременных соединений.
+
+Один процесс gunicorn (gthread, ASYNC_DB_WORKERS потоков) и один процесс
+uvicorn с асинхронными представлениями (пул из стольких же потоков для
+базы) получают по --connections одновременных соединений. Клиенты
+медленные: заголовки запроса приходят с паузой --client-delay, а сами
+клиенты подключаются равномерно в течение --ramp секунд. Для
+каждого сервера считаются успешные ответы, ошибки, пропускная
+способность и задержки от подключения до конца ответа.
+
+    python -m benchmarks.concurrency
+    python -m benchmarks.concurrency --connections 200 --client-delay 0.5
+"""
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import import_module
+from io import StringIO
+
+DATABASE = 'bench.sqlite3'
+
+SERVERS = {
+    'wsgi': lambda port, threads: [
+        sys.executable, '-m', 'gunicorn', 'yanote.wsgi',
+        '--worker-class', 'gthread', '--workers', '1',
+        '--threads', str(threads), '--worker-connections', '10000',
+        '--backlog', '4096', '--bind', f'127.0.0.1:{port}',
+        '--log-level', 'warning',
+    ],
+    'asgi': lambda port, threads: [
+        sys.executable, '-m', 'uvicorn', 'yanote.asgi:application',
+        '--host', '127.0.0.1', '--port', str(port), '--backlog', '4096',
+        '--no-access-log', '--log-level', 'warning',
+    ],
+}
+
+
+def prepare(directory, options):
+    """База с данными seed_notes и сессиями вошедших пользователей."""
+    os.environ['YANOTE_DATABASE'] = os.path.join(directory, DATABASE)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yanote.settings')
+    import django
+
+    django.setup()
+    from django.conf import settings
+    from django.contrib.auth import (
+        BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY,
+    )
+    from django.core.management import call_command
+
+    from notes.models import Note
+
+    call_command('migrate', verbosity=0)
+    call_command(
+        'seed_notes', users=options.users, notes=options.notes,
+        # Серверы запускаются позже, их кеш ещё пуст.
+        seed=0, local_cache=True, stdout=StringIO(),
+    )
+    engine = import_module(settings.SESSION_ENGINE)
+    clients = []
+    for note in Note.objects.select_related('author').order_by('?')[
+        :options.users * 5
+    ]:
+        session = engine.SessionStore()
+        session[SESSION_KEY] = str(note.author.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = note.author.get_session_auth_hash()
+        session.create()
+        clients.append((session.session_key, note.slug))
+    return clients
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Сервер завершился при запуске.')
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Сервер не запустился.')
+
+
+async def request(port, path, session_key, start, delay, timeout):
+    """Один медленный клиент: (секунды, код ответа или None при ошибке)."""
+    await asyncio.sleep(start)
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection('127.0.0.1', port), timeout
+        )
+        writer.write(f'GET {path} HTTP/1.1\r\n'.encode())
+        await writer.drain()
+        await asyncio.sleep(delay)
+        writer.write((
+            'Host: localhost\r\n'
+            f'Cookie: sessionid={session_key}\r\n'
+            'Connection: close\r\n\r\n'
+        ).encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        status = int(response.split(b' ', 2)[1])
+    except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+        return time.perf_counter() - started, None
+    return time.perf_counter() - started, status
+
+
+async def load(port, clients, options):
+    paths = ('/', '/notes/', '/note/{}/')
+    started = time.perf_counter()
+    samples = await asyncio.gather(*(
+        request(
+            port, paths[number % len(paths)].format(slug), session_key,
+            number * options.ramp / options.connections,
+            options.client_delay, options.timeout,
+        )
+        for number, (session_key, slug) in zip(
+            range(options.connections),
+            (clients[i % len(clients)] for i in range(options.connections)),
+        )
+    ))
+    return samples, time.perf_counter() - started
+
+
+def run_server(name, clients, options):
+    port = free_port()
+    env = dict(
+        os.environ, YANOTE_ASYNC_DB_WORKERS=str(options.threads),
+        PYTHONPATH=os.getcwd(),
+    )
+    process = subprocess.Popen(SERVERS[name](port, options.threads), env=env)
+    try:
+        wait_for_port(port, process)
+        samples, elapsed = asyncio.run(load(port, clients, options))
+    finally:
+        process.terminate()
+        process.wait()
+    ok = [seconds * 1000 for seconds, status in samples if status == 200]
+    percentiles = (
+        statistics.quantiles(ok, n=100, method='inclusive')
+        if len(ok) > 1 else [0.0] * 99
+    )
+    return {
+        'ok': len(ok),
+        'errors': len(samples) - len(ok),
+        'rps': round(len(ok) / elapsed, 1),
+        'p50_ms': round(percentiles[49], 1),
+        'p95_ms': round(percentiles[94], 1),
+        'p99_ms': round(percentiles[98], 1),
+        'max_ms': round(max(ok, default=0.0), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument(
+        '--client-delay', type=float, default=1.0,
+        help='Пауза клиента между строкой запроса и заголовками, секунды.',
+    )
+    parser.add_argument(
+        '--ramp', type=float, default=5.0,
+        help=(
+            'За сколько секунд подключаются все клиенты: медленные '
+            'клиенты приходят непрерывно, а не одной волной.'
+        ),
+    )
+    parser.add_argument(
+        '--threads', type=int, default=8,
+        help='Потоки gunicorn и пул базы под ASGI (ASYNC_DB_WORKERS).',
+    )
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--notes', type=int, default=50)
+    parser.add_argument(
+        '--servers', nargs='+', choices=tuple(SERVERS),
+        default=tuple(SERVERS),
+    )
+    options = parser.parse_args()
+    # Клиентские и серверные сокеты: нужен запас дескрипторов.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = options.connections * 2 + 256
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    with tempfile.TemporaryDirectory() as directory:
+        clients = prepare(directory, options)
+        print(
+            f'{options.connections} соединений за {options.ramp} с, пауза '
+            f'клиента {options.client_delay} с, {options.threads} потоков'
+        )
+        print(
+            f'{"сервер":<8}{"успешно":>9}{"ошибок":>8}{"запр/с":>9}'
+            f'{"p50 мс":>10}{"p95 мс":>10}{"p99 мс":>10}{"max мс":>10}'
+        )
+        for name in options.servers:
+            result = run_server(name, clients, options)
+            print(
+                f'{name:<8}{result["ok"]:>9}{result["errors"]:>8}'
+                f'{result["rps"]:>9}{result["p50_ms"]:>10}'
+                f'{result["p95_ms"]:>10}{result["p99_ms"]:>10}'
+                f'{result["max_ms"]:>10}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+"""
+Нагрузочный тест всех маршрутов yanote на сгенерированных данных.
+
+Во временной базе создаются данные командой seed_notes, затем каждый
+маршрут из notes/urls.py и yanote/urls.py опрашивается параллельно из
+нескольких потоков через тестовый клиент Django. Для маршрута считаются
+пропускная способность, p50/p95/p99 задержки и число SQL-запросов на
+запрос (медиана). Результаты сравниваются с сохранённой базовой линией; при
+регрессии код возврата 1, так что проверку можно запускать в CI.
+
+    python -m benchmarks.routes
+    python -m benchmarks.routes --save-baseline
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yanote.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.contrib.staticfiles.storage import (  # noqa: E402
+    staticfiles_storage,
+)
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    override_settings, setup_test_environment,
+)
+
+from notes.management.commands.seed_notes import WORDS  # noqa: E402
+from notes.models import Note  # noqa: E402
+
+BASELINE = Path(__file__).with_name('baseline.json')
+PASSWORD = 'bench-password'
+PREFIX = 'bench'
+STYLESHEET = 'vendor/bootstrap-5.1.3/bootstrap.min.css'
+
+
+class Scenario:
+    """Общее состояние прогона: пользователи, их заметки и счётчики."""
+
+    def __init__(self, options):
+        User = get_user_model()
+        self.users = list(
+            User.objects.filter(username__startswith=PREFIX).order_by('pk')
+        )
+        self.admin = User.objects.create_superuser(
+            'bench-admin', password=PASSWORD
+        )
+        self.slugs = {
+            user.pk: list(
+                Note.objects.filter(author=user).values_list('slug', flat=True)
+            )
+            for user in self.users
+        }
+        self.created = []
+        self.numbers = itertools.count(1)
+        self.local = threading.local()
+
+    def client(self, user=None):
+        """Клиент потока, вошедший как user (или как случайный автор)."""
+        clients = self.local.__dict__.setdefault('clients', {})
+        user = user or self.users[
+            threading.get_ident() % len(self.users)
+        ]
+        if user.pk not in clients:
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            clients[user.pk] = client
+        return clients[user.pk], user
+
+    def slug(self, user):
+        return random.choice(self.slugs[user.pk])
+
+    def unique(self, name):
+        return f'{name}-{next(self.numbers)}'
+
+
+def get(path, **params):
+    def request(scenario):
+        client, _ = scenario.client()
+        return client.get(path, params)
+    return request
+
+
+def own_note(path):
+    def request(scenario):
+        client, user = scenario.client()
+        return client.get(path.format(slug=scenario.slug(user)))
+    return request
+
+
+def create_note(scenario):
+    client, user = scenario.client()
+    slug = scenario.unique(f'{PREFIX}-new')
+    response = client.post('/add/', {
+        'title': random.choice(WORDS), 'text': ' '.join(WORDS), 'slug': slug,
+    })
+    scenario.created.append((user, slug))
+    return response
+
+
+def edit_note(scenario):
+    client, user = scenario.client()
+    slug = scenario.slug(user)
+    return client.post(f'/edit/{slug}/', {
+        'title': random.choice(WORDS), 'text': ' '.join(WORDS), 'slug': slug,
+    })
+
+
+def delete_note(scenario):
+    # Удаляются заметки, созданные маршрутом notes:add.
+    user, slug = scenario.created.pop()
+    client, _ = scenario.client(user)
+    return client.post(f'/delete/{slug}/')
+
+
+def batch_api(scenario):
+    client, _ = scenario.client()
+    operations = [
+        {'action': 'create', 'data': {
+            'title': random.choice(WORDS), 'text': ' '.join(WORDS),
+            'slug': scenario.unique(f'{PREFIX}-api'),
+        }}
+        for _ in range(10)
+    ]
+    return client.post(
+        '/api/notes/', json.dumps({'operations': operations}),
+        content_type='application/json',
+    )
+
+
+def export_notes(scenario):
+    client, _ = scenario.client()
+    response = client.get('/export/', {'format': 'jsonl'})
+    # Ответ потоковый: время включает выгрузку всех строк.
+    b''.join(response.streaming_content)
+    return response
+
+
+def note_events(scenario):
+    # Поток бесконечный: меряем подписку и первое сообщение, затем
+    # закрываем ответ, как при уходе со страницы.
+    client, _ = scenario.client()
+    response = client.get('/events/')
+    next(iter(response.streaming_content))
+    response.close()
+    return response
+
+
+def static_asset(scenario):
+    client, _ = scenario.client()
+    response = client.get(
+        staticfiles_storage.url(STYLESHEET), HTTP_ACCEPT_ENCODING='br, gzip'
+    )
+    b''.join(response.streaming_content)
+    return response
+
+
+def admin_index(scenario):
+    client, _ = scenario.client(scenario.admin)
+    return client.get('/admin/')
+
+
+def login(scenario):
+    client = Client()
+    return client.post('/auth/login/', {
+        'username': random.choice(scenario.users).username,
+        'password': PASSWORD,
+    })
+
+
+def logout(scenario):
+    client = Client()
+    client.force_login(random.choice(scenario.users))
+    return client.get('/auth/logout/')
+
+
+def signup(scenario):
+    password = 'Bench-' + PASSWORD
+    return Client().post('/auth/signup/', {
+        'username': scenario.unique('bench-signup'),
+        'password1': password, 'password2': password,
+    })
+
+
+# Порядок важен: notes:delete удаляет то, что создал notes:add.
+ROUTES = {
+    'notes:home': get('/'),
+    'notes:list': get('/notes/'),
+    'notes:detail': own_note('/note/{slug}/'),
+    'notes:search': get('/search/', q='проект'),
+    'notes:export': export_notes,
+    'notes:changes': get('/changes/', since=0),
+    'notes:events': note_events,
+    'notes:success': get('/done/'),
+    'notes:add': create_note,
+    'notes:edit': edit_note,
+    'notes:delete': delete_note,
+    'notes:api': batch_api,
+    'admin:index': admin_index,
+    'metrics': get('/metrics'),
+    'static': static_asset,
+    'users:login': login,
+    'users:logout': logout,
+    'users:signup': signup,
+}
+
+
+def measure(scenario, request):
+    """Один запрос: (секунды, SQL-запросы, успешен ли ответ)."""
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    with connection.execute_wrapper(count):
+        response = request(scenario)
+    elapsed = time.perf_counter() - started
+    return elapsed, queries, response.status_code < 400
+
+
+def run_route(scenario, request, requests, concurrency):
+    with ThreadPoolExecutor(concurrency) as executor:
+        started = time.perf_counter()
+        samples = list(executor.map(
+            lambda _: measure(scenario, request), range(requests)
+        ))
+        elapsed = time.perf_counter() - started
+    latencies = [sample[0] * 1000 for sample in samples]
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentiles[49], 2),
+        'p95_ms': round(percentiles[94], 2),
+        'p99_ms': round(percentiles[98], 2),
+        # Медиана: первые запросы потока дороже из-за сессии и кеша.
+        'queries': statistics.median(sample[1] for sample in samples),
+        'errors': sum(not sample[2] for sample in samples),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Регрессии: ошибки, рост числа SQL-запросов на запрос или p95 выше
+    базового больше чем на tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('routes', {}).get(name)
+        if result['errors']:
+            regressions.append(f'{name}: ошибок {result["errors"]}')
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(
+                f'{name}: запросов {result["queries"]} > {base["queries"]}'
+            )
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f'{name}: p95 {result["p95_ms"]} мс > '
+                f'{base["p95_ms"]} мс + {tolerance:.0%}'
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--notes', type=int, default=200)
+    parser.add_argument('--text-median', type=int, default=400)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument(
+        '--tolerance', type=float, default=0.5,
+        help='Допустимый рост p95 относительно базовой линии.',
+    )
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='Записать результаты как новую базовую линию.',
+    )
+    options = parser.parse_args()
+    random.seed(options.seed)
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory:
+        # Файл, а не память: потоки работают с одной базой, как процессы
+        # с общим db.sqlite3.
+        settings.DATABASES['default']['TEST']['NAME'] = os.path.join(
+            directory, 'bench.sqlite3'
+        )
+        connection.creation.create_test_db(verbosity=0)
+        # Кеш заметок и сессии в общем файловом кеше, как у нескольких
+        # процессов с YANOTE_CACHE_DIR.
+        override_settings(
+            CACHES={**settings.CACHES, settings.NOTES_CACHE: {
+                'BACKEND': (
+                    'django.core.cache.backends.filebased.FileBasedCache'
+                ),
+                'LOCATION': os.path.join(directory, 'cache'),
+            }},
+            SESSION_ENGINE='notes.sessions',
+        ).enable()
+        # Статика отдаётся из STATIC_ROOT, собранного collectstatic.
+        settings.STATIC_ROOT = os.path.join(directory, 'static')
+        call_command('collectstatic', interactive=False, verbosity=0)
+        call_command(
+            'seed_notes', users=options.users, notes=options.notes,
+            text_median=options.text_median, prefix=PREFIX,
+            password=PASSWORD, seed=options.seed, verbosity=0,
+        )
+        scenario = Scenario(options)
+        print(
+            f'{options.users} пользователей × {options.notes} заметок, '
+            f'{options.requests} запросов на маршрут, '
+            f'{options.concurrency} потоков'
+        )
+        print(
+            f'{"маршрут":<16}{"запр/с":>9}{"p50 мс":>9}{"p95 мс":>9}'
+            f'{"p99 мс":>9}{"SQL":>7}{"ошибок":>8}'
+        )
+        results = {}
+        for name, request in ROUTES.items():
+            result = results[name] = run_route(
+                scenario, request, options.requests, options.concurrency
+            )
+            print(
+                f'{name:<16}{result["rps"]:>9}{result["p50_ms"]:>9}'
+                f'{result["p95_ms"]:>9}{result["p99_ms"]:>9}'
+                f'{result["queries"]:>7}{result["errors"]:>8}'
+            )
+    report = {
+        'options': {
+            key: getattr(options, key) for key in (
+                'users', 'notes', 'text_median', 'requests', 'concurrency',
+            )
+        },
+        'routes': results,
+    }
+    if options.save_baseline:
+        options.baseline.write_text(
+            json.dumps(report, ensure_ascii=False, indent=2) + '\n'
+        )
+        print(f'Базовая линия записана в {options.baseline}')
+        return
+    if not options.baseline.exists():
+        print('Базовой линии нет, сравнение пропущено.')
+        return
+    baseline = json.loads(options.baseline.read_text())
+    if baseline.get('options') != report['options']:
+        print('Параметры прогона отличаются от базовой линии.')
+    regressions = compare(results, baseline, options.tolerance)
+    for regression in regressions:
+        print(f'РЕГРЕССИЯ {regression}')
+    if regressions:
+        sys.exit(1)
+    print('Регрессий нет.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Сравнение SQLite «как было» и с профилем yanote.settings_production.
+
+Несколько процессов одновременно пишут заметки (вставка и обновление
+счётчика в одной транзакции, как в Note.save), ещё несколько читают список.
+Режим «до»: журнал по умолчанию, новое соединение на каждую операцию.
+Режим «после»: PRAGMA из SQLITE_PRAGMAS и постоянные соединения.
+
+    python -m benchmarks.sqlite_write_concurrency --writers 8 --readers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from yanote.settings_production import SQLITE_PRAGMAS
+
+SCHEMA = '''
+CREATE TABLE note (
+    id INTEGER PRIMARY KEY,
+    author_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    text TEXT NOT NULL,
+    slug TEXT NOT NULL UNIQUE
+);
+CREATE INDEX note_author_id_idx ON note (author_id, id);
+CREATE TABLE counter (author_id INTEGER PRIMARY KEY, value INTEGER);
+'''
+
+
+def connect(path, tuned):
+    connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+    if tuned:
+        for name, value in SQLITE_PRAGMAS.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+    return connection
+
+
+def writer(path, tuned, worker, operations, results):
+    connection = connect(path, tuned)
+    done = locked = 0
+    for number in range(operations):
+        if not tuned:
+            connection.close()
+            connection = connect(path, tuned)
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'INSERT INTO note (author_id, title, text, slug) '
+                'VALUES (?, ?, ?, ?)',
+                (worker, 'Заметка', 'Текст заметки ' * 20,
+                 f'note-{worker}-{number}'),
+            )
+            connection.execute(
+                'INSERT INTO counter VALUES (?, 1) ON CONFLICT (author_id) '
+                'DO UPDATE SET value = value + 1', (worker,)
+            )
+            connection.execute('COMMIT')
+            done += 1
+        except sqlite3.OperationalError:
+            locked += 1
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+    results.put(('write', done, locked))
+
+
+def reader(path, tuned, worker, deadline, results):
+    connection = connect(path, tuned)
+    done = locked = 0
+    while time.monotonic() < deadline.value:
+        if not tuned:
+            connection.close()
+            connection = connect(path, tuned)
+        try:
+            connection.execute(
+                'SELECT id, slug, title FROM note WHERE author_id = ? '
+                'ORDER BY id DESC LIMIT 50', (worker,)
+            ).fetchall()
+            done += 1
+        except sqlite3.OperationalError:
+            locked += 1
+    results.put(('read', done, locked))
+
+
+def run(tuned, writers, readers, operations):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite3')
+        connect(path, tuned).executescript(SCHEMA)
+        results = multiprocessing.Queue()
+        deadline = multiprocessing.Value('d', float('inf'))
+        processes = [
+            multiprocessing.Process(
+                target=writer,
+                args=(path, tuned, worker, operations, results),
+            )
+            for worker in range(writers)
+        ] + [
+            multiprocessing.Process(
+                target=reader, args=(path, tuned, worker, deadline, results),
+            )
+            for worker in range(readers)
+        ]
+        started = time.monotonic()
+        for process in processes:
+            process.start()
+        totals = {'write': [0, 0], 'read': [0, 0]}
+        for _ in range(writers):
+            kind, done, locked = results.get()
+            totals[kind][0] += done
+            totals[kind][1] += locked
+        elapsed = time.monotonic() - started
+        deadline.value = 0
+        for _ in range(readers):
+            kind, done, locked = results.get()
+            totals[kind][0] += done
+            totals[kind][1] += locked
+        for process in processes:
+            process.join()
+    return elapsed, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--operations', type=int, default=500)
+    options = parser.parse_args()
+    print(
+        f'{options.writers} писателей по {options.operations} транзакций, '
+        f'{options.readers} читателей'
+    )
+    for label, tuned in (('до', False), ('после', True)):
+        elapsed, totals = run(
+            tuned, options.writers, options.readers, options.operations
+        )
+        writes, write_errors = totals['write']
+        reads, read_errors = totals['read']
+        print(
+            f'{label:>6}: {writes / elapsed:8.0f} записей/с, '
+            f'{reads / elapsed:8.0f} чтений/с, '
+            f'ошибок блокировки: {write_errors + read_errors}, '
+            f'{elapsed:.2f} с'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,55 @@
 from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
-from .models import Note
+from .models import Note, ProfileDump
 
 admin.site.register(Note)
+
+
+@admin.register(ProfileDump)
+class ProfileDumpAdmin(admin.ModelAdmin):
+    """Профили запросов: только просмотр, скачивание и удаление."""
+    list_display = (
+        'created', 'view_name', 'path', 'user', 'format', 'duration', 'size',
+        'download',
+    )
+    list_filter = ('view_name', 'format')
+    search_fields = ('view_name', 'path')
+    list_select_related = ('user',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:pk>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='notes_profiledump_download',
+            ),
+        ] + super().get_urls()
+
+    @admin.display(description='Файл')
+    def download(self, dump):
+        return format_html(
+            '<a href="{}">{}</a>',
+            reverse('admin:notes_profiledump_download', args=(dump.pk,)),
+            dump.file_name,
+        )
+
+    def download_view(self, request, pk):
+        if not self.has_view_permission(request):
+            raise Http404
+        dump = get_object_or_404(ProfileDump, pk=pk)
+        if not dump.file_path.exists():
+            raise Http404('Файл профиля удалён.')
+        return FileResponse(
+            dump.file_path.open('rb'), as_attachment=True,
+            filename=dump.file_name,
+        )
@@ -0,0 +1,179 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers import asgi
+from django.db import connections
+
+# Метрики текущего запроса (notes.metrics) для SQL в потоках run_db.
+current_metrics = contextvars.ContextVar('current_metrics', default=None)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Пул из ASYNC_DB_WORKERS потоков для работы с базой под ASGI."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Потоки не переживают fork: дочернему процессу нужен свой пул.
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                settings.ASYNC_DB_WORKERS, thread_name_prefix='yanote-db'
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Выполняет синхронный func в пуле get_executor, не блокируя цикл событий.
+
+    Потоков не больше ASYNC_DB_WORKERS, и у каждого своё постоянное
+    соединение с базой: сколько бы клиентов ни ждало, к базе обращаются
+    не больше ASYNC_DB_WORKERS запросов одновременно. Контекстные
+    переменные (реплики, метрики) передаются в поток.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(),
+        partial(context.run, call_in_worker, func, args, kwargs),
+    )
+
+
+def call_in_worker(func, args, kwargs):
+    metrics = current_metrics.get()
+    try:
+        with ExitStack() as stack:
+            if metrics is not None:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+            return func(*args, **kwargs)
+    finally:
+        for connection in connections.all():
+            # Соединения потоков постоянные: закрываются только сломанные.
+            if connection.connection is None:
+                continue
+            if connection.errors_occurred:
+                if connection.is_usable():
+                    connection.errors_occurred = False
+                else:
+                    connection.close()
+
+
+def render_view(view, request, args, kwargs):
+    """Вызывает синхронное представление и сразу рендерит его шаблон."""
+    response = view(request, *args, **kwargs)
+    if callable(getattr(response, 'render', None)) and not (
+        response.is_rendered
+    ):
+        started = time.perf_counter()
+        response.render()
+        metrics = getattr(request, 'metrics', None)
+        if metrics is not None:
+            metrics.render_time = time.perf_counter() - started
+    return response
+
+
+def as_async_view(view_class, **initkwargs):
+    """
+    Асинхронный вариант представления view_class для ASGI.
+
+    Django 3.2 не умеет асинхронные запросы к базе и асинхронные
+    class-based views, поэтому представление вместе с рендерингом шаблона
+    выполняется одним вызовом run_db. Цикл событий тем временем
+    обслуживает остальные соединения, а медленный клиент не занимает поток.
+    """
+    view = view_class.as_view(**initkwargs)
+
+    async def async_view(request, *args, **kwargs):
+        return await run_db(render_view, view, request, args, kwargs)
+
+    async_view.view_class = view_class
+    async_view.view_initkwargs = initkwargs
+    async_view.__doc__ = view_class.__doc__
+    async_view.__module__ = view_class.__module__
+    async_view.__name__ = view_class.__name__
+    return async_view
+
+
+class HybridMiddleware:
+    """
+    Основа middleware, работающих и под WSGI, и под ASGI.
+
+    Под ASGI Django передаёт асинхронный get_response, и запрос
+    обрабатывает __acall__ подкласса без перехода в отдельный поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Так Django 3.2 узнаёт, что экземпляр нужно await-ить.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    ASGIHandler, который умеет асинхронные потоковые ответы.
+
+    Django 3.2 перебирает потоковый ответ синхронно прямо в цикле событий,
+    где запросы к базе запрещены. Если у ответа есть async_content —
+    асинхронный итератор байтов, — отправляется он, а синхронное
+    содержимое ответа остаётся для WSGI.
+    """
+
+    async def send_response(self, response, send):
+        content = getattr(response, 'async_content', None)
+        if content is None:
+            return await super().send_response(response, send)
+        headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()
+        ] + [
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        ]
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+        try:
+            async for chunk in content:
+                await send({
+                    'type': 'http.response.body', 'body': chunk,
+                    'more_body': True,
+                })
+            await send({'type': 'http.response.body'})
+        finally:
+            await content.aclose()
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    """Как django.core.asgi.get_asgi_application, но с ASGIHandler выше."""
+    django.setup(set_prefix=False)
+    return ASGIHandler()
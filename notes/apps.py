@@ -1,6 +1,29 @@
 from django.apps import AppConfig
+from django.core.checks import register
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
 
 
 class NotesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notes'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+
+        from . import auth, checks, db, profiling, sessions, sharding
+
+        register(checks.check_session_cache)
+        register(checks.check_shard_cache)
+        connection_created.connect(db.apply_sqlite_pragmas)
+        request_started.connect(db.check_connection_health)
+        request_finished.connect(sessions.flush_sessions)
+        post_save.connect(auth.bump_user, sender=get_user_model())
+        post_delete.connect(auth.bump_user, sender=get_user_model())
+        pre_delete.connect(
+            sharding.delete_author_notes, sender=get_user_model()
+        )
+        post_delete.connect(
+            profiling.delete_dump_file, sender=self.get_model('ProfileDump')
+        )
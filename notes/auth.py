@@ -0,0 +1,110 @@
+import pickle
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from .aio import run_db
+from .cache import bump_auth_stamp, get_auth_stamp, is_shared, notes_cache
+from .sharding import sharding_enabled
+
+USER_KEY = 'notes:user:{}:{}'
+
+
+def bump_user(sender, instance, **kwargs):
+    """Сбрасывает закешированного пользователя при сохранении и удалении."""
+    bump_auth_stamp(instance.pk)
+
+
+class StatsModelBackend(ModelBackend):
+    """
+    ModelBackend, который читает пользователя вместе со статистикой его
+    заметок (AuthorStats) одним запросом. Кеш get_user хранит их вместе,
+    а запись заметок сбрасывает этот кеш.
+
+    С шардами статистика лежит на шарде автора и читается отдельным
+    запросом при первом обращении.
+    """
+
+    def get_user(self, user_id):
+        users = auth.get_user_model()._default_manager
+        if not sharding_enabled():
+            users = users.select_related('note_stats')
+        try:
+            user = users.get(pk=user_id)
+        except users.model.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+def get_user(request):
+    """
+    Пользователь сессии без запроса к auth_user.
+
+    Из сессии берутся id, бэкенд и хеш пароля, как в auth.get_user, а сам
+    пользователь — из кеша по ключу с версией учётной записи. Любое
+    сохранение пользователя (смена пароля, last_login при входе) повышает
+    версию, и следующий запрос прочитает строку из базы. Хеш пароля в
+    сессии сверяется с закешированным пользователем; при расхождении
+    решение принимает auth.get_user, который сбросит сессию.
+
+    Кеш процесса не видит версий, повышенных в других процессах, поэтому
+    без общего кеша пользователь всегда читается из базы.
+    """
+    if not is_shared():
+        return auth.get_user(request)
+    try:
+        user_id = auth._get_user_session_key(request)
+        backend = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+    cache = notes_cache()
+    # Версия читается до загрузки: если пользователя изменят между
+    # чтением и записью в кеш, устаревшая копия ляжет под старый ключ.
+    key = USER_KEY.format(user_id, get_auth_stamp(user_id))
+    data = cache.get(key)
+    if data is not None:
+        user = pickle.loads(data)
+        session_hash = request.session.get(auth.HASH_SESSION_KEY)
+        if session_hash and constant_time_compare(
+            session_hash, user.get_session_auth_hash()
+        ):
+            return user
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        cache.set(
+            key, pickle.dumps(user, pickle.HIGHEST_PROTOCOL),
+            settings.NOTES_OBJECT_TIMEOUT,
+        )
+    return user
+
+
+def get_cached_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = get_user(request)
+    return request._cached_user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware, берущий пользователя из кеша (get_user).
+
+    Под ASGI пользователь сессии загружается заранее в пуле run_db, чтобы
+    обращение к request.user не блокировало цикл событий.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_cached_user(request))
+
+    async def __acall__(self, request):
+        self.process_request(request)
+        if request.session.session_key is not None:
+            await run_db(get_cached_user, request)
+        return await self.get_response(request)
@@ -0,0 +1,169 @@
+from django.db import IntegrityError, router
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sharding
+from .forms import NoteForm
+from .models import Note
+from .slugs import base_slug, pick_slug, prefix_filter, slug_owners
+
+ACTIONS = ('create', 'update', 'delete')
+MAX_OPERATIONS = 1000
+
+
+class BatchError(Exception):
+    """Пакет целиком не может быть применён."""
+
+
+class BatchConflict(BatchError):
+    """Пакет конфликтует с параллельными изменениями, его можно повторить."""
+
+
+class NoteBatch:
+    """
+    Пакет операций над заметками одного автора.
+
+    Все операции проверяются по правилам NoteForm, а затем применяются в
+    одной транзакции массовыми запросами. Если хотя бы одна операция
+    некорректна, не применяется ничего.
+    """
+
+    def __init__(self, author, operations):
+        if not isinstance(operations, list):
+            raise BatchError('Ожидается список операций.')
+        if len(operations) > MAX_OPERATIONS:
+            raise BatchError(
+                f'Не больше {MAX_OPERATIONS} операций в одном пакете.'
+            )
+        self.author = author
+        self.operations = operations
+        self.results = []
+        self.creates, self.updates, self.deletes = [], [], []
+
+    def load(self):
+        """Два запроса на весь пакет: заметки автора и занятые slug."""
+        slugs, new_slugs = set(), set()
+        for operation in self.operations:
+            if not isinstance(operation, dict):
+                continue
+            slugs.add(str(operation.get('slug')))
+            data = operation.get('data')
+            if isinstance(data, dict):
+                new_slugs.add(str(data.get('slug')))
+        self.notes = {
+            note.slug: note
+            for note in Note.objects.for_author(self.author).filter(
+                slug__in=slugs
+            )
+        }
+        self.slug_owners = slug_owners(
+            Note, Q(slug__in=new_slugs), self.author
+        )
+        self.max_slug_length = Note._meta.get_field('slug').max_length
+        self.loaded_bases = set()
+
+    def free_slug(self, title):
+        """Свободный slug из заголовка: один запрос на каждую основу."""
+        base = base_slug(title, self.max_slug_length)
+        if base not in self.loaded_bases:
+            self.loaded_bases.add(base)
+            owners = slug_owners(
+                Note, prefix_filter(base, self.max_slug_length), self.author
+            )
+            for slug, pk in owners.items():
+                self.slug_owners.setdefault(slug, pk)
+        return pick_slug(base, self.slug_owners, self.max_slug_length)
+
+    def validate(self, index, operation):
+        """Проверяет операцию; возвращает (ошибки или None, заметка)."""
+        if not isinstance(operation, dict):
+            return {'__all__': ['Операция должна быть объектом.']}, None
+        action = operation.get('action')
+        if action not in ACTIONS:
+            return {
+                'action': [f'Допустимые действия: {", ".join(ACTIONS)}.']
+            }, None
+        note = None
+        if action != 'create':
+            note = self.notes.pop(str(operation.get('slug')), None)
+            if note is None:
+                # Заметки нет или она уже встречалась в этом пакете.
+                return {'slug': ['Заметка не найдена.']}, None
+        if action == 'delete':
+            self.deletes.append(note)
+            self.release_slug(note)
+            return None, note
+        return self.validate_data(index, action, note, operation.get('data'))
+
+    def validate_data(self, index, action, note, data):
+        """Проверяет поля заметки для create и update по NoteForm."""
+        if not isinstance(data, dict):
+            return {'data': ['Ожидается объект с полями заметки.']}, None
+        old_slug = note and note.slug
+        form = NoteForm(data, instance=note, slug_owners=self.slug_owners)
+        if not form.is_valid():
+            return {
+                field: list(errors) for field, errors in form.errors.items()
+            }, None
+        note = form.save(commit=False)
+        if not note.slug:
+            note.slug = self.free_slug(note.title)
+        if action == 'create':
+            note.author = self.author
+            self.creates.append(note)
+            self.slug_owners[note.slug] = ('create', index)
+        else:
+            if note.slug != old_slug:
+                self.release_slug(note, old_slug)
+            note.updated = timezone.now()
+            self.updates.append(note)
+            self.slug_owners[note.slug] = note.pk
+        return None, note
+
+    def release_slug(self, note, slug=None):
+        slug = slug or note.slug
+        if self.slug_owners.get(slug) == note.pk:
+            del self.slug_owners[slug]
+
+    def apply(self):
+        """Возвращает (применён ли пакет, результаты по операциям)."""
+        self.load()
+        notes = []
+        for index, operation in enumerate(self.operations):
+            errors, note = self.validate(index, operation)
+            notes.append(note)
+            result = {
+                'index': index,
+                'action': (
+                    operation.get('action')
+                    if isinstance(operation, dict) else None
+                ),
+                'status': 'ok' if errors is None else 'error',
+            }
+            if errors:
+                result['errors'] = errors
+            self.results.append(result)
+        if any(result['status'] == 'error' for result in self.results):
+            return False, self.results
+        # С шардами транзакция открывается на шарде автора.
+        using = router.db_for_write(Note, author_id=self.author.pk)
+        queryset = Note.objects.using(using)
+        try:
+            with sharding.atomic(using):
+                if self.deletes:
+                    queryset.filter(
+                        pk__in=[note.pk for note in self.deletes]
+                    ).delete()
+                if self.updates:
+                    queryset.bulk_update(
+                        self.updates, ('title', 'text', 'slug', 'updated')
+                    )
+                if self.creates:
+                    queryset.bulk_create(self.creates)
+        except IntegrityError:
+            raise BatchConflict(
+                'Slug заняли параллельным запросом, повторите пакет.'
+            )
+        for result, note in zip(self.results, notes):
+            result['slug'] = note.slug
+        return True, self.results
@@ -0,0 +1,137 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .db import reading_replicas
+
+VERSION_KEY = 'notes:version:{}'
+AUTH_STAMP_KEY = 'notes:auth-stamp:{}'
+
+# Бэкенды, у которых в каждом процессе свой кеш.
+PROCESS_CACHES = (LocMemCache, DummyCache)
+
+
+def notes_cache():
+    """Кеш для отрендеренных фрагментов и версий заметок пользователей."""
+    return caches[settings.NOTES_CACHE]
+
+
+def is_shared(alias=None):
+    """
+    Виден ли кеш alias (по умолчанию NOTES_CACHE) всем процессам.
+
+    В кеше процесса нельзя держать то, что должен сбрасывать другой
+    процесс: сессии, пользователей, версии заметок.
+    """
+    return not isinstance(
+        caches[alias or settings.NOTES_CACHE], PROCESS_CACHES
+    )
+
+
+def get_notes_version(user_id):
+    """
+    Текущая версия заметок пользователя.
+
+    Версия входит в ключи закешированных фрагментов: при её изменении старые
+    фрагменты просто перестают читаться. Начальное значение берётся из
+    времени, чтобы после вытеснения ключа из кеша версия не совпала с одной
+    из прежних.
+    """
+    return get_version(VERSION_KEY.format(user_id))
+
+
+def bump_notes_version(user_id):
+    """Инвалидирует все закешированные фрагменты заметок пользователя."""
+    bump_version(VERSION_KEY.format(user_id))
+
+
+def get_auth_stamp(user_id):
+    """Версия учётной записи: меняется при каждом сохранении пользователя."""
+    return get_version(AUTH_STAMP_KEY.format(user_id))
+
+
+def bump_auth_stamp(user_id):
+    bump_version(AUTH_STAMP_KEY.format(user_id))
+
+
+def get_version(key):
+    cache = notes_cache()
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        cache.add(key, version, timeout=None)
+        version = cache.get(key, version)
+    return version
+
+
+def bump_version(key):
+    cache = notes_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def versioned_key(user_id, name):
+    """Ключ кеша, который устаревает вместе с версией заметок пользователя."""
+    return f'notes:{name}:{user_id}:{get_notes_version(user_id)}'
+
+
+class LRUCache:
+    """Кеш процесса на NOTES_OBJECT_CACHE_SIZE ключей: лишние вытесняются."""
+
+    def __init__(self):
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > settings.NOTES_OBJECT_CACHE_SIZE:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+local_notes = LRUCache()
+
+
+def get_note(author_id, slug, load):
+    """
+    Заметка автора по slug: из кеша процесса, затем из общего кеша, и
+    только потом load() из базы.
+
+    Ключ содержит версию заметок автора, а Note.save и удаление её
+    повышают, так что изменённая заметка не будет прочитана ни из одного
+    уровня. Заметки хранятся сериализованными: каждый вызов получает свой
+    экземпляр, и правка формы не портит закешированный. Заметка,
+    прочитанная с реплики, в кеши не попадает (см. reading_replicas).
+    """
+    key = versioned_key(author_id, f'note:{slug}')
+    data = local_notes.get(key)
+    if data is None:
+        cache = notes_cache()
+        data = cache.get(key)
+        if data is None:
+            if reading_replicas():
+                return load()
+            data = pickle.dumps(load(), pickle.HIGHEST_PROTOCOL)
+            cache.set(key, data, settings.NOTES_OBJECT_TIMEOUT)
+        local_notes.set(key, data)
+    return pickle.loads(data)
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.checks import Error
+
+from .cache import is_shared
+
+
+def check_session_cache(app_configs, **kwargs):
+    """Сессии notes.sessions должны лежать в кеше, общем для процессов."""
+    if (
+        settings.SESSION_ENGINE != 'notes.sessions'
+        or is_shared(settings.SESSION_CACHE_ALIAS)
+    ):
+        return []
+    return [Error(
+        'Сессии notes.sessions хранятся в кеше процесса: выход и смена '
+        'пароля в одном процессе не дойдут до остальных.',
+        hint=(
+            'Задайте общий кеш (YANOTE_CACHE_DIR) или SESSION_ENGINE '
+            "'django.contrib.sessions.backends.db'."
+        ),
+        id='notes.E001',
+    )]
+
+
+def check_shard_cache(app_configs, **kwargs):
+    """Каталог шардов должен кешироваться в кеше, общем для процессов."""
+    if not settings.NOTE_SHARDS or is_shared():
+        return []
+    return [Error(
+        'Шард автора кешируется в кеше процесса: после rebalance_shards '
+        'остальные процессы продолжат писать на прежний шард.',
+        hint='Задайте общий кеш (YANOTE_CACHE_DIR).',
+        id='notes.E002',
+    )]
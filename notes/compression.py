@@ -0,0 +1,100 @@
+import gzip
+
+import brotli
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .aio import HybridMiddleware
+
+# Кодировки в порядке предпочтения при равном q и суффиксы их файлов.
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+
+
+def compress(data, encoding, best=False):
+    """
+    Сжимает data кодировкой encoding.
+
+    best — максимальное сжатие для статики, которая сжимается один раз
+    при collectstatic; ответы сжимаются быстрее и чуть хуже.
+    """
+    if encoding == 'br':
+        quality = 11 if best else settings.RESPONSE_BROTLI_QUALITY
+        return brotli.compress(data, quality=quality)
+    level = 9 if best else settings.RESPONSE_GZIP_LEVEL
+    # mtime=0: одинаковые данные дают одинаковый результат.
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с их весами q."""
+    weights = {}
+    for item in header.split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        if not name:
+            continue
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.lower()] = weight
+    return weights
+
+
+def negotiate(header, available=tuple(ENCODINGS)):
+    """Лучшая из кодировок available, которую принимает клиент, или None."""
+    weights = accepted_encodings(header)
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressionMiddleware(HybridMiddleware):
+    """
+    Сжимает текстовые ответы brotli или gzip по заголовку Accept-Encoding.
+
+    Сжимаются только готовые (не потоковые) ответы от
+    RESPONSE_COMPRESS_MIN_SIZE байт: выгрузки и статика отдаются как есть
+    или уже сжатыми. ETag становится слабым, как у GZipMiddleware, так что
+    условные запросы продолжают работать.
+    """
+
+    def handle(self, request):
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0]
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or content_type not in COMPRESSIBLE_TYPES
+            or len(response.content) < settings.RESPONSE_COMPRESS_MIN_SIZE
+        ):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        content = compress(response.content, encoding)
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
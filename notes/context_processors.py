@@ -0,0 +1,22 @@
+from django.conf import settings
+
+from .cache import get_notes_version
+from .db import reading_replicas
+
+
+def notes_cache(request):
+    """Параметры кеширования фрагментов для шаблонов."""
+    def notes_version():
+        # Вызывается шаблоном лениво, только если фрагмент кешируется.
+        if not request.user.is_authenticated:
+            return 0
+        return get_notes_version(request.user.pk)
+
+    return {
+        'notes_cache_alias': settings.NOTES_CACHE,
+        'notes_version': notes_version,
+        # Фрагмент, собранный по данным реплики, не сохраняется: таймаут 0.
+        'notes_fragment_timeout': (
+            0 if reading_replicas() else settings.NOTES_FRAGMENT_TIMEOUT
+        ),
+    }
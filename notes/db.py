@@ -0,0 +1,124 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from .aio import HybridMiddleware
+
+REPLICA_PIN_COOKIE = 'replica_pin'
+
+# Можно ли читать заметки с реплики в текущем запросе.
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+def reading_replicas():
+    """
+    Идут ли чтения заметок в текущем контексте на реплики.
+
+    Прочитанное с реплики не кладётся в общий кеш и кеш процесса: реплика
+    может отставать, а под текущей версией заметок автора устаревшие строки
+    отдавались бы до истечения кеша, в том числе другим устройствам автора,
+    у которых нет cookie REPLICA_PIN_COOKIE.
+    """
+    return bool(settings.DATABASE_REPLICAS) and replica_reads.get()
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Настраивает каждое новое соединение с SQLite по SQLITE_PRAGMAS."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def check_connection_health(sender, **kwargs):
+    """
+    Закрывает неработающие постоянные соединения в начале запроса.
+
+    Django 3.2 проверяет постоянное соединение только после ошибки в нём;
+    с DB_HEALTH_CHECKS проверка выполняется перед каждым запросом.
+    """
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+class ReplicaRouter:
+    """
+    Отправляет чтение заметок на реплики из DATABASE_REPLICAS.
+
+    Реплики используются только внутри запросов, которые разрешил
+    ReplicaMiddleware; запись, сессии и пользователи всегда идут в
+    основную базу. Прочитанное с реплик не кешируется, см.
+    reading_replicas.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'notes' and reading_replicas():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaMiddleware(HybridMiddleware):
+    """
+    Разрешает чтение с реплик для представлений с replica_reads = True.
+
+    После успешного изменяющего запроса клиент на REPLICA_PIN_SECONDS
+    получает cookie, и его чтения идут в основную базу: так пользователь
+    всегда видит собственные изменения, даже если реплика отстаёт.
+    """
+
+    def handle(self, request):
+        request.replica_token = None
+        try:
+            response = self.get_response(request)
+        finally:
+            self.reset(request)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        request.replica_token = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.reset(request)
+        return self.pin(request, response)
+
+    def reset(self, request):
+        if request.replica_token is None:
+            return
+        try:
+            replica_reads.reset(request.replica_token)
+        except ValueError:
+            # Под ASGI process_view выполняется в потоке с копией контекста.
+            replica_reads.set(False)
+
+    def pin(self, request, response):
+        if (
+            request.method not in ('GET', 'HEAD', 'OPTIONS')
+            and response.status_code < 400
+        ):
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        if (
+            request.method in ('GET', 'HEAD')
+            and getattr(view_class, 'replica_reads', False)
+            and REPLICA_PIN_COOKIE not in request.COOKIES
+        ):
+            request.replica_token = replica_reads.set(True)
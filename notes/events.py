@@ -0,0 +1,367 @@
+import asyncio
+import json
+import queue
+import threading
+from collections import defaultdict
+from functools import partial
+from importlib import import_module
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from .aio import run_db
+from .auth import get_user
+
+LAST_EVENT_ID_HEADER = 'Last-Event-ID'
+# Через сколько миллисекунд браузер переподключается после обрыва.
+RETRY = b'retry: 3000\n\n'
+HEARTBEAT = b': heartbeat\n\n'
+# Сколько изменений читать за запрос при догоне из базы.
+REPLAY_PAGE_SIZE = 200
+EVENT_FIELDS = ('id', 'slug', 'title', 'revision')
+STREAM_HEADERS = {
+    'Content-Type': 'text/event-stream; charset=utf-8',
+    'Cache-Control': 'no-cache',
+    # nginx не должен буферизовать поток.
+    'X-Accel-Buffering': 'no',
+}
+# Ключ scope, которым EventsApplication сообщает адрес потока приложению.
+SCOPE_KEY = 'yanote.events'
+
+
+class LocalBroker:
+    """
+    Pub/sub в памяти процесса: канал — id автора.
+
+    Подписчик передаёт callback, который вызывается в потоке публикации
+    и не должен блокироваться. Брокер выбирается настройкой EVENTS_BROKER:
+    для нескольких процессов её можно заменить классом с теми же
+    subscribe и publish поверх внешнего брокера.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel, callback):
+        """Подписывает callback на канал; возвращает функцию отписки."""
+        with self.lock:
+            self.subscribers[channel].add(callback)
+        return partial(self.unsubscribe, channel, callback)
+
+    def unsubscribe(self, channel, callback):
+        with self.lock:
+            callbacks = self.subscribers.get(channel)
+            if callbacks is None:
+                return
+            callbacks.discard(callback)
+            if not callbacks:
+                del self.subscribers[channel]
+
+    def publish(self, channel, event):
+        with self.lock:
+            callbacks = list(self.subscribers.get(channel, ()))
+        for callback in callbacks:
+            callback(event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENTS_BROKER)()
+        return _broker
+
+
+def note_event(kind, note):
+    """Событие create или update; note — заметка или строка values()."""
+    get = note.get if isinstance(note, dict) else partial(getattr, note)
+    return {
+        'id': get('revision'),
+        'event': kind,
+        'data': {
+            'id': get('id'),
+            'slug': get('slug'),
+            'title': get('title'),
+            'revision': get('revision'),
+            'url': reverse('notes:detail', args=(get('slug'),)),
+        },
+    }
+
+
+def delete_event(slug, revision):
+    return {
+        'id': revision,
+        'event': 'delete',
+        'data': {'slug': slug, 'revision': revision},
+    }
+
+
+def publish(using, author_id, events):
+    """
+    Публикует события автора после коммита транзакции в базе using.
+
+    При откате ничего не публикуется, а номера изменений в событиях идут
+    в том же порядке, в каком изменения зафиксированы.
+    """
+    events = list(events)
+    if events:
+        transaction.on_commit(
+            partial(broadcast, author_id, events), using=using
+        )
+
+
+def broadcast(author_id, events):
+    broker = get_broker()
+    for event in events:
+        broker.publish(author_id, event)
+
+
+def encode(event):
+    return (
+        f'id: {event["id"]}\n'
+        f'event: {event["event"]}\n'
+        f'data: {json.dumps(event["data"], ensure_ascii=False)}\n\n'
+    ).encode()
+
+
+def parse_last_event_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+class EventStream:
+    """
+    Поток событий одного подписчика.
+
+    Номера событий — номера изменений из ленты синхронизации, поэтому после
+    обрыва браузер присылает Last-Event-ID и получает пропущенное из базы
+    (changes_since). Из базы же поток догоняет, если живое событие пришло
+    не по порядку (публикации разных процессов и потоков могут обгонять
+    друг друга) или очередь подписчика переполнилась: изменения в базе
+    зафиксированы раньше, чем опубликованы. Из базы заметки приходят
+    событием update, удаления — delete.
+    """
+
+    def __init__(self, notes, author, last_id=None):
+        self.notes = notes
+        self.author = author
+        self.last_id = last_id
+        self.lagged = False
+
+    def catch_up(self):
+        """
+        Закодированные события после last_id из базы. Без Last-Event-ID
+        поток начинается с текущего номера изменений автора.
+        """
+        from .models import ChangeCounter
+        from .sync import changes_since
+
+        if self.last_id is None:
+            self.last_id = ChangeCounter.objects.using(self.notes.db).filter(
+                author=self.author
+            ).values_list('value', flat=True).first() or 0
+            return []
+        chunks = []
+        while True:
+            page = changes_since(
+                self.notes, self.author, self.last_id, REPLAY_PAGE_SIZE,
+                fields=EVENT_FIELDS,
+            )
+            events = [note_event('update', row) for row in page['notes']]
+            events += [
+                delete_event(row['slug'], row['revision'])
+                for row in page['deleted']
+            ]
+            chunks += [
+                encode(event)
+                for event in sorted(events, key=lambda event: event['id'])
+            ]
+            self.last_id = int(page['next'])
+            if not page['has_more']:
+                return chunks
+
+    def accept(self, event):
+        """
+        True — событие следующее по порядку, его нужно отправить;
+        False — уже отправлено; None — нужен catch_up: событие пришло с
+        пропуском или очередь подписчика переполнялась.
+        """
+        if self.lagged:
+            self.lagged = False
+            return None
+        if event['id'] <= self.last_id:
+            return False
+        if event['id'] > self.last_id + 1:
+            return None
+        self.last_id = event['id']
+        return True
+
+    def __iter__(self):
+        """Синхронный поток для WSGI: занимает поток сервера, пока открыт."""
+        events = queue.Queue(settings.EVENTS_QUEUE_SIZE)
+
+        def deliver(event):
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                self.lagged = True
+
+        unsubscribe = get_broker().subscribe(self.author.pk, deliver)
+        try:
+            yield RETRY
+            yield from self.catch_up()
+            while True:
+                try:
+                    event = events.get(
+                        timeout=settings.EVENTS_HEARTBEAT_SECONDS
+                    )
+                except queue.Empty:
+                    yield HEARTBEAT
+                    continue
+                accepted = self.accept(event)
+                if accepted is None:
+                    yield from self.catch_up()
+                elif accepted:
+                    yield encode(event)
+        finally:
+            unsubscribe()
+
+    async def stream(self, send, receive):
+        """Асинхронный поток для ASGI: ждёт событий в цикле событий."""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def put(event):
+            if events.qsize() >= settings.EVENTS_QUEUE_SIZE:
+                self.lagged = True
+            else:
+                events.put_nowait(event)
+
+        unsubscribe = get_broker().subscribe(
+            self.author.pk,
+            lambda event: loop.call_soon_threadsafe(put, event),
+        )
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            await write(send, RETRY, *await run_db(self.catch_up))
+            while True:
+                event = await wait_event(events, disconnect)
+                if disconnect.done():
+                    return
+                if event is None:
+                    await write(send, HEARTBEAT)
+                    continue
+                accepted = self.accept(event)
+                if accepted is None:
+                    await write(send, *await run_db(self.catch_up))
+                elif accepted:
+                    await write(send, encode(event))
+        finally:
+            unsubscribe()
+            disconnect.cancel()
+
+
+async def write(send, *chunks):
+    for chunk in chunks:
+        await send({
+            'type': 'http.response.body', 'body': chunk, 'more_body': True,
+        })
+
+
+async def wait_event(events, disconnect):
+    """Следующее событие или None, если пора слать heartbeat."""
+    getter = asyncio.ensure_future(events.get())
+    await asyncio.wait(
+        (getter, disconnect), timeout=settings.EVENTS_HEARTBEAT_SECONDS,
+        return_when=asyncio.FIRST_COMPLETED,
+    )
+    if getter.done():
+        return getter.result()
+    getter.cancel()
+    return None
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def events_url(request):
+    """
+    Адрес потока для страницы или None, если подписываться не стоит.
+
+    Под WSGI каждый подписчик держит поток сервера, поэтому поток
+    включается, только если запрос пришёл через EventsApplication или
+    задан EVENTS_WSGI.
+    """
+    scope = getattr(request, 'scope', {})
+    if SCOPE_KEY in scope:
+        return scope[SCOPE_KEY]
+    if settings.EVENTS_WSGI:
+        return reverse('notes:events')
+    return None
+
+
+def authenticate(request):
+    """Пользователь ASGI-запроса по cookie сессии, как в middleware."""
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    return get_user(request)
+
+
+class EventsApplication:
+    """
+    ASGI-приложение: поток событий (notes:events) обслуживается прямо в
+    цикле событий, остальные запросы передаются application.
+
+    Django 3.2 итерирует потоковый ответ синхронно внутри цикла событий,
+    поэтому представление NoteEvents под ASGI не используется: здесь
+    соединение подписчика не занимает ни поток, ни соединение с базой
+    (в базу ходят только аутентификация и догон через run_db).
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.path = None
+
+    async def __call__(self, scope, receive, send):
+        if self.path is None:
+            self.path = reverse('notes:events')
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.application(
+                {**scope, SCOPE_KEY: self.path}, receive, send
+            )
+        request = ASGIRequest(scope, BytesIO())
+        user = await run_db(authenticate, request)
+        if not user.is_authenticated:
+            await send({'type': 'http.response.start', 'status': 403})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        from .models import Note
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (name.lower().encode(), value.encode())
+                for name, value in STREAM_HEADERS.items()
+            ],
+        })
+        await EventStream(
+            Note.objects.for_author(user), user,
+            parse_last_event_id(request.headers.get(LAST_EVENT_ID_HEADER)),
+        ).stream(send, receive)
+        await send({'type': 'http.response.body', 'body': b''})
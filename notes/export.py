@@ -0,0 +1,120 @@
+import io
+import json
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .aio import run_db
+
+EXPORT_FIELDS = ('slug', 'title', 'text', 'created', 'updated')
+CHUNK_SIZE = 500
+
+
+class StreamBuffer(io.RawIOBase):
+    """Файлоподобный приёмник, из которого записанное забирается кусками."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def fetch_notes(queryset, after):
+    """
+    Следующие CHUNK_SIZE заметок с id больше after. Читаются только
+    выгружаемые поля: HTML текста сжат и по объёму сравним с самим текстом.
+    """
+    return list(
+        queryset.only('id', *EXPORT_FIELDS).filter(
+            id__gt=after
+        ).order_by('id')[:CHUNK_SIZE]
+    )
+
+
+class JsonlWriter:
+    """Заметки по одной JSON-строке."""
+
+    def write(self, notes):
+        return b''.join(
+            json.dumps(
+                {field: getattr(note, field) for field in EXPORT_FIELDS},
+                cls=DjangoJSONEncoder, ensure_ascii=False,
+            ).encode() + b'\n'
+            for note in notes
+        )
+
+    def close(self):
+        return b''
+
+
+def note_markdown(note):
+    return f'# {note.title}\n\n{note.text}\n'
+
+
+class ZipWriter:
+    """
+    ZIP-архив с заметкой в Markdown на файл.
+
+    Архив пишется в поток без перемотки, поэтому каждая порция файлов
+    отдаётся клиенту сразу после сжатия, а память не зависит от числа
+    заметок.
+    """
+
+    def __init__(self):
+        self.buffer = StreamBuffer()
+        self.archive = zipfile.ZipFile(self.buffer, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, notes):
+        for note in notes:
+            info = zipfile.ZipInfo(
+                f'{note.slug}.md', date_time=note.updated.timetuple()[:6]
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self.archive.writestr(info, note_markdown(note))
+        return self.buffer.pop()
+
+    def close(self):
+        self.archive.close()
+        return self.buffer.pop()
+
+
+def write_chunk(writer, queryset, after):
+    """
+    Читает и записывает следующую порцию заметок. Возвращает данные и id
+    последней заметки; None вместо id — выгрузка закончена.
+    """
+    notes = fetch_notes(queryset, after)
+    if not notes:
+        return writer.close(), None
+    return writer.write(notes), notes[-1].id
+
+
+def export_notes(writer, queryset):
+    """Выгрузка для WSGI: порции читаются в потоке ответа."""
+    after = 0
+    while after is not None:
+        data, after = write_chunk(writer, queryset, after)
+        if data:
+            yield data
+
+
+async def aexport_notes(writer, queryset):
+    """
+    Выгрузка для ASGI: порции читаются в пуле run_db, а цикл событий
+    только отправляет их клиенту.
+    """
+    after = 0
+    while after is not None:
+        data, after = await run_db(write_chunk, writer, queryset, after)
+        if data:
+            yield data
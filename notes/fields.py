@@ -0,0 +1,89 @@
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+# Первый байт значения в базе: как хранится остальное.
+PLAIN, ZLIB = b'\x00', b'\x01'
+
+
+class Compressed(bytes):
+    """Сжатый текст из базы, который ещё не распаковывали."""
+
+
+def compress(text):
+    """Значение для базы: текст длиннее порога сжимается zlib."""
+    data = text.encode()
+    if len(data) >= settings.NOTE_TEXT_COMPRESS_THRESHOLD:
+        packed = zlib.compress(data, settings.NOTE_TEXT_COMPRESS_LEVEL)
+        if len(packed) < len(data):
+            return ZLIB + packed
+    return PLAIN + data
+
+
+def decompress(value):
+    """Текст из значения в базе, в том числе из ещё не распакованного."""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value[:1] == ZLIB:
+        return zlib.decompress(value[1:]).decode()
+    return value[1:].decode()
+
+
+class CompressedTextAttribute(DeferredAttribute):
+    """Распаковывает текст при первом обращении к атрибуту."""
+
+    # С __set__ дескриптор срабатывает, даже когда значение уже лежит
+    # в __dict__ экземпляра.
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, Compressed):
+            value = instance.__dict__[self.field.attname] = decompress(value)
+        return value
+
+
+class CompressedTextField(models.TextField):
+    """
+    Текстовое поле, которое хранит длинные значения сжатыми.
+
+    В базе это двоичная колонка: тексты от NOTE_TEXT_COMPRESS_THRESHOLD
+    байт сжимаются zlib, короткие хранятся как есть. Сжатое значение
+    распаковывается при первом чтении атрибута, поэтому выборки, которым
+    текст не нужен, не тратят на него время. В формах и шаблонах поле
+    ведёт себя как обычный TextField. Поиск по содержимому средствами
+    базы (text__icontains) для него невозможен.
+    """
+    descriptor_class = CompressedTextAttribute
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if value[:1] == ZLIB:
+            return Compressed(value)
+        return decompress(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress(value)
+        return super().to_python(value)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, Compressed):
+            return value
+        return compress(self.to_python(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        return connection.Database.Binary(value)
@@ -1,29 +1,77 @@
-from pytils.translit import slugify
-
 from django import forms
 from django.core.exceptions import ValidationError
 
-from .models import Note
+from .models import Note, Tag
+from .slugs import slug_queryset
+from .tagging import MAX_TAGS, format_tags, parse_tags
 
 WARNING = ' - такой slug уже существует, придумайте уникальное значение!'
 
 
 class NoteForm(forms.ModelForm):
     """Форма для создания или обновления заметки."""
+    tags = forms.CharField(
+        label='Теги',
+        required=False,
+        help_text='Через запятую, например: работа, идеи',
+    )
 
     class Meta:
         model = Note
         fields = ('title', 'text', 'slug')
 
+    def __init__(self, *args, slug_owners=None, **kwargs):
+        """
+        slug_owners — заранее загруженное соответствие slug → id заметки.
+        Если оно передано, проверка уникальности обходится без запроса.
+        """
+        super().__init__(*args, **kwargs)
+        self.slug_owners = slug_owners
+        if not self.is_bound and self.instance.pk is not None:
+            self.initial['tags'] = format_tags(self.instance.tag_list())
+
+    def slug_taken(self, slug):
+        if self.slug_owners is not None:
+            owner = self.slug_owners.get(slug, self.instance.pk)
+            return owner != self.instance.pk
+        if slug == getattr(self.instance, '_loaded_slug', None):
+            return False
+        return slug_queryset(Note).filter(slug=slug).exists()
+
     def clean_slug(self):
-        """Обрабатывает случай, если slug не уникален."""
-        cleaned_data = super().clean()
-        slug = cleaned_data.get('slug')
-        if not slug:
-            title = cleaned_data.get('title')
-            slug = slugify(title)[:100]
-        if Note.objects.filter(
-                slug=slug
-        ).exclude(id=self.instance.pk).exists():
+        """
+        Обрабатывает случай, если slug не уникален.
+
+        Пустой slug остаётся пустым: свободный адрес из заголовка подберёт
+        Note.save, добавив при необходимости суффикс -2, -3…
+        """
+        slug = self.cleaned_data.get('slug')
+        if slug and self.slug_taken(slug):
             raise ValidationError(slug + WARNING)
         return slug
+
+    def clean_tags(self):
+        names = parse_tags(self.cleaned_data['tags'])
+        if len(names) > MAX_TAGS:
+            raise ValidationError(f'Не больше {MAX_TAGS} тегов.')
+        max_length = Tag._meta.get_field('name').max_length
+        for name in names:
+            if len(name) > max_length:
+                raise ValidationError(
+                    f'Тег «{name}» длиннее {max_length} символов.'
+                )
+        return names
+
+    def save(self, commit=True):
+        # Без поля tags в данных (пакетный API) теги не меняются.
+        if 'tags' in self.data:
+            self.instance.tag_names = self.cleaned_data['tags']
+        return super().save(commit)
+
+    def validate_unique(self):
+        """Уникальность slug уже проверена в clean_slug."""
+        exclude = [*self._get_validation_exclusions(), 'slug']
+        try:
+            self.instance.validate_unique(exclude=exclude)
+        except ValidationError as error:
+            self._update_errors(error)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.cache import is_shared
+
+
+class WriteCommand(BaseCommand):
+    """
+    Команда, которая меняет заметки в отдельном от серверов процессе.
+
+    Версии заметок, которые она повышает, сбрасывают закешированные
+    страницы серверов, только если кеш заметок общий (YANOTE_CACHE_DIR).
+    С кешем процесса команда запускается лишь с --local-cache: тогда
+    серверы должны быть остановлены.
+    """
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            '--local-cache', action='store_true',
+            help=(
+                'Запустить с кешем процесса, когда серверы остановлены и '
+                'их кеш не устареет.'
+            ),
+        )
+        return parser
+
+    def execute(self, *args, **options):
+        if not options['local_cache'] and not is_shared():
+            raise CommandError(
+                'Кеш заметок у каждого процесса свой: запущенные серверы '
+                'не увидят изменений до истечения кеша. Задайте общий кеш '
+                '(YANOTE_CACHE_DIR) или остановите серверы и добавьте '
+                '--local-cache.'
+            )
+        return super().execute(*args, **options)
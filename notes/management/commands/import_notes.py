@@ -0,0 +1,151 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.validators import slug_re
+from django.core.management.base import CommandError
+
+from notes.management.base import WriteCommand
+from notes.models import Note
+from notes.slugs import base_slug, pick_slug, slug_queryset
+
+User = get_user_model()
+ROW_FIELDS = ('author', 'title', 'text', 'slug')
+
+
+def is_valid(row):
+    """Строка файла — объект, и его поля, если заданы, — строки."""
+    return isinstance(row, dict) and all(
+        isinstance(row.get(field), (str, type(None))) for field in ROW_FIELDS
+    )
+
+
+class Command(WriteCommand):
+    help = (
+        'Импортирует заметки из файла JSONL или CSV с полями author '
+        '(username), title, text и необязательным slug.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с заметками.')
+        parser.add_argument(
+            '--format', choices=('jsonl', 'csv'),
+            help='Формат файла; по умолчанию определяется по расширению.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько заметок вставлять одним запросом.',
+        )
+        parser.add_argument(
+            '--offset', type=int, default=0,
+            help='Байтовое смещение, с которого продолжить импорт.',
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or (
+            'csv' if options['path'].endswith('.csv') else 'jsonl'
+        )
+        self.position = committed = options['offset']
+        self.authors = {}
+        # Один запрос на все занятые адреса; дальше slug подбираются в памяти.
+        self.taken = set(
+            slug_queryset(Note).values_list('slug', flat=True).iterator()
+        )
+        imported = skipped = 0
+        started = time.monotonic()
+        try:
+            with open(options['path'], 'rb') as file:
+                rows = (
+                    self.read_csv(file) if file_format == 'csv'
+                    else self.read_jsonl(file)
+                )
+                while True:
+                    batch = list(islice(rows, options['batch_size']))
+                    if not batch:
+                        break
+                    valid = [row for row in batch if is_valid(row)]
+                    self.resolve_authors(valid)
+                    notes = [
+                        note for note in map(self.build_note, valid) if note
+                    ]
+                    skipped += len(batch) - len(notes)
+                    # bulk_create сам пишет заметки каждого шарда в своей
+                    # транзакции и освобождает slug, если она не удалась:
+                    # внешняя транзакция на default накрыла бы только реестр.
+                    Note.objects.bulk_create(notes)
+                    # Пачка читается целиком до вставки, поэтому продолжать
+                    # можно только с конца последней записанной.
+                    committed = self.position
+                    imported += len(notes)
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    self.stdout.write(
+                        f'Импортировано {imported}, пропущено {skipped}, '
+                        f'{imported / elapsed:.0f} заметок/с, '
+                        f'--offset {committed}'
+                    )
+        except (OSError, ValueError) as error:
+            raise CommandError(
+                f'Импорт остановлен на смещении {committed}: {error}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: импортировано {imported}, пропущено {skipped}.'
+        ))
+
+    def build_note(self, row):
+        """
+        Заметка из строки файла или None, если автор неизвестен или текста
+        нет. Недопустимый slug заменяется транслитерацией.
+        """
+        author_id = self.authors.get(row.get('author'))
+        if author_id is None or not row.get('text'):
+            return None
+        max_slug_length = Note._meta.get_field('slug').max_length
+        title = (row.get('title') or '')[
+            :Note._meta.get_field('title').max_length
+        ]
+        slug = (row.get('slug') or '')[:max_slug_length]
+        if not slug_re.match(slug):
+            slug = base_slug(slug or title, max_slug_length)
+        slug = pick_slug(slug, self.taken, max_slug_length)
+        self.taken.add(slug)
+        return Note(
+            title=title, text=row['text'], slug=slug, author_id=author_id,
+        )
+
+    def lines(self, file):
+        """Строки файла; self.position — конец последней прочитанной."""
+        file.seek(self.position)
+        for line in iter(file.readline, b''):
+            self.position = file.tell()
+            yield line.decode('utf-8')
+
+    def read_jsonl(self, file):
+        """Объекты строк; вместо строки с невалидным JSON — None."""
+        for line in self.lines(file):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield None
+
+    def read_csv(self, file):
+        header = next(csv.reader([file.readline().decode('utf-8')]))
+        if self.position == 0:
+            self.position = file.tell()
+        for values in csv.reader(self.lines(file)):
+            yield dict(zip(header, values))
+
+    def resolve_authors(self, batch):
+        """Дополняет кеш username → id одним запросом на пачку."""
+        missing = {
+            row.get('author') for row in batch
+        } - self.authors.keys()
+        if missing:
+            # Неизвестные авторы тоже запоминаются, чтобы не искать их снова.
+            self.authors.update(dict.fromkeys(missing))
+            self.authors.update(
+                User.objects.filter(username__in=missing)
+                .values_list('username', 'id')
+            )
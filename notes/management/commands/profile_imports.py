@@ -0,0 +1,88 @@
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Запускается в отдельном интерпретаторе с -X importtime: загрузка
+# приложения без прогрева, затем прогрев, время этапов — в stdout.
+STARTUP_SCRIPT = '''
+import json, os, time
+os.environ['YANOTE_WARMUP'] = '0'
+started = time.perf_counter()
+import yanote.{target}
+timings = {{'load': time.perf_counter() - started}}
+from notes.warmup import warm_up
+timings.update(warm_up(pool=False))
+print(json.dumps(timings))
+'''
+
+
+def parse_importtime(output):
+    """
+    Строки -X importtime: [(модуль, своё время, время с вложенными
+    импортами)] в секундах.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        'Профилирует холодный старт рабочего процесса: какие модули '
+        'дольше всего импортируются и сколько занимает каждый этап прогрева.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', choices=('wsgi', 'asgi'), default='wsgi',
+            help='Какую точку входа загружать.',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=20,
+            help='Сколько модулей и пакетов показать.',
+        )
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [
+                sys.executable, '-X', 'importtime', '-c',
+                STARTUP_SCRIPT.format(target=options['target']),
+            ],
+            capture_output=True, text=True, cwd=settings.BASE_DIR,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        modules = parse_importtime(result.stderr)
+        packages = defaultdict(float)
+        for name, own, cumulative in modules:
+            packages[name.split('.')[0]] += own
+        limit = options['limit']
+
+        self.stdout.write('Этапы старта, мс:')
+        for stage, seconds in timings.items():
+            self.stdout.write(f'  {stage:<14}{seconds * 1000:>10.1f}')
+        self.stdout.write(
+            f'Импорт: {len(modules)} модулей, '
+            f'{sum(own for _, own, _ in modules) * 1000:.1f} мс.'
+        )
+        self.stdout.write('Пакеты по собственному времени импорта, мс:')
+        for name, own in sorted(
+            packages.items(), key=lambda item: item[1], reverse=True
+        )[:limit]:
+            self.stdout.write(f'  {name:<40}{own * 1000:>10.1f}')
+        self.stdout.write('Модули: время с вложенными импортами и своё, мс:')
+        for name, own, cumulative in sorted(
+            modules, key=lambda module: module[2], reverse=True
+        )[:limit]:
+            self.stdout.write(
+                f'  {name:<40}{cumulative * 1000:>10.1f}{own * 1000:>10.1f}'
+            )
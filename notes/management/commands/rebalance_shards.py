@@ -0,0 +1,21 @@
+from django.core.management.base import CommandError
+
+from notes import sharding
+from notes.management.base import WriteCommand
+
+
+class Command(WriteCommand):
+    help = (
+        'Переносит заметки авторов на шарды, назначенные им кольцом '
+        'консистентного хеширования по текущему NOTE_SHARDS.'
+    )
+
+    def handle(self, *args, **options):
+        if not sharding.sharding_enabled():
+            raise CommandError('Шарды не настроены: задайте YANOTE_SHARDS.')
+        # Заметки, созданные до включения шардов, остаются в default, пока
+        # их авторы не перенесены; их slug тоже должны быть в реестре.
+        sharding.sync_slug_registry()
+        sharding.place_unsharded_authors()
+        moved = sharding.rebalance(self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Перенесено авторов: {moved}.'))
@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+
+from notes import sharding, stats
+from notes.management.base import WriteCommand
+from notes.sharding import DIRECTORY_DB
+
+
+class Command(WriteCommand):
+    help = (
+        'Сверяет статистику авторов (число заметок и объём текстов) с '
+        'заметками и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Скольких авторов сверять в одной транзакции.',
+        )
+
+    def handle(self, *args, **options):
+        checked = fixed = 0
+        for batch in self.batches(options['batch_size']):
+            for using, author_ids in self.by_shard(batch).items():
+                drifted = stats.reconcile(author_ids, using)
+                for author_id in drifted:
+                    self.stdout.write(
+                        f'Исправлена статистика автора {author_id}.'
+                    )
+                fixed += len(drifted)
+            checked += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено авторов: {checked}, исправлено: {fixed}.'
+        ))
+
+    def batches(self, batch_size):
+        """Порции id пользователей по возрастанию."""
+        users = get_user_model().objects.using(DIRECTORY_DB).order_by('pk')
+        last_id = 0
+        while True:
+            batch = list(
+                users.filter(pk__gt=last_id).values_list(
+                    'pk', flat=True
+                )[:batch_size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]
+
+    def by_shard(self, author_ids):
+        if not sharding.sharding_enabled():
+            return {DIRECTORY_DB: author_ids}
+        shards = defaultdict(list)
+        for author_id in author_ids:
+            shards[sharding.shard_for_author(author_id)].append(author_id)
+        return shards
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.db import transaction
+
+from notes import markup
+from notes.cache import bump_notes_version
+from notes.management.base import WriteCommand
+from notes.models import Note
+from notes.sharding import DIRECTORY_DB
+
+
+class Command(WriteCommand):
+    help = (
+        'Перерисовывает HTML заметок, отрендеренный прежней версией '
+        'рендерера Markdown (или всех заметок с --all).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Перерисовать все заметки, а не только устаревшие.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько заметок обрабатывать в одной транзакции.',
+        )
+
+    def handle(self, *args, **options):
+        rendered = 0
+        for using in (DIRECTORY_DB, *settings.NOTE_SHARDS):
+            notes = Note.objects.using(using)
+            if not options['all']:
+                notes = notes.filter(html_version__lt=markup.RENDERER_VERSION)
+            rendered += self.render(notes, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Перерисовано заметок: {rendered}.'
+        ))
+
+    def render(self, notes, batch_size):
+        """
+        Рендерит заметки выборки порциями по id.
+
+        Меняется только HTML, а не сами заметки, поэтому номера изменений
+        не выдаются и в ленту синхронизации ничего не попадает.
+        """
+        notes = notes.only('id', 'author_id', 'text').order_by('id')
+        rendered, last_id = 0, 0
+        while True:
+            batch = list(notes.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return rendered
+            with transaction.atomic(using=notes.db):
+                for note in batch:
+                    note.html_version = 0
+                    note.render_html()
+                    notes.filter(pk=note.pk).update(
+                        text_html=note.text_html, text_hash=note.text_hash,
+                        html_version=note.html_version,
+                    )
+            for author_id in {note.author_id for note in batch}:
+                bump_notes_version(author_id)
+            rendered += len(batch)
+            last_id = batch[-1].id
@@ -0,0 +1,108 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from notes.management.base import WriteCommand
+from notes.models import Note
+
+User = get_user_model()
+
+WORDS = (
+    'заметка план список идея встреча проект задача отчёт покупки книга '
+    'работа дом отпуск код релиз ошибка сервер база данные поиск запрос '
+    'неделя месяц итоги цель звонок письмо документ черновик важно срочно'
+).split()
+
+
+class Command(WriteCommand):
+    help = (
+        'Заполняет базу пользователями и заметками для нагрузочных '
+        'тестов. Длина текстов распределена логнормально.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=10,
+            help='Сколько пользователей создать.',
+        )
+        parser.add_argument(
+            '--notes', type=int, default=100,
+            help='Сколько заметок у каждого пользователя.',
+        )
+        parser.add_argument(
+            '--text-median', type=int, default=400,
+            help='Медианная длина текста заметки в символах.',
+        )
+        parser.add_argument(
+            '--text-sigma', type=float, default=1.0,
+            help='Разброс длины текста; 0 — все тексты одной длины.',
+        )
+        parser.add_argument(
+            '--prefix', default='bench',
+            help='Префикс имён пользователей и slug заметок.',
+        )
+        parser.add_argument(
+            '--password', default='bench-password',
+            help='Пароль всех созданных пользователей.',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора, чтобы данные повторялись.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько заметок вставлять одним запросом.',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        prefix = options['prefix']
+        started = time.monotonic()
+        # Хеширование пароля дорогое: один хеш на всех пользователей.
+        password = make_password(options['password'])
+        User.objects.bulk_create(
+            User(username=f'{prefix}{number}', password=password)
+            for number in range(1, options['users'] + 1)
+        )
+        users = User.objects.filter(
+            username__in=[
+                f'{prefix}{number}'
+                for number in range(1, options['users'] + 1)
+            ]
+        ).order_by('pk')
+        created = 0
+        for user in users:
+            notes = [
+                Note(
+                    title=self.words(self.random.randint(1, 6))[:100],
+                    text=self.text(
+                        options['text_median'], options['text_sigma']
+                    ),
+                    slug=f'{prefix}-{user.pk}-{number}',
+                    author=user,
+                )
+                for number in range(1, options['notes'] + 1)
+            ]
+            for start in range(0, len(notes), options['batch_size']):
+                with transaction.atomic():
+                    Note.objects.bulk_create(
+                        notes[start:start + options['batch_size']]
+                    )
+            created += len(notes)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, заметок: {created} '
+            f'за {time.monotonic() - started:.1f} с.'
+        ))
+
+    def words(self, count):
+        return ' '.join(self.random.choices(WORDS, k=count)).capitalize()
+
+    def text(self, median, sigma):
+        length = max(1, round(self.random.lognormvariate(0, sigma) * median))
+        text = self.words(length // 6 + 1)
+        while len(text) < length:
+            text += '. ' + self.words(self.random.randint(5, 15))
+        return text[:length]
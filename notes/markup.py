@@ -0,0 +1,37 @@
+import hashlib
+
+import bleach
+import markdown
+
+# Повышается при любом изменении рендеринга: render_notes перерисует
+# заметки со старой версией.
+RENDERER_VERSION = 1
+EXTENSIONS = ('fenced_code', 'tables', 'sane_lists')
+ALLOWED_TAGS = (
+    'a', 'abbr', 'blockquote', 'br', 'code', 'del', 'em', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'hr', 'img', 'li', 'ol', 'p', 'pre', 'strong', 'table',
+    'tbody', 'td', 'th', 'thead', 'tr', 'ul',
+)
+ALLOWED_ATTRIBUTES = {
+    'a': ('href', 'title'),
+    'abbr': ('title',),
+    'img': ('src', 'alt', 'title'),
+    'td': ('align',),
+    'th': ('align',),
+}
+ALLOWED_PROTOCOLS = ('http', 'https', 'mailto')
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def render_markdown(text):
+    """HTML из Markdown, очищенный от всего, кроме разрешённой разметки."""
+    return bleach.clean(
+        markdown.markdown(text, extensions=EXTENSIONS),
+        tags=ALLOWED_TAGS,
+        attributes=ALLOWED_ATTRIBUTES,
+        protocols=ALLOWED_PROTOCOLS,
+        strip=True,
+    )
@@ -0,0 +1,268 @@
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+from .aio import HybridMiddleware, current_metrics
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'yanote'
+SECONDS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERIES = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+# Описание и корзины каждой гистограммы.
+HISTOGRAMS = {
+    'request_duration_seconds': ('Полное время запроса.', SECONDS),
+    'sql_duration_seconds': ('Время SQL-запросов за запрос.', SECONDS),
+    'render_duration_seconds': ('Время рендеринга шаблона.', SECONDS),
+    'sql_queries': ('Число SQL-запросов за запрос.', QUERIES),
+}
+COUNTERS = {
+    'nplusone_total': 'Запросы с повторяющимся SQL (вероятно, N+1).',
+}
+UNRESOLVED = '<unresolved>'
+# Числа и строки в SQL, чтобы запросы N+1 с подставленными значениями
+# сводились к одному шаблону.
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+class Registry:
+    """
+    Гистограммы и счётчики процесса по именам представлений.
+
+    С METRICS_DIR процесс раз в METRICS_FLUSH_SECONDS записывает снимок
+    в файл <pid>.json, а /metrics складывает снимки всех процессов.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.pid = os.getpid()
+        self.flushed = time.monotonic()
+        # (метрика, представление) → [счётчики корзин…, сумма, число]
+        self.histograms = {}
+        self.counters = Counter()
+
+    def check_fork(self):
+        # После fork дочерний процесс не должен повторять данные родителя.
+        if self.pid != os.getpid():
+            self.clear()
+
+    def observe(self, name, view, value):
+        buckets = HISTOGRAMS[name][1]
+        with self.lock:
+            self.check_fork()
+            row = self.histograms.setdefault(
+                (name, view), [0] * len(buckets) + [0, 0]
+            )
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    row[index] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def increment(self, name, view):
+        with self.lock:
+            self.check_fork()
+            self.counters[name, view] += 1
+
+    def snapshot(self):
+        with self.lock:
+            self.check_fork()
+            return {
+                'histograms': [
+                    [name, view, list(row)]
+                    for (name, view), row in self.histograms.items()
+                ],
+                'counters': [
+                    [name, view, value]
+                    for (name, view), value in self.counters.items()
+                ],
+            }
+
+    def flush(self, force=False):
+        """Записывает снимок процесса в METRICS_DIR, если пора."""
+        directory = settings.METRICS_DIR
+        due = self.flushed + settings.METRICS_FLUSH_SECONDS
+        if not directory or not (force or time.monotonic() >= due):
+            return
+        self.flushed = time.monotonic()
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{os.getpid()}.json'
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(self.snapshot()))
+        os.replace(temporary, path)
+
+    def collect(self):
+        """Снимки всех процессов; свой берётся из памяти, а не из файла."""
+        snapshots = [self.snapshot()]
+        if settings.METRICS_DIR:
+            own = f'{os.getpid()}.json'
+            for path in Path(settings.METRICS_DIR).glob('*.json'):
+                if path.name == own:
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+        histograms, counters = {}, Counter()
+        for snapshot in snapshots:
+            for name, view, row in snapshot['histograms']:
+                total = histograms.setdefault((name, view), [0] * len(row))
+                for index, value in enumerate(row):
+                    total[index] += value
+            for name, view, value in snapshot['counters']:
+                counters[name, view] += value
+        return histograms, counters
+
+
+registry = Registry()
+atexit.register(registry.flush, force=True)
+
+
+class RequestMetrics:
+    """Счётчики одного запроса, собираемые обёрткой execute_wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.render_time = None
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[SQL_LITERALS.sub('?', sql)] += 1
+
+    def repeated(self, threshold):
+        """SQL-шаблоны, выполненные за запрос не меньше threshold раз."""
+        return [
+            (sql, count) for sql, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+def label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n'
+    )
+
+
+def render_metrics():
+    """Метрики всех процессов в текстовом формате Prometheus."""
+    histograms, counters = registry.collect()
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [
+            f'# HELP {PREFIX}_{name} {help_text}',
+            f'# TYPE {PREFIX}_{name} histogram',
+        ]
+        for (metric, view), row in sorted(histograms.items()):
+            if metric != name:
+                continue
+            view = label(view)
+            for bound, value in zip(buckets, row):
+                lines.append(
+                    f'{PREFIX}_{name}_bucket{{view="{view}",le="{bound}"}} '
+                    f'{value}'
+                )
+            lines += [
+                f'{PREFIX}_{name}_bucket{{view="{view}",le="+Inf"}} '
+                f'{row[-1]}',
+                f'{PREFIX}_{name}_sum{{view="{view}"}} {row[-2]}',
+                f'{PREFIX}_{name}_count{{view="{view}"}} {row[-1]}',
+            ]
+    for name, help_text in COUNTERS.items():
+        lines += [
+            f'# HELP {PREFIX}_{name} {help_text}',
+            f'# TYPE {PREFIX}_{name} counter',
+        ]
+        for (metric, view), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(
+                    f'{PREFIX}_{name}{{view="{label(view)}"}} {value}'
+                )
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Меряет каждый запрос: полное время, число и время SQL-запросов,
+    время рендеринга шаблона. Метрики подписываются именем маршрута
+    (notes:list, notes:detail…). Если один SQL-шаблон повторился за
+    запрос NPLUSONE_THRESHOLD раз, пишет предупреждение в лог.
+
+    Под ASGI считаются запросы, выполненные через notes.aio.run_db.
+    """
+
+    def handle(self, request):
+        metrics = request.metrics = RequestMetrics()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        self.record(request, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        metrics = request.metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.record(request, metrics, time.perf_counter() - started)
+        return response
+
+    def record(self, request, metrics, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else UNRESOLVED
+        registry.observe('request_duration_seconds', view, elapsed)
+        registry.observe('sql_duration_seconds', view, metrics.sql_time)
+        registry.observe('sql_queries', view, metrics.queries)
+        if metrics.render_time is not None:
+            registry.observe(
+                'render_duration_seconds', view, metrics.render_time
+            )
+        repeated = metrics.repeated(settings.NPLUSONE_THRESHOLD)
+        if repeated:
+            registry.increment('nplusone_total', view)
+            for sql, count in repeated:
+                logger.warning(
+                    'Вероятно N+1 в %s: %d раз за запрос %s', view, count, sql
+                )
+        registry.flush()
+
+    def process_template_response(self, request, response):
+        # Шаблон рендерится сразу после этого метода; конец рендеринга
+        # отмечает post-render callback. Асинхронные представления
+        # (notes.aio) рендерят шаблон сами и время записывают тоже сами.
+        if response.is_rendered:
+            return response
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.metrics.render_time = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
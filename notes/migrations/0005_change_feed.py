@@ -0,0 +1,72 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def number_existing_notes(apps, schema_editor):
+    """Нумерует уже существующие заметки, чтобы они попали в ленту."""
+    Note = apps.get_model('notes', 'Note')
+    ChangeCounter = apps.get_model('notes', 'ChangeCounter')
+    db = schema_editor.connection.alias
+    author_ids = Note.objects.using(db).values_list(
+        'author_id', flat=True
+    ).distinct()
+    for author_id in author_ids.iterator():
+        notes = list(
+            Note.objects.using(db).filter(author_id=author_id)
+            .order_by('id').only('id')
+        )
+        for revision, note in enumerate(notes, start=1):
+            note.revision = revision
+        Note.objects.using(db).bulk_update(notes, ('revision',), 1000)
+        ChangeCounter.objects.using(db).create(
+            author_id=author_id, value=len(notes)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notes', '0004_note_created_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCounter',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='note_changes', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('value', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=100)),
+                ('revision', models.PositiveBigIntegerField(verbose_name='Номер изменения')),
+                ('deleted', models.DateTimeField(auto_now_add=True, verbose_name='Удалена')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['author', 'revision'], name='note_author_revision_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['author', 'revision'], name='tombstone_author_revision_idx'),
+        ),
+        migrations.RunPython(number_existing_notes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notes', '0006_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileDump',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Снят')),
+                ('view_name', models.CharField(blank=True, max_length=200, verbose_name='Маршрут')),
+                ('path', models.CharField(max_length=200, verbose_name='Путь')),
+                ('format', models.CharField(choices=[('pstats', 'cProfile (pstats)'), ('collapsed', 'Свёрнутые стеки (flamegraph)')], max_length=20, verbose_name='Формат')),
+                ('file_name', models.CharField(max_length=255, unique=True, verbose_name='Файл')),
+                ('duration', models.FloatField(verbose_name='Длительность, с')),
+                ('size', models.PositiveIntegerField(verbose_name='Размер, байт')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'профиль запроса',
+                'verbose_name_plural': 'профили запросов',
+                'ordering': ('-created',),
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations, models
+
+import notes.fields
+
+BATCH_SIZE = 500
+
+
+def copy_text(apps, schema_editor, source, target):
+    """Переносит тексты между колонками порциями по BATCH_SIZE строк."""
+    Note = apps.get_model('notes', 'Note')
+    notes = Note.objects.using(schema_editor.connection.alias)
+    last_id = 0
+    while True:
+        batch = list(
+            notes.filter(id__gt=last_id).order_by('id')
+            .only('id', source)[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        for note in batch:
+            setattr(note, target, getattr(note, source))
+        notes.bulk_update(batch, (target,))
+        last_id = batch[-1].id
+
+
+def compress_texts(apps, schema_editor):
+    copy_text(apps, schema_editor, 'text', 'text_compressed')
+
+
+def decompress_texts(apps, schema_editor):
+    copy_text(apps, schema_editor, 'text_compressed', 'text')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0007_profile_dump'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='text_compressed',
+            field=notes.fields.CompressedTextField(null=True),
+        ),
+        migrations.RunPython(compress_texts, decompress_texts),
+        # Только состояние: при откате колонка text вернётся с пустым
+        # значением по умолчанию, и decompress_texts её заполнит.
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='note',
+                name='text',
+                field=models.TextField(default=''),
+            ),
+        ]),
+        migrations.RemoveField(
+            model_name='note',
+            name='text',
+        ),
+        migrations.RenameField(
+            model_name='note',
+            old_name='text_compressed',
+            new_name='text',
+        ),
+        migrations.AlterField(
+            model_name='note',
+            name='text',
+            field=notes.fields.CompressedTextField(help_text='Добавьте подробностей', verbose_name='Текст'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+import notes.fields
+from notes import markup
+
+BATCH_SIZE = 500
+
+
+def render_existing_notes(apps, schema_editor):
+    """Рендерит HTML уже существующих заметок порциями по BATCH_SIZE."""
+    Note = apps.get_model('notes', 'Note')
+    notes = Note.objects.using(schema_editor.connection.alias)
+    last_id = 0
+    while True:
+        batch = list(
+            notes.filter(id__gt=last_id).order_by('id')
+            .only('id', 'text')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        for note in batch:
+            note.text_html = markup.render_markdown(note.text)
+            note.text_hash = markup.content_hash(note.text)
+            note.html_version = markup.RENDERER_VERSION
+        notes.bulk_update(batch, ('text_html', 'text_hash', 'html_version'))
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0008_compressed_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='html_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='text_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='text_html',
+            field=notes.fields.CompressedTextField(blank=True, editable=False, verbose_name='HTML текста'),
+        ),
+        migrations.RunPython(
+            render_existing_notes, migrations.RunPython.noop
+        ),
+    ]
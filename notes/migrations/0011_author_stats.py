@@ -0,0 +1,40 @@
+# Generated by Django 3.2.15 on 2026-10-18 20:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+import django.db.models.deletion
+
+
+def count_existing_notes(apps, schema_editor):
+    """Заполняет статистику авторов по уже существующим заметкам."""
+    Note = apps.get_model('notes', 'Note')
+    AuthorStats = apps.get_model('notes', 'AuthorStats')
+    db = schema_editor.connection.alias
+    rows = Note.objects.using(db).values('author_id').annotate(
+        note_count=Count('id'), text_bytes=Sum(Length('text'))
+    ).order_by()
+    AuthorStats.objects.using(db).bulk_create(
+        (AuthorStats(**row) for row in rows.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notes', '0010_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('author', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='note_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('note_count', models.PositiveIntegerField(default=0, verbose_name='Заметок')),
+                ('text_bytes', models.PositiveBigIntegerField(default=0, verbose_name='Объём текстов')),
+            ],
+        ),
+        migrations.RunPython(count_existing_notes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+from django.db import migrations
+
+from notes.search import index_terms
+
+FTS_TABLE = 'notes_note_fts'
+BATCH_SIZE = 500
+
+
+def rebuild(apps, schema_editor, tokenize, terms):
+    """
+    Пересоздаёт индекс FTS5 и заполняет его порциями по BATCH_SIZE
+    заметок: тексты в notes_note сжаты, и SQL их не прочитает.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE {FTS_TABLE}')
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+        f'title, text, tokenize="{tokenize}")'
+    )
+    Note = apps.get_model('notes', 'Note')
+    notes = Note.objects.using(schema_editor.connection.alias)
+    last_id = 0
+    while True:
+        batch = list(
+            notes.filter(id__gt=last_id).order_by('id')
+            .only('id', 'title', 'text', 'author_id')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE}(rowid, title, text) '
+                'VALUES (%s, %s, %s)',
+                [
+                    (note.id, *terms(note.author_id, note.title, note.text))
+                    for note in batch
+                ],
+            )
+        last_id = batch[-1].id
+
+
+def index_author_terms(apps, schema_editor):
+    rebuild(
+        apps, schema_editor,
+        "unicode61 remove_diacritics 2 tokenchars '~'",
+        lambda author_id, *values: [
+            index_terms(author_id, value) for value in values
+        ],
+    )
+
+
+def index_words(apps, schema_editor):
+    rebuild(
+        apps, schema_editor,
+        'unicode61 remove_diacritics 2',
+        lambda author_id, *values: values,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0011_author_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_author_terms, index_words),
+    ]
@@ -1,7 +1,237 @@
+from collections import defaultdict
+from functools import partial
+from operator import attrgetter, itemgetter
+from pathlib import Path
+
 from django.conf import settings
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F
+
+from . import events, markup, search, sharding, stats, tagging
+from .cache import bump_notes_version
+from .fields import Compressed, CompressedTextField
+from .slugs import save_with_unique_slug
+
+
+def group_by_author(items, key=attrgetter('author_id')):
+    groups = defaultdict(list)
+    for item in items:
+        groups[key(item)].append(item)
+    return groups
+
+
+def publish_changes(using, tombstones=(), notes=(), kind='update'):
+    """
+    События для потока notes:events после коммита: удаления по отметкам
+    tombstones и kind (create или update) по заметкам notes.
+    """
+    changes = [
+        events.delete_event(tombstone.slug, tombstone.revision)
+        for tombstone in tombstones
+    ] + [events.note_event(kind, note) for note in notes]
+    by_author = group_by_author(
+        zip([*tombstones, *notes], changes), key=lambda item: item[0].author_id
+    )
+    for author_id, items in by_author.items():
+        events.publish(using, author_id, sorted(
+            (change for _, change in items), key=itemgetter('id')
+        ))
+
+
+class AuthorQuerySet(models.QuerySet):
+
+    def for_author(self, author):
+        """Строки автора; с шардами запросы идут на его шард."""
+        queryset = self.filter(author=author)
+        queryset._add_hints(author_id=author.pk)
+        return queryset
+
+
+class NoteQuerySet(AuthorQuerySet):
+
+    def by_shard(self, objs):
+        """Выборки по шардам авторов для объектов objs."""
+        for author_id, notes in group_by_author(objs).items():
+            yield self.using(sharding.shard_for_author(author_id)), notes
 
-from pytils.translit import slugify
+    def with_tag(self, tag):
+        """
+        Заметки с тегом tag. Условия на автора нет: тег и так принадлежит
+        одному автору, а без него запрос идёт по индексу связей (tag, note),
+        не перебирая остальные заметки автора.
+        """
+        queryset = self.filter(note_tags__tag=tag)
+        queryset._add_hints(author_id=tag.author_id)
+        return queryset
+
+    def create(self, **kwargs):
+        if sharding.sharding_enabled() and self._db is None:
+            # Базу выберет роутер по автору, а не выборка без подсказок.
+            note = self.model(**kwargs)
+            note.save(force_insert=True)
+            return note
+        return super().create(**kwargs)
+
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False):
+        """
+        Массовое создание заметок с обновлением поискового индекса и версий
+        кеша их авторов.
+        """
+        objs = list(objs)
+        if sharding.sharding_enabled() and self._db is None:
+            for queryset, notes in self.by_shard(objs):
+                queryset.bulk_create(notes, batch_size, ignore_conflicts)
+            return objs
+        with sharding.reserving():
+            if sharding.sharding_enabled():
+                objs = sharding.reserve_slugs(objs, ignore_conflicts)
+            for obj in objs:
+                obj.render_html()
+            objs = self.insert(objs, batch_size, ignore_conflicts)
+        if ignore_conflicts:
+            # Часть строк могла не вставиться: индексируем то, что в базе.
+            stored = list(self.filter(slug__in=[obj.slug for obj in objs]))
+            search.index_notes(stored, using=self.db)
+            revisions = {(obj.author_id, obj.revision) for obj in objs}
+            publish_changes(self.db, notes=[
+                note for note in stored
+                if (note.author_id, note.revision) in revisions
+            ], kind='create')
+        else:
+            search.index_notes(objs, using=self.db)
+            publish_changes(self.db, notes=objs, kind='create')
+        for author_id in {obj.author_id for obj in objs}:
+            bump_notes_version(author_id)
+        return objs
+
+    def insert(self, objs, batch_size, ignore_conflicts):
+        """Вставка строк с номерами изменений и тегами в одной транзакции."""
+        with transaction.atomic(using=self.db):
+            self.allocate_revisions(objs)
+            objs = super().bulk_create(
+                objs, batch_size=batch_size,
+                ignore_conflicts=ignore_conflicts
+            )
+            if ignore_conflicts:
+                stats.add_notes(self.inserted(objs), using=self.db)
+            else:
+                self.set_ids(objs)
+                tagging.apply_tags(objs, using=self.db)
+                stats.add_notes(objs, using=self.db)
+        return objs
+
+    def inserted(self, objs):
+        """Заметки objs, которые вставились: их номера изменений в базе."""
+        stored = set(
+            self.filter(
+                slug__in=[obj.slug for obj in objs]
+            ).values_list('author_id', 'revision')
+        )
+        return [obj for obj in objs if (obj.author_id, obj.revision) in stored]
+
+    def set_ids(self, objs):
+        """Находит id по slug: SQLite не возвращает их из массовой вставки."""
+        ids = dict(
+            self.filter(
+                slug__in=[obj.slug for obj in objs]
+            ).values_list('slug', 'id')
+        )
+        for obj in objs:
+            if obj.pk is None:
+                obj.pk = ids[obj.slug]
+
+    def allocate_revisions(self, objs):
+        """
+        Выдаёт заметкам номера изменений. Возвращает отметки о прежних slug
+        переименованных заметок, их номера идут перед номерами заметок.
+        """
+        tombstones = []
+        for author_id, notes in group_by_author(objs).items():
+            renamed = [note for note in notes if note.renamed_from]
+            revisions = iter(ChangeCounter.allocate(
+                author_id, len(notes) + len(renamed), using=self.db
+            ))
+            tombstones += [
+                Tombstone(
+                    author_id=author_id, slug=note.renamed_from,
+                    revision=next(revisions),
+                )
+                for note in renamed
+            ]
+            for note in notes:
+                note.revision = next(revisions)
+        return tombstones
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """Массовое обновление с теми же побочными эффектами, что и save."""
+        objs = list(objs)
+        if sharding.sharding_enabled() and self._db is None:
+            for queryset, notes in self.by_shard(objs):
+                queryset.bulk_update(notes, fields, batch_size)
+            return
+        if 'text' in fields:
+            for note in objs:
+                note.render_html()
+            fields = {*fields, *Note.HTML_FIELDS}
+        renamed = [note for note in objs if note.renamed_from]
+        freed = [note.renamed_from for note in renamed]
+        with sharding.reserving():
+            if sharding.sharding_enabled():
+                sharding.reserve_slugs(renamed)
+            with transaction.atomic(using=self.db):
+                tombstones = self.allocate_revisions(objs)
+                sizes = stats.stored_sizes(
+                    [note.pk for note in objs] if 'text' in fields else (),
+                    using=self.db,
+                )
+                super().bulk_update(
+                    objs, {*fields, 'revision'}, batch_size=batch_size
+                )
+                Tombstone.objects.using(self.db).bulk_create(tombstones)
+                tagging.apply_tags(objs, using=self.db)
+                stats.change_notes(objs, sizes, using=self.db)
+        sharding.release_slugs(freed, self.db)
+        publish_changes(self.db, tombstones, objs)
+        for note in objs:
+            note._loaded_slug = note.slug
+        if {'title', 'text'} & set(fields):
+            search.index_notes(objs, using=self.db)
+        for author_id in {obj.author_id for obj in objs}:
+            bump_notes_version(author_id)
+
+    def delete(self):
+        """Удаление выборки вместе с записями поискового индекса."""
+        with transaction.atomic(using=self.db):
+            rows = list(self.values_list('id', 'author_id', 'slug'))
+            tombstones = []
+            for author_id, slugs in group_by_author(
+                rows, key=itemgetter(1)
+            ).items():
+                revisions = ChangeCounter.allocate(
+                    author_id, len(slugs), using=self.db
+                )
+                tombstones += [
+                    Tombstone(
+                        author_id=author_id, slug=slug, revision=revision
+                    )
+                    for (_, _, slug), revision in zip(slugs, revisions)
+                ]
+            Tombstone.objects.using(self.db).bulk_create(tombstones)
+            tagging.forget_notes([pk for pk, _, _ in rows], using=self.db)
+            stats.remove_notes(
+                stats.stored_sizes([pk for pk, _, _ in rows], using=self.db),
+                using=self.db,
+            )
+            result = super().delete()
+        search.unindex_notes([pk for pk, _, _ in rows], using=self.db)
+        publish_changes(self.db, tombstones)
+        sharding.release_slugs([slug for _, _, slug in rows], self.db)
+        for author_id in {author_id for _, author_id, _ in rows}:
+            bump_notes_version(author_id)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 
 class Note(models.Model):
@@ -11,7 +241,8 @@ class Note(models.Model):
         default='Название заметки',
         help_text='Дайте короткое название заметке'
     )
-    text = models.TextField(
+    # Длинные тексты хранятся сжатыми и распаковываются при обращении.
+    text = CompressedTextField(
         'Текст',
         help_text='Добавьте подробностей'
     )
@@ -23,16 +254,359 @@ class Note(models.Model):
         help_text=('Укажите адрес для страницы заметки. Используйте только '
                    'латиницу, цифры, дефисы и знаки подчёркивания')
     )
+    # Без ограничения в базе: с шардами пользователи живут в другой базе.
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    updated = models.DateTimeField('Изменена', auto_now=True)
+    # Номер последнего изменения в ленте изменений автора.
+    revision = models.PositiveBigIntegerField(
+        'Номер изменения', default=0, editable=False
     )
+    # Текст, отрендеренный из Markdown при сохранении, и sha256 текста и
+    # версия рендерера, с которыми он получен.
+    text_html = CompressedTextField('HTML текста', blank=True, editable=False)
+    text_hash = models.CharField(max_length=64, blank=True, editable=False)
+    html_version = models.PositiveSmallIntegerField(default=0, editable=False)
+    tags = models.ManyToManyField(
+        'Tag', through='NoteTag', related_name='notes', blank=True,
+    )
+
+    HTML_FIELDS = ('text_html', 'text_hash', 'html_version')
+    # Новые имена тегов (NoteForm); записываются при сохранении заметки.
+    tag_names = None
+
+    objects = NoteQuerySet.as_manager()
+
+    class Meta:
+        indexes = (
+            # Keyset-пагинация списка заметок: WHERE author_id = ? AND id > ?
+            models.Index(fields=('author', 'id'), name='note_author_id_idx'),
+            # Валидаторы условных GET: MAX(updated) по заметкам автора.
+            models.Index(
+                fields=('author', 'updated'), name='note_author_updated_idx'
+            ),
+            # Лента изменений: WHERE author_id = ? AND revision > ?
+            models.Index(
+                fields=('author', 'revision'), name='note_author_revision_idx'
+            ),
+        )
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        note = super().from_db(db, field_names, values)
+        note._loaded_slug = note.__dict__.get('slug')
+        return note
+
+    @property
+    def renamed_from(self):
+        """Прежний slug, если он изменился после загрузки из базы."""
+        loaded_slug = getattr(self, '_loaded_slug', None)
+        return loaded_slug if loaded_slug != self.slug else None
+
+    def tag_list(self):
+        """
+        Имена тегов по алфавиту. Читаются один раз и хранятся в самой
+        заметке, поэтому заметка из кеша (notes.cache.get_note) приходит
+        с тегами: их изменение меняет и версию кеша.
+        """
+        if '_tag_list' not in self.__dict__:
+            self._tag_list = list(
+                self.tags.order_by('name').values_list('name', flat=True)
+            )
+        return self._tag_list
+
+    def render_html(self):
+        """
+        Рендерит text_html, если текст или версия рендерера изменились.
+
+        Текст, не тронутый с загрузки из базы, не распаковывается: его hash
+        уже сохранён вместе с HTML.
+        """
+        text = self.__dict__.get('text')
+        up_to_date = self.html_version == markup.RENDERER_VERSION
+        if up_to_date and (text is None or isinstance(text, Compressed)):
+            return False
+        digest = markup.content_hash(self.text)
+        if up_to_date and digest == self.text_hash:
+            return False
+        self.text_html = markup.render_markdown(self.text)
+        self.text_hash = digest
+        self.html_version = markup.RENDERER_VERSION
+        return True
+
     def save(self, *args, **kwargs):
-        if not self.slug:
-            max_slug_length = self._meta.get_field('slug').max_length
-            self.slug = slugify(self.title)[:max_slug_length]
-        super().save(*args, **kwargs)
+        using = router.db_for_write(type(self), instance=self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'text' in update_fields:
+            self.render_html()
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'revision'}
+            if 'text' in update_fields:
+                kwargs['update_fields'] |= set(self.HTML_FIELDS)
+        adding = self._state.adding
+        written = {}
+        with sharding.atomic(using):
+            write = partial(self.write_row, using, written, *args, **kwargs)
+            if self.slug:
+                write()
+            else:
+                save_with_unique_slug(self, write)
+            tagging.apply_tags((self,), using=using)
+            if adding:
+                stats.add_notes((self,), using)
+            else:
+                stats.change_notes((self,), written['sizes'], using)
+        tombstones = written['tombstones']
+        sharding.release_slugs(
+            [tombstone.slug for tombstone in tombstones], using
+        )
+        publish_changes(
+            using, tombstones, (self,), 'create' if adding else 'update'
+        )
+        self._loaded_slug = self.slug
+        if update_fields is None or {'title', 'text'} & set(update_fields):
+            search.index_notes((self,), using=self._state.db)
+        bump_notes_version(self.author_id)
+
+    def saves_text(self, update_fields):
+        """Запишет ли save текст: он загружен и входит в update_fields."""
+        return 'text' in self.__dict__ and (
+            update_fields is None or 'text' in update_fields
+        )
+
+    def write_row(self, db, written, *args, **kwargs):
+        """
+        Запись строки, когда slug уже выбран: только тогда известно,
+        переименована ли заметка. Отметку о прежнем slug и прежний размер
+        текста кладёт в written.
+
+        Номер изменения выдаётся в той же транзакции, что и запись:
+        строка счётчика заблокирована до коммита, поэтому изменения
+        одного автора фиксируются строго в порядке номеров.
+        """
+        renamed_from = self.renamed_from
+        revisions = iter(ChangeCounter.allocate(
+            self.author_id, 2 if renamed_from else 1, using=db
+        ))
+        written['tombstones'] = [
+            Tombstone.objects.using(db).create(
+                author_id=self.author_id, slug=renamed_from,
+                revision=next(revisions),
+            )
+        ] if renamed_from else []
+        self.revision = next(revisions)
+        written['sizes'] = {} if self._state.adding else stats.stored_sizes(
+            (self.pk,) if self.saves_text(kwargs.get('update_fields')) else (),
+            db,
+        )
+        with sharding.reserved_slug(self):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        pk, using = self.pk, self._state.db
+        with transaction.atomic(using=using):
+            tombstone = Tombstone.objects.using(using).create(
+                author_id=self.author_id, slug=self.slug,
+                revision=ChangeCounter.allocate(
+                    self.author_id, 1, using=using
+                )[0],
+            )
+            tagging.forget_notes((pk,), using=using)
+            stats.remove_notes(stats.stored_sizes((pk,), using), using)
+            result = super().delete(*args, **kwargs)
+        search.unindex_notes((pk,), using=using)
+        publish_changes(using, (tombstone,))
+        sharding.release_slugs([self.slug], using)
+        bump_notes_version(self.author_id)
+        return result
+
+
+class ChangeCounter(models.Model):
+    """Счётчик изменений заметок автора для ленты синхронизации."""
+    author = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='note_changes',
+        db_constraint=False,
+    )
+    value = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, author_id, count, using=None):
+        """
+        Выдаёт count следующих номеров изменений автора.
+
+        Вызывается внутри транзакции: UPDATE блокирует строку счётчика до
+        её завершения.
+        """
+        counters = cls.objects.using(using).filter(author_id=author_id)
+        if not counters.update(value=F('value') + count):
+            counters.get_or_create(author_id=author_id)
+            counters.update(value=F('value') + count)
+        value = counters.values_list('value', flat=True).get()
+        return range(value - count + 1, value + 1)
+
+
+class Tombstone(models.Model):
+    """Отметка об удалённой (или переименованной) заметке."""
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    slug = models.SlugField(max_length=100)
+    revision = models.PositiveBigIntegerField('Номер изменения')
+    deleted = models.DateTimeField('Удалена', auto_now_add=True)
+
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=('author', 'revision'),
+                name='tombstone_author_revision_idx',
+            ),
+        )
+
+    def __str__(self):
+        return self.slug
+
+
+class Tag(models.Model):
+    """Тег заметок автора."""
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    name = models.CharField('Тег', max_length=50)
+    # Сколько заметок автора с тегом: меняется в одной транзакции со
+    # связями (notes.tagging), поэтому список тегов с числом заметок
+    # читается без GROUP BY по заметкам.
+    note_count = models.PositiveIntegerField('Заметок', default=0)
+
+    objects = AuthorQuerySet.as_manager()
+
+    class Meta:
+        constraints = (
+            # Он же индекс для списка тегов автора по имени.
+            models.UniqueConstraint(
+                fields=('author', 'name'), name='tag_author_name_uniq'
+            ),
+        )
+
+    def __str__(self):
+        return self.name
+
+
+class NoteTag(models.Model):
+    """Связь заметки с тегом."""
+    note = models.ForeignKey(
+        Note, on_delete=models.CASCADE, related_name='note_tags'
+    )
+    tag = models.ForeignKey(
+        Tag, on_delete=models.CASCADE, related_name='note_tags'
+    )
+
+    class Meta:
+        constraints = (
+            # Фильтр списка по тегу: WHERE tag_id = ? AND note_id > ?
+            models.UniqueConstraint(
+                fields=('tag', 'note'), name='notetag_tag_note_uniq'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.note_id}:{self.tag_id}'
+
+
+class AuthorStats(models.Model):
+    """
+    Число заметок автора и место, которое занимают их тексты.
+
+    Меняется в транзакциях записи заметок (notes.stats), поэтому шапка
+    не считает COUNT и SUM(LENGTH(text)) по заметкам на каждый запрос.
+    Расхождения исправляет команда reconcile_stats.
+    """
+    author = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='note_stats',
+        db_constraint=False,
+    )
+    note_count = models.PositiveIntegerField('Заметок', default=0)
+    # Байты текстов в базе, как LENGTH(text): длинные тексты сжаты.
+    text_bytes = models.PositiveBigIntegerField('Объём текстов', default=0)
+
+    def __str__(self):
+        return f'{self.author_id}: {self.note_count}'
+
+
+class ShardPlacement(models.Model):
+    """Каталог: на каком шарде хранятся заметки автора."""
+    author = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='note_shard',
+    )
+    shard = models.CharField('Шард', max_length=100)
+
+    def __str__(self):
+        return self.shard
+
+
+class SlugRegistry(models.Model):
+    """Занятые slug всех шардов: уникальность адресов заметок."""
+    slug = models.SlugField(max_length=100, primary_key=True)
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    def __str__(self):
+        return self.slug
+
+
+class ProfileDump(models.Model):
+    """Профиль запроса, снятый notes.profiling.ProfilingMiddleware."""
+    FORMATS = (
+        ('pstats', 'cProfile (pstats)'),
+        ('collapsed', 'Свёрнутые стеки (flamegraph)'),
+    )
+
+    created = models.DateTimeField('Снят', auto_now_add=True)
+    view_name = models.CharField('Маршрут', max_length=200, blank=True)
+    path = models.CharField('Путь', max_length=200)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='Пользователь',
+    )
+    format = models.CharField('Формат', max_length=20, choices=FORMATS)
+    file_name = models.CharField('Файл', max_length=255, unique=True)
+    duration = models.FloatField('Длительность, с')
+    size = models.PositiveIntegerField('Размер, байт')
+
+    class Meta:
+        ordering = ('-created',)
+        verbose_name = 'профиль запроса'
+        verbose_name_plural = 'профили запросов'
+
+    def __str__(self):
+        return f'{self.view_name or self.path} {self.created:%Y-%m-%d %H:%M}'
+
+    @property
+    def file_path(self):
+        return Path(settings.PROFILE_DIR) / self.file_name
@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+
+from django.http import Http404
+
+# Курсоры — 64-битные целые: большее число SQLite не сравнит с id.
+MIN_CURSOR, MAX_CURSOR = -2 ** 63, 2 ** 63 - 1
+
+
+@dataclass
+class KeysetPage:
+    """Страница выборки и курсоры для перехода на соседние страницы."""
+    object_list: list
+    prev_cursor: int = None
+    next_cursor: int = None
+
+
+def parse_cursor(value):
+    """Курсор — это id заметки; некорректное значение даёт 404."""
+    if value is None:
+        return None
+    try:
+        cursor = int(value)
+    except ValueError:
+        raise Http404('Некорректный курсор страницы.')
+    if not MIN_CURSOR <= cursor <= MAX_CURSOR:
+        raise Http404('Некорректный курсор страницы.')
+    return cursor
+
+
+def paginate_keyset(queryset, params, per_page, ordering=('author', 'id')):
+    """
+    Возвращает страницу выборки, упорядоченной по ordering.
+
+    Вместо OFFSET используется условие по id последней показанной записи,
+    поэтому страница N стоит столько же, сколько первая: запрос идёт по
+    составному индексу (author_id, id) и читает ровно per_page + 1 строк.
+    Последнее поле ordering должно совпадать с id, остальные — быть
+    постоянными в выборке, как author у заметок одного автора.
+    """
+    after = parse_cursor(params.get('after'))
+    before = parse_cursor(params.get('before'))
+    if before is not None:
+        rows = list(
+            queryset.filter(id__lt=before)
+            .order_by(*(f'-{field}' for field in ordering))[:per_page + 1]
+        )
+        has_prev = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            queryset = queryset.filter(id__gt=after)
+        rows = list(queryset.order_by(*ordering)[:per_page + 1])
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev = after is not None
+    return KeysetPage(
+        object_list=rows,
+        prev_cursor=rows[0].id if rows and has_prev else None,
+        next_cursor=rows[-1].id if rows and has_next else None,
+    )
@@ -0,0 +1,187 @@
+import cProfile
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from .aio import HybridMiddleware, run_db
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'X-Profile'
+SIGNING_SALT = 'notes.profiling'
+FORMATS = {'pstats': 'prof', 'collapsed': 'txt'}
+DEFAULT_FORMAT = 'collapsed'
+
+
+def make_token(profile_format=DEFAULT_FORMAT):
+    """Подписанное значение заголовка X-Profile, см. PROFILE_TOKEN_MAX_AGE."""
+    return signing.dumps({'format': profile_format}, salt=SIGNING_SALT)
+
+
+def requested_format(request):
+    """
+    Формат профиля, если запрос нужно профилировать, иначе None.
+
+    Профиль включают: параметр ?profile=pstats|collapsed от сотрудника,
+    подписанный заголовок X-Profile (make_token) или случайная выборка
+    с долей PROFILE_SAMPLE_RATE.
+    """
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        try:
+            value = signing.loads(
+                token, salt=SIGNING_SALT,
+                max_age=settings.PROFILE_TOKEN_MAX_AGE,
+            )
+        except signing.BadSignature:
+            return None
+        return value.get('format') if value.get('format') in FORMATS else None
+    flag = request.GET.get(PROFILE_PARAM)
+    if flag in FORMATS and request.user.is_staff:
+        return flag
+    rate = settings.PROFILE_SAMPLE_RATE
+    if rate and random.random() < rate:
+        return DEFAULT_FORMAT
+    return None
+
+
+class StackSampler:
+    """
+    Сэмплирующий профилировщик: фоновый поток раз в PROFILE_INTERVAL
+    секунд снимает стек профилируемого потока. Результат — свёрнутые
+    стеки «модуль.функция;…;модуль.функция число» для flamegraph.pl
+    или speedscope.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f'{frame.f_globals.get("__name__", "?")}.'
+                    f'{getattr(code, "co_qualname", code.co_name)}'
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        path.write_text(''.join(
+            f'{stack} {count}\n' for stack, count in self.stacks.items()
+        ))
+
+
+class CProfiler:
+    """Детерминированный профиль cProfile в формате pstats."""
+
+    def __enter__(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+def profiler(profile_format):
+    if profile_format == 'pstats':
+        return CProfiler()
+    return StackSampler(settings.PROFILE_INTERVAL)
+
+
+def delete_dump_file(sender, instance, **kwargs):
+    """Удаляет файл профиля вместе с записью ProfileDump."""
+    instance.file_path.unlink(missing_ok=True)
+
+
+def save_dump(request, result, profile_format, duration):
+    """Сохраняет профиль в PROFILE_DIR и удаляет самые старые сверх лимита."""
+    from .models import ProfileDump
+
+    match = getattr(request, 'resolver_match', None)
+    view_name = match.view_name if match else ''
+    user = request.user if request.user.is_authenticated else None
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = '{}-{}-{}.{}'.format(
+        timezone.now().strftime('%Y%m%d-%H%M%S-%f'),
+        re.sub(r'[^\w-]+', '_', view_name or 'unresolved'),
+        user.pk if user else 'anonymous',
+        FORMATS[profile_format],
+    )
+    result.dump(directory / name)
+    ProfileDump.objects.create(
+        view_name=view_name, path=request.path[:200], user=user,
+        format=profile_format, file_name=name, duration=duration,
+        size=(directory / name).stat().st_size,
+    )
+    stale = ProfileDump.objects.order_by('-created', '-pk')[
+        settings.PROFILE_KEEP:
+    ]
+    for dump in stale:
+        dump.delete()
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    Профилирует запрос по требованию (см. requested_format).
+
+    Стоит после AuthenticationMiddleware и охватывает остальные middleware,
+    представление и рендеринг шаблона. Без включающего флага стоимость —
+    проверка заголовка и параметра запроса. Под ASGI профилируется поток
+    цикла событий: работа в пуле notes.aio.run_db в профиль не попадает,
+    а параллельные запросы — попадают.
+    """
+
+    def handle(self, request):
+        profile_format = requested_format(request)
+        if profile_format is None:
+            return self.get_response(request)
+        started = time.perf_counter()
+        # Шаблонные ответы рендерятся до возврата из get_response.
+        with profiler(profile_format) as result:
+            response = self.get_response(request)
+        save_dump(
+            request, result, profile_format, time.perf_counter() - started
+        )
+        return response
+
+    async def __acall__(self, request):
+        profile_format = requested_format(request)
+        if profile_format is None:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with profiler(profile_format) as result:
+            response = await self.get_response(request)
+        await run_db(
+            save_dump, request, result, profile_format,
+            time.perf_counter() - started,
+        )
+        return response
@@ -1,10 +1,42 @@
+import sqlite3
+import time
+
 import pytest
 
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
 from django.test.client import Client
 
+from notes import sessions
+from notes.cache import local_notes
 from notes.models import Note
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Кеш в памяти переживает тесты, а id пользователей повторяются."""
+    sessions.flushed = time.monotonic()
+    yield
+    for cache in caches.all():
+        cache.clear()
+    local_notes.clear()
+    sessions.pending.clear()
+
+
+@pytest.fixture
+def shared_cache(settings, tmp_path):
+    """Общий для процессов кеш заметок и сессии в нём, как в продакшене."""
+    settings.CACHES = {
+        **settings.CACHES,
+        settings.NOTES_CACHE: {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': str(tmp_path / 'cache'),
+        },
+    }
+    settings.SESSION_ENGINE = 'notes.sessions'
+
+
 @pytest.fixture
 def author(django_user_model):
     return django_user_model.objects.create(username='Автор')
@@ -52,3 +84,52 @@ def form_data():
         'text': 'Новый текст',
         'slug': 'new-slug'
     }
+
+
+@pytest.fixture
+def shards(settings, tmp_path):
+    """Два шарда заметок в отдельных файлах SQLite."""
+    aliases = ['shard1', 'shard2']
+    for alias in aliases:
+        connections.databases[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': str(tmp_path / f'{alias}.sqlite3'),
+        }
+        connections.ensure_defaults(alias)
+        connections.prepare_test_settings(alias)
+        call_command('migrate', database=alias, verbosity=0)
+    settings.NOTE_SHARDS = aliases
+    yield aliases
+    for alias in aliases:
+        connections[alias].close()
+        del connections[alias]
+        del connections.databases[alias]
+
+
+@pytest.fixture
+def replica(settings, tmp_path):
+    """
+    Реплика с копией основной базы на момент вызова фикстуры: следующие
+    записи до неё не доходят.
+    """
+    alias = 'replica1'
+    path = tmp_path / f'{alias}.sqlite3'
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    # Поиск читает только основную базу: таблицы FTS не копируются.
+    target.executescript('\n'.join(
+        line for line in connection.connection.iterdump()
+        if 'notes_note_fts' not in line
+    ))
+    target.close()
+    connections.databases[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(path),
+    }
+    connections.ensure_defaults(alias)
+    connections.prepare_test_settings(alias)
+    settings.DATABASE_REPLICAS = [alias]
+    yield alias
+    connections[alias].close()
+    del connections[alias]
+    del connections.databases[alias]
@@ -1,7 +1,17 @@
+import io
+import json
+import zipfile
+from http import HTTPStatus
+
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from notes.cache import LRUCache
 from notes.forms import NoteForm
+from notes.models import Note
+from notes.views import NotesList
 
 
 @pytest.mark.parametrize(
@@ -39,3 +49,186 @@ def test_pages_contains_form(author_client, name, args):
     response = author_client.get(reverse(name, args=args))
     assert 'form' in response.context
     assert isinstance(response.context['form'], NoteForm)
+
+
+def test_notes_list_keyset_pagination(author, author_client, monkeypatch):
+    """
+    Проверяю, что список заметок разбит на страницы по курсору, а поле text
+    при выборке списка не загружается.
+    """
+    monkeypatch.setattr(NotesList, 'per_page', 2)
+    notes = Note.objects.bulk_create(
+        Note(title=f'Заметка {index}', text='Текст', slug=f'note-{index}',
+             author=author)
+        for index in range(3)
+    )
+    url = reverse('notes:list')
+    first_page = author_client.get(url).context
+    assert len(first_page['object_list']) == 2
+    assert first_page['page'].prev_cursor is None
+    assert 'text' in first_page['object_list'][0].get_deferred_fields()
+    second_page = author_client.get(
+        url, {'after': first_page['page'].next_cursor}
+    ).context
+    assert [note.slug for note in second_page['object_list']] == [
+        notes[2].slug
+    ]
+    assert second_page['page'].next_cursor is None
+    back_page = author_client.get(
+        url, {'before': second_page['page'].prev_cursor}
+    ).context
+    assert list(back_page['object_list']) == list(first_page['object_list'])
+
+
+def test_notes_list_filtered_by_tag(author, author_client, monkeypatch):
+    """
+    Проверяю, что список фильтруется по тегу по индексу связей, страницы
+    фильтра сохраняют тег, а теги показаны с числом заметок.
+    """
+    monkeypatch.setattr(NotesList, 'per_page', 1)
+    for index in range(4):
+        author_client.post(reverse('notes:add'), {
+            'title': f'Заметка {index}', 'text': 'Текст',
+            'slug': f'note-{index}', 'tags': '' if index % 2 else 'чётные',
+        })
+    url = reverse('notes:list')
+    with CaptureQueriesContext(connection) as queries:
+        response = author_client.get(url, {'tag': 'чётные'})
+    assert [note.slug for note in response.context['object_list']] == [
+        'note-0'
+    ]
+    page_query, = [
+        query['sql'] for query in queries if 'notes_notetag' in query['sql']
+    ]
+    assert '"notes_note"."author_id"' not in page_query
+    content = response.content.decode()
+    assert 'чётные (2)' in content
+    next_cursor = response.context['page'].next_cursor
+    assert (
+        f'?tag=%D1%87%D1%91%D1%82%D0%BD%D1%8B%D0%B5&amp;after={next_cursor}'
+    ) in content
+    assert [note.slug for note in author_client.get(
+        url, {'tag': 'чётные', 'after': next_cursor}
+    ).context['object_list']] == ['note-2']
+    assert list(
+        author_client.get(url, {'tag': 'нет'}).context['object_list']
+    ) == []
+
+
+@pytest.mark.parametrize(
+    'parametrized_client, note_found',
+    (
+        (pytest.lazy_fixture('author_client'), True),
+        (pytest.lazy_fixture('not_author_client'), False),
+    )
+)
+def test_search_finds_only_own_notes(note, parametrized_client, note_found):
+    """
+    Проверяю, что поиск находит заметку по слову из текста, подсвечивает его
+    и не показывает чужие заметки.
+    """
+    response = parametrized_client.get(reverse('notes:search'), {'q': 'текс'})
+    found = response.context['object_list']
+    assert (note in found) is note_found
+    if note_found:
+        assert '<mark>Текст</mark>' in found[0].snippet
+
+
+def test_unchanged_notes_list_is_served_from_cache(author_client, note,
+                                                   form_data):
+    """
+    Проверяю, что повторный показ неизменного списка не делает запросов к
+    заметкам, а после изменения заметки список обновляется.
+    """
+    url = reverse('notes:list')
+    author_client.get(url)
+    with CaptureQueriesContext(connection) as queries:
+        response = author_client.get(url)
+    assert not [
+        query for query in queries if 'notes_note' in query['sql']
+    ]
+    assert note.title in response.content.decode()
+    author_client.post(
+        reverse('notes:edit', args=(note.slug,)), form_data
+    )
+    assert form_data['title'] in author_client.get(url).content.decode()
+
+
+def test_header_shows_stats_with_user_fetch(
+    author_client, form_data, django_capture_on_commit_callbacks,
+):
+    """
+    Проверяю, что шапка показывает число заметок и объём, а статистика
+    читается тем же запросом, что и пользователь.
+    """
+    with django_capture_on_commit_callbacks(execute=True):
+        author_client.post(reverse('notes:add'), form_data)
+    with CaptureQueriesContext(connection) as queries:
+        response = author_client.get(reverse('notes:home'))
+    assert 'заметок: 1,' in response.content.decode()
+    stats_queries = [
+        query['sql'] for query in queries
+        if 'notes_authorstats' in query['sql']
+    ]
+    assert len(stats_queries) == 1
+    assert 'auth_user' in stats_queries[0]
+
+
+def test_note_detail_served_from_object_cache(author_client, note, form_data):
+    """
+    Проверяю, что повторные открытия заметки, её правка и удаление не
+    читают заметку из базы, а после правки показывается новая версия.
+    """
+    detail_url = reverse('notes:detail', args=(note.slug,))
+    author_client.get(detail_url)
+    with CaptureQueriesContext(connection) as queries:
+        author_client.get(detail_url)
+        author_client.get(reverse('notes:edit', args=(note.slug,)))
+    assert not [
+        query for query in queries if 'notes_note' in query['sql']
+    ]
+    author_client.post(reverse('notes:edit', args=(note.slug,)), form_data)
+    response = author_client.get(
+        reverse('notes:detail', args=(form_data['slug'],))
+    )
+    assert response.context['object'].title == form_data['title']
+    assert author_client.get(detail_url).status_code == HTTPStatus.NOT_FOUND
+
+
+def test_local_note_cache_evicts_least_recently_used(settings):
+    """Проверяю, что кеш процесса вытесняет давно не читанные заметки."""
+    settings.NOTES_OBJECT_CACHE_SIZE = 2
+    lru = LRUCache()
+    lru.set('a', b'1')
+    lru.set('b', b'2')
+    lru.get('a')
+    lru.set('c', b'3')
+    assert (lru.get('a'), lru.get('b'), lru.get('c')) == (b'1', None, b'3')
+
+
+def test_export_zip_contains_markdown_notes(author_client, note,
+                                            not_author):
+    """
+    Проверяю, что выгрузка в ZIP отдаётся потоком и содержит только заметки
+    пользователя в Markdown.
+    """
+    Note.objects.create(title='Чужая', text='Текст', author=not_author)
+    response = author_client.get(reverse('notes:export'), {'format': 'zip'})
+    assert response.streaming
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+    assert archive.namelist() == [f'{note.slug}.md']
+    assert archive.read(f'{note.slug}.md').decode() == (
+        f'# {note.title}\n\n{note.text}\n'
+    )
+
+
+def test_export_jsonl(author_client, note):
+    """
+    Проверяю, что выгрузка в JSONL содержит по строке на заметку и не
+    читает HTML текста.
+    """
+    response = author_client.get(reverse('notes:export'))
+    with CaptureQueriesContext(connection) as queries:
+        lines = b''.join(response.streaming_content).decode().splitlines()
+    assert [json.loads(line)['slug'] for line in lines] == [note.slug]
+    assert not [query for query in queries if 'text_html' in query['sql']]
@@ -1,12 +1,21 @@
 from http import HTTPStatus
+from io import StringIO
 
 import pytest
 from pytils.translit import slugify
 from pytest_django.asserts import assertFormError, assertRedirects
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
 from django.urls import reverse
 
+from notes import checks, markup, search, sharding, slugs
+from notes.fields import Compressed
+from notes.db import apply_sqlite_pragmas
 from notes.forms import WARNING
-from notes.models import Note
+from notes.models import (
+    AuthorStats, Note, ShardPlacement, SlugRegistry, Tag, Tombstone,
+)
+from notes.views import NoteChanges
 
 
 def test_user_can_create_note(author_client, author, form_data):
@@ -100,3 +109,604 @@ def test_other_user_cant_delete_note(not_author_client, slug_for_args):
     )
     assert response.status_code == HTTPStatus.NOT_FOUND
     assert Note.objects.count() == 1
+
+
+def test_search_index_follows_edit_and_delete(author_client, form_data,
+                                              note, slug_for_args):
+    """
+    Проверяю, что поисковый индекс обновляется при редактировании и удалении
+    заметки.
+    """
+    search_url = reverse('notes:search')
+    author_client.post(reverse('notes:edit', args=slug_for_args), form_data)
+    assert author_client.get(
+        search_url, {'q': 'заметки'}
+    ).context['object_list'] == []
+    assert len(author_client.get(
+        search_url, {'q': 'новый'}
+    ).context['object_list']) == 1
+    author_client.post(reverse('notes:delete', args=(form_data['slug'],)))
+    assert author_client.get(
+        search_url, {'q': 'новый'}
+    ).context['object_list'] == []
+
+
+def test_search_index_scoped_by_author(author, not_author, note):
+    """
+    Проверяю, что MATCH находит только термы автора, а найденные без учёта
+    регистра слова подсвечиваются в заголовке и фрагменте текста.
+    """
+    Note.objects.create(
+        title='Заголовок', text='Текст заметки', slug='other',
+        author=not_author,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {search.FTS_TABLE} '
+            f'WHERE {search.FTS_TABLE} MATCH %s',
+            [search.build_match('текст', author.pk)],
+        )
+        assert cursor.fetchall() == [(note.pk,)]
+    note.title, note.text = 'Ёлка', 'Длинный текст про ёлку и подарки'
+    note.save()
+    (found,), _ = search.search_notes(
+        Note.objects.for_author(author), author, 'ЁЛК'
+    )
+    assert found.title_html == '<mark>Ёлка</mark>'
+    assert '<mark>ёлку</mark>' in found.snippet
+
+
+def test_tag_counts_follow_edit_and_delete(author, author_client, form_data,
+                                           note, slug_for_args):
+    """
+    Проверяю, что теги из формы приводятся к одному виду, а число заметок
+    с тегом меняется при правке и удалении заметок.
+    """
+    form_data['tags'] = 'Работа,  идеи , работа'
+    author_client.post(reverse('notes:edit', args=slug_for_args), form_data)
+    author_client.post(reverse('notes:add'), {
+        'title': 'Вторая', 'text': 'Текст', 'slug': 'second', 'tags': 'идеи',
+    })
+
+    def counts():
+        return dict(Tag.objects.for_author(author).values_list(
+            'name', 'note_count'
+        ))
+
+    assert counts() == {'идеи': 2, 'работа': 1}
+    assert Note.objects.get(slug='new-slug').tag_list() == ['идеи', 'работа']
+    form_data['tags'] = 'работа'
+    author_client.post(reverse('notes:edit', args=('new-slug',)), form_data)
+    assert counts() == {'идеи': 1, 'работа': 1}
+    Note.objects.filter(author=author).delete()
+    assert counts() == {'идеи': 0, 'работа': 0}
+
+
+def test_author_stats_follow_writes_and_reconcile(author, author_client,
+                                                  form_data, note,
+                                                  slug_for_args):
+    """
+    Проверяю, что статистика автора меняется вместе с заметками, а
+    reconcile_stats исправляет расхождение.
+    """
+    def stats():
+        return AuthorStats.objects.filter(author=author).values_list(
+            'note_count', 'text_bytes'
+        ).get()
+
+    def actual():
+        notes = Note.objects.filter(author=author)
+        return notes.count(), sum(
+            len(Note._meta.get_field('text').get_prep_value(note.text))
+            for note in notes
+        )
+
+    form_data['text'] = 'Длинный текст. ' * 200
+    author_client.post(reverse('notes:edit', args=slug_for_args), form_data)
+    Note.objects.bulk_create(
+        Note(title='Пакет', text='Текст пакета', slug=f'batch-{index}',
+             author=author)
+        for index in range(2)
+    )
+    assert stats() == actual()
+    Note.objects.filter(slug='batch-0').delete()
+    author_client.post(reverse('notes:delete', args=('batch-1',)))
+    assert stats() == actual() == (1, stats()[1])
+    AuthorStats.objects.filter(author=author).update(note_count=7)
+    output = StringIO()
+    call_command(
+        'reconcile_stats', batch_size=1, local_cache=True, stdout=output
+    )
+    assert f'Исправлена статистика автора {author.pk}.' in output.getvalue()
+    assert stats() == actual()
+
+
+def test_slug_allocation_retries_on_conflict(author, monkeypatch):
+    """
+    Проверяю, что если свободный slug успели занять между проверкой и
+    сохранением, заметка сохраняется со следующим вариантом.
+    """
+    Note.objects.create(title='Заметка', text='Текст', author=author)
+    real_taken_slugs = slugs.taken_slugs
+    calls = []
+
+    def stale_taken_slugs(*args):
+        # Первая проверка «не видит» уже занятый slug.
+        calls.append(args)
+        return set() if len(calls) == 1 else real_taken_slugs(*args)
+
+    monkeypatch.setattr(slugs, 'taken_slugs', stale_taken_slugs)
+    note = Note.objects.create(title='Заметка', text='Текст', author=author)
+    assert note.slug == slugify('Заметка') + '-2'
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize(
+    'file_name, content',
+    (
+        (
+            'notes.jsonl',
+            '{"author": "Автор", "title": "Заметка", "text": "Текст"}\n'
+            '{"author": "Автор", "title": "Заметка", "text": "Ещё"}\n'
+            '{"author": "Никто", "title": "Чужая", "text": "Текст"}\n'
+        ),
+        (
+            'notes.csv',
+            'author,title,text\n'
+            'Автор,Заметка,Текст\n'
+            'Автор,Заметка,"Многострочный\nтекст"\n'
+            'Никто,Чужая,Текст\n'
+        ),
+    )
+)
+def test_import_notes(author, note, tmp_path, file_name, content):
+    """
+    Проверяю, что команда import_notes создаёт заметки пачками, подбирает
+    уникальные slug и пропускает строки неизвестных авторов.
+    """
+    path = tmp_path / file_name
+    path.write_text(content, encoding='utf-8')
+    call_command(
+        'import_notes', str(path), batch_size=2, local_cache=True,
+        stdout=StringIO(),
+    )
+    imported = Note.objects.exclude(pk=note.pk).order_by('id')
+    assert [imported_note.slug for imported_note in imported] == [
+        'zametka', 'zametka-2'
+    ]
+    assert all(
+        imported_note.author == author for imported_note in imported
+    )
+
+
+def test_import_notes_resumes_from_offset(author, tmp_path):
+    """Проверяю, что импорт можно продолжить с байтового смещения."""
+    first = '{"author": "Автор", "title": "Первая", "text": "Текст"}\n'
+    path = tmp_path / 'notes.jsonl'
+    path.write_text(
+        first + '{"author": "Автор", "title": "Вторая", "text": "Текст"}\n',
+        encoding='utf-8'
+    )
+    call_command(
+        'import_notes', str(path), offset=len(first.encode()),
+        local_cache=True, stdout=StringIO(),
+    )
+    assert list(Note.objects.values_list('title', flat=True)) == ['Вторая']
+
+
+def test_import_notes_skips_malformed_rows(author, tmp_path):
+    """
+    Проверяю, что недопустимый slug заменяется транслитерацией, а строки,
+    которые не являются объектом с текстовыми полями, пропускаются.
+    """
+    path = tmp_path / 'notes.jsonl'
+    path.write_text(
+        '{"author": "Автор", "title": "Первая", "text": "Текст", '
+        '"slug": "my note/ü"}\n'
+        '["не объект"]\n'
+        '{"author": ["Автор"], "title": "Вторая", "text": "Текст"}\n'
+        '{"author": "Автор", "title": "Третья", "text": 3}\n'
+        '{broken\n',
+        encoding='utf-8'
+    )
+    output = StringIO()
+    call_command(
+        'import_notes', str(path), local_cache=True, stdout=output
+    )
+    assert list(Note.objects.values_list('slug', flat=True)) == ['my-note']
+    assert 'импортировано 1, пропущено 4' in output.getvalue()
+
+
+def test_import_notes_reports_committed_offset(author, tmp_path):
+    """
+    Проверяю, что при ошибке чтения импорт сообщает смещение после
+    последней записанной пачки и с него продолжается без потерь.
+    """
+    path = tmp_path / 'notes.jsonl'
+    path.write_bytes(b''.join(
+        f'{{"author": "Автор", "title": "t{number}", "text": "Текст"}}\n'
+        .encode() for number in range(3)
+    ) + b'\xff\n')
+    with pytest.raises(CommandError) as error:
+        call_command(
+            'import_notes', str(path), batch_size=2, local_cache=True,
+            stdout=StringIO(),
+        )
+    offset = int(str(error.value).split('смещении ')[1].split(':')[0])
+    assert sorted(Note.objects.values_list('title', flat=True)) == [
+        't0', 't1'
+    ]
+    path.write_bytes(path.read_bytes()[:-2])
+    call_command(
+        'import_notes', str(path), offset=offset, local_cache=True,
+        stdout=StringIO(),
+    )
+    assert sorted(Note.objects.values_list('title', flat=True)) == [
+        't0', 't1', 't2'
+    ]
+
+
+def test_batch_api_applies_all_operations(author_client, author, note):
+    """
+    Проверяю, что пакет из создания, изменения и удаления применяется одним
+    запросом к API и возвращает результат по каждой операции.
+    """
+    second = Note.objects.create(title='Вторая', text='Текст', author=author)
+    operations = [
+        {'action': 'create', 'data': {'title': 'Вторая', 'text': 'Новая'}},
+        {'action': 'update', 'slug': note.slug,
+         'data': {'title': 'Новый заголовок', 'text': 'Новый текст',
+                  'slug': note.slug}},
+        {'action': 'delete', 'slug': second.slug},
+    ]
+    response = author_client.post(
+        reverse('notes:api'), {'operations': operations},
+        content_type='application/json'
+    )
+    assert response.status_code == HTTPStatus.OK
+    results = response.json()['results']
+    assert [result['status'] for result in results] == ['ok'] * 3
+    assert results[0]['slug'] == slugify('Вторая') + '-2'
+    note.refresh_from_db()
+    assert note.title == 'Новый заголовок'
+    assert not Note.objects.filter(pk=second.pk).exists()
+    assert Note.objects.filter(slug=results[0]['slug']).exists()
+
+
+def test_batch_api_rejects_whole_batch_on_error(author_client, note,
+                                                not_author):
+    """
+    Проверяю, что при ошибке в одной операции пакет не применяется, а чужие
+    заметки в пакете не находятся.
+    """
+    foreign = Note.objects.create(
+        title='Чужая', text='Текст', slug='foreign', author=not_author
+    )
+    operations = [
+        {'action': 'create', 'data': {'title': 'Новая', 'text': 'Текст',
+                                      'slug': note.slug}},
+        {'action': 'delete', 'slug': foreign.slug},
+        {'action': 'create', 'data': {'title': 'Ещё одна', 'text': 'Текст'}},
+    ]
+    response = author_client.post(
+        reverse('notes:api'), {'operations': operations},
+        content_type='application/json'
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    results = response.json()['results']
+    assert results[0]['errors'] == {'slug': [note.slug + WARNING]}
+    assert results[1]['errors'] == {'slug': ['Заметка не найдена.']}
+    assert results[2]['status'] == 'ok'
+    assert Note.objects.count() == 2
+
+
+@pytest.mark.parametrize('operation', (
+    {'action': 'create', 'data': 'x'},
+    {'action': 'create', 'data': ['x']},
+    {'action': 'update', 'slug': 'note-slug'},
+))
+def test_batch_api_rejects_data_that_is_not_object(author_client, note,
+                                                   operation):
+    """Проверяю, что data не объектом — ошибка операции, а не сбой."""
+    response = author_client.post(
+        reverse('notes:api'), {'operations': [operation]},
+        content_type='application/json'
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json()['results'][0]['errors'] == {
+        'data': ['Ожидается объект с полями заметки.']
+    }
+
+
+def test_changes_feed(author_client, author, note, form_data, monkeypatch):
+    """
+    Проверяю, что лента изменений отдаёт изменённые заметки и slug удалённых
+    (в том числе прежний slug переименованной заметки) порциями по токену.
+    """
+    monkeypatch.setattr(NoteChanges, 'per_page', 2)
+    url = reverse('notes:changes')
+    other = Note.objects.create(title='Вторая', text='Текст', author=author)
+    token = author_client.get(url, {'since': 0}).json()['next']
+    author_client.post(reverse('notes:edit', args=(note.slug,)), form_data)
+    author_client.post(reverse('notes:delete', args=(other.slug,)))
+    first = author_client.get(url, {'since': token}).json()
+    assert first['has_more'] is True
+    assert first['deleted'] == [
+        {'slug': note.slug, 'revision': int(token) + 1}
+    ]
+    assert [row['slug'] for row in first['notes']] == [form_data['slug']]
+    second = author_client.get(url, {'since': first['next']}).json()
+    assert second['has_more'] is False
+    assert [row['slug'] for row in second['deleted']] == [other.slug]
+    assert second['notes'] == []
+    third = author_client.get(url, {'since': second['next']}).json()
+    assert third == {
+        'notes': [], 'deleted': [], 'next': second['next'], 'has_more': False
+    }
+
+
+@pytest.mark.django_db
+def test_seed_notes_generates_users_and_notes(django_user_model):
+    """
+    Проверяю, что seed_notes создаёт пользователей с заметками, а длина
+    текстов распределена вокруг заданной медианы.
+    """
+    call_command(
+        'seed_notes', users=3, notes=40, text_median=200, local_cache=True,
+        stdout=StringIO(),
+    )
+    users = django_user_model.objects.filter(username__startswith='bench')
+    assert users.count() == 3
+    assert all(user.check_password('bench-password') for user in users)
+    assert Note.objects.count() == 120
+    lengths = sorted(len(note.text) for note in Note.objects.only('text'))
+    assert lengths[0] < 200 < lengths[-1]
+    assert 100 < lengths[len(lengths) // 2] < 400
+
+
+@pytest.mark.django_db
+def test_sqlite_pragmas_applied_to_connection(settings):
+    """Проверяю, что PRAGMA из SQLITE_PRAGMAS применяются к соединению."""
+    settings.SQLITE_PRAGMAS = {'cache_size': -12345}
+    apply_sqlite_pragmas(sender=None, connection=connection)
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA cache_size')
+        assert cursor.fetchone() == (-12345,)
+
+
+def test_hash_ring_moves_few_authors_to_new_shard():
+    """
+    Проверяю, что после добавления шарда на него переезжает лишь часть
+    авторов, а остальные остаются на прежних шардах.
+    """
+    old = sharding.HashRing(('shard1', 'shard2', 'shard3'))
+    new = sharding.HashRing(('shard1', 'shard2', 'shard3', 'shard4'))
+    moved = [
+        author_id for author_id in range(1, 1001)
+        if old.shard_for(author_id) != new.shard_for(author_id)
+    ]
+    assert {new.shard_for(author_id) for author_id in moved} == {'shard4'}
+    assert 150 < len(moved) < 350
+
+
+def test_shard_router_routes_notes_by_author(settings, author, note):
+    """
+    Проверяю, что заметки направляются на шард автора, закреплённый в
+    каталоге, а пользователи остаются в основной базе.
+    """
+    settings.NOTE_SHARDS = ['shard1', 'shard2']
+    router = sharding.ShardRouter()
+    shard = router.db_for_write(Note, instance=note)
+    assert shard in settings.NOTE_SHARDS
+    assert router.db_for_read(Note, author_id=author.pk) == shard
+    assert author.note_shard.shard == shard
+    assert router.db_for_read(type(author)) == sharding.DIRECTORY_DB
+    settings.NOTE_SHARDS = []
+    assert router.db_for_read(Note, instance=note) is None
+
+
+@pytest.mark.django_db
+def test_slugs_unique_across_shards(shards, author, not_author):
+    """
+    Проверяю, что slug уникален на всех шардах, пересохранение с тем же
+    slug его не освобождает, а откат транзакции шарда возвращает реестр.
+    """
+    ShardPlacement.objects.create(author=author, shard='shard1')
+    ShardPlacement.objects.create(author=not_author, shard='shard2')
+    note = Note.objects.create(title='Заметка', text='Текст', author=author)
+    with pytest.raises(IntegrityError):
+        Note.objects.create(
+            title='Другая', text='Текст', slug=note.slug, author=not_author
+        )
+    other = Note.objects.create(
+        title='Заметка', text='Текст', author=not_author
+    )
+    assert (note.slug, other.slug) == ('zametka', 'zametka-2')
+    assert Note.objects.using('shard2').get().slug == other.slug
+    note.slug = ''
+    note.save()
+    assert note.slug == 'zametka'
+    assert not Tombstone.objects.using('shard1').exists()
+    registry = SlugRegistry.objects.values_list('slug', flat=True)
+    assert set(registry) == {'zametka', 'zametka-2'}
+    with pytest.raises(RuntimeError):
+        with sharding.atomic('shard1'):
+            note.delete()
+            Note.objects.create(
+                title='Новая', text='Текст', slug='fresh', author=author
+            )
+            raise RuntimeError
+    assert set(registry) == {'zametka', 'zametka-2'}
+    assert Note.objects.using('shard1').filter(slug='zametka').exists()
+
+
+@pytest.mark.django_db
+def test_user_deletion_removes_notes_from_shard(shards, author, not_author):
+    """
+    Проверяю, что при удалении пользователя его заметки и их slug
+    удаляются с шарда и из реестра, а чужие остаются.
+    """
+    ShardPlacement.objects.create(author=author, shard='shard2')
+    ShardPlacement.objects.create(author=not_author, shard='shard2')
+    Note.objects.create(
+        title='Своя', text='Текст', slug='own', author=author
+    )
+    Note.objects.create(
+        title='Чужая', text='Текст', slug='other', author=not_author
+    )
+    author.delete()
+    assert list(
+        Note.objects.using('shard2').values_list('slug', flat=True)
+    ) == ['other']
+    assert not AuthorStats.objects.using('shard2').filter(
+        author_id=author.pk
+    ).exists()
+    assert list(SlugRegistry.objects.values_list('slug', flat=True)) == [
+        'other'
+    ]
+    assert not ShardPlacement.objects.filter(author_id=author.pk).exists()
+
+
+@pytest.mark.django_db
+def test_rebalance_moves_author_to_ring_shard(
+    shards, author, django_capture_on_commit_callbacks
+):
+    """
+    Проверяю, что rebalance_shards переносит заметки, теги и статистику
+    автора на шард по кольцу и переключает каталог.
+    """
+    target = sharding.get_ring().shard_for(author.pk)
+    source = next(shard for shard in shards if shard != target)
+    ShardPlacement.objects.create(author=author, shard=source)
+    note = Note(title='Заметка', text='Текст', author=author)
+    note.tag_names = ['тег']
+    note.save()
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command('rebalance_shards', local_cache=True, stdout=StringIO())
+    assert not Note.objects.using(source).exists()
+    moved = Note.objects.for_author(author).get()
+    assert (moved.slug, moved._state.db) == (note.slug, target)
+    assert moved.tag_list() == ['тег']
+    assert AuthorStats.objects.using(target).get(
+        author_id=author.pk
+    ).note_count == 1
+    assert ShardPlacement.objects.get(author=author).shard == target
+    assert SlugRegistry.objects.get().author_id == author.pk
+
+
+@pytest.mark.django_db
+def test_failed_move_keeps_placement(shards, author, monkeypatch):
+    """
+    Проверяю, что ошибка после переключения каталога откатывает и его:
+    автор остаётся на прежнем шарде со всеми заметками.
+    """
+    target = sharding.get_ring().shard_for(author.pk)
+    source = next(shard for shard in shards if shard != target)
+    ShardPlacement.objects.create(author=author, shard=source)
+    note = Note.objects.create(title='Заметка', text='Текст', author=author)
+    drop_notes = sharding.drop_notes
+
+    def fail_on_source(using, *args, **kwargs):
+        if using == source:
+            raise IntegrityError('сбой на source')
+        return drop_notes(using, *args, **kwargs)
+
+    monkeypatch.setattr(sharding, 'drop_notes', fail_on_source)
+    with pytest.raises(IntegrityError):
+        sharding.move_author(author.pk, source, target)
+    assert ShardPlacement.objects.get(author=author).shard == source
+    assert sharding.shard_for_author(author.pk) == source
+    assert Note.objects.for_author(author).get().slug == note.slug
+
+
+def test_shards_require_shared_cache(settings, shared_cache):
+    """Проверяю, что шарды с каталогом в кеше процесса не пропускаются."""
+    settings.NOTE_SHARDS = ['shard1']
+    assert checks.check_shard_cache(None) == []
+    settings.CACHES = {
+        **settings.CACHES,
+        settings.NOTES_CACHE: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+    assert [
+        error.id for error in checks.check_shard_cache(None)
+    ] == ['notes.E002']
+
+
+def test_long_text_stored_compressed(author_client, author, form_data):
+    """
+    Проверяю, что длинный текст хранится сжатым, распаковывается при
+    первом обращении и доходит до страницы и ленты изменений целиком.
+    """
+    form_data['text'] = '\n'.join(['строка журнала'] * 5000)
+    author_client.post(reverse('notes:add'), data=form_data)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT length(text) FROM notes_note')
+        assert cursor.fetchone()[0] < len(form_data['text']) // 100
+    note = Note.objects.get()
+    assert isinstance(note.__dict__['text'], Compressed)
+    assert note.text == form_data['text']
+    assert not isinstance(note.__dict__['text'], Compressed)
+    response = author_client.get(reverse('notes:detail', args=(note.slug,)))
+    assert response.context['note'].text == form_data['text']
+    feed = author_client.get(reverse('notes:changes'), {'since': 0}).json()
+    assert feed['notes'][0]['text'] == form_data['text']
+
+
+def test_markdown_rendered_once_and_sanitized(
+    author_client, author, form_data, monkeypatch
+):
+    """
+    Проверяю, что Markdown рендерится при сохранении без опасной разметки
+    и не перерисовывается, пока текст не изменился.
+    """
+    form_data['text'] = '**жирный** <script>alert(1)</script>'
+    author_client.post(reverse('notes:add'), data=form_data)
+    note = Note.objects.get()
+    assert '<strong>жирный</strong>' in note.text_html
+    assert '<script>' not in note.text_html
+    assert note.text_hash == markup.content_hash(note.text)
+    calls = []
+    monkeypatch.setattr(
+        markup, 'render_markdown', lambda text: calls.append(text) or text
+    )
+    note.title = 'Новый заголовок'
+    note.save()
+    Note.objects.get().save()
+    assert calls == []
+    note.text = 'Новый текст'
+    note.save()
+    assert calls == ['Новый текст']
+
+
+def test_render_notes_after_renderer_version_change(
+    author, note, monkeypatch
+):
+    """Проверяю, что render_notes перерисовывает устаревший HTML."""
+    monkeypatch.setattr(markup, 'RENDERER_VERSION', 2)
+    monkeypatch.setattr(
+        markup, 'render_markdown', lambda text: f'<p>v2 {text}</p>'
+    )
+    revision = note.revision
+    call_command('render_notes', local_cache=True, stdout=StringIO())
+    note.refresh_from_db()
+    assert note.text_html == f'<p>v2 {note.text}</p>'
+    assert note.html_version == 2
+    assert note.revision == revision
+
+
+def test_write_commands_require_shared_cache(shared_cache, note, settings):
+    """
+    Проверяю, что команды, меняющие заметки, не запускаются с кешем
+    процесса: версии заметок, которые они повышают, серверы не увидят.
+    """
+    call_command('render_notes', stdout=StringIO())
+    settings.CACHES = {
+        **settings.CACHES,
+        settings.NOTES_CACHE: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+    with pytest.raises(CommandError, match='YANOTE_CACHE_DIR'):
+        call_command('render_notes', stdout=StringIO())
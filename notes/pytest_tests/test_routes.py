@@ -1,8 +1,35 @@
+import asyncio
+import importlib
+import json
+import pstats
+import threading
+import time
+from functools import partial
 from http import HTTPStatus
+from io import StringIO
 
+import brotli
 import pytest
 from pytest_django.asserts import assertRedirects
-from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.template import engines
+from django.templatetags.static import static
+from django.db import OperationalError, connection, connections
+from django.test import AsyncClient, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, reverse
+from django.utils.http import http_date
+
+import notes.urls
+import yanote.urls
+from notes import (
+    aio, checks, events, metrics, profiling, sessions, warmup,
+)
+from notes.db import REPLICA_PIN_COOKIE, ReplicaRouter, replica_reads
+from notes.models import Note, ProfileDump
 
 
 @pytest.mark.parametrize(
@@ -56,9 +83,621 @@ def test_pages_availability_for_author(parametrized_client, expected_status,
         ('notes:add', None),
         ('notes:success', None),
         ('notes:list', None),
+        ('notes:search', None),
+        ('notes:export', None),
     ),
 )
 def test_redirects(client, name, args):
     login_url = reverse('users:login')
     url = reverse(name, args=args)
     assertRedirects(client.get(url), f'{login_url}?next={url}')
+
+
+@pytest.mark.parametrize('name, params', (
+    ('notes:list', {'after': 'x'}),
+    ('notes:list', {'after': '9' * 23}),
+    ('notes:list', {'before': f'-{"9" * 23}'}),
+    ('notes:changes', {'since': '9' * 23}),
+    ('notes:search', {'q': 'текст', 'cursor': f'1.0_{"9" * 23}'}),
+    ('notes:search', {'q': 'текст', 'cursor': 'nan_1'}),
+))
+def test_bad_cursor_not_found(author_client, name, params):
+    """Проверяю, что некорректный или слишком большой курсор даёт 404."""
+    response = author_client.get(reverse(name), params)
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.parametrize(
+    'name, args',
+    (
+        ('notes:detail', pytest.lazy_fixture('slug_for_args')),
+        ('notes:list', None),
+    ),
+)
+def test_conditional_get(author_client, note, name, args,
+                         django_assert_max_num_queries):
+    """
+    Проверяю, что страницы заметки и списка заметок отдают ETag, а на
+    повторный запрос с ним отвечают 304 без рендеринга.
+    """
+    url = reverse(name, args=args)
+    response = author_client.get(url)
+    assert response.status_code == HTTPStatus.OK
+    headers = {'HTTP_IF_NONE_MATCH': response['ETag']}
+    if response.has_header('Last-Modified'):
+        headers['HTTP_IF_MODIFIED_SINCE'] = response['Last-Modified']
+    # Сессия, пользователь и не больше одного запроса валидаторов.
+    with django_assert_max_num_queries(3):
+        response = author_client.get(url, **headers)
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+
+def test_conditional_get_after_delete(author_client, author, note):
+    """Проверяю, что после удаления заметки ETag списка меняется."""
+    url = reverse('notes:list')
+    Note.objects.create(title='Вторая', text='Текст', author=author)
+    etag = author_client.get(url)['ETag']
+    note.delete()
+    response = author_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == HTTPStatus.OK
+
+
+def test_list_not_cached_by_modified_since_after_delete(
+    author_client, author, note
+):
+    """
+    Проверяю, что после удаления заметки список не отвечает 304 на один
+    If-Modified-Since: MAX(updated) удаление не меняет.
+    """
+    url = reverse('notes:list')
+    Note.objects.create(title='Вторая', text='Текст', author=author)
+    response = author_client.get(url)
+    assert not response.has_header('Last-Modified')
+    note.delete()
+    response = author_client.get(
+        url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+    )
+    assert response.status_code == HTTPStatus.OK
+
+
+def test_detail_etag_changes_with_other_notes(author_client, author, note):
+    """
+    Проверяю, что после создания другой заметки страница заметки не
+    отвечает 304 ни по ETag, ни по If-Modified-Since: в шапке число
+    заметок автора.
+    """
+    url = reverse('notes:detail', args=(note.slug,))
+    response = author_client.get(url)
+    assert not response.has_header('Last-Modified')
+    Note.objects.create(title='Вторая', text='Текст', author=author)
+    assert author_client.get(
+        url, HTTP_IF_NONE_MATCH=response['ETag']
+    ).status_code == HTTPStatus.OK
+    assert author_client.get(
+        url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+    ).status_code == HTTPStatus.OK
+
+
+def test_replica_router(settings):
+    """
+    Проверяю, что чтение заметок идёт на реплику только в разрешённом
+    контексте, а пользователи и запись — в основную базу.
+    """
+    settings.DATABASE_REPLICAS = ['replica1']
+    router = ReplicaRouter()
+    assert router.db_for_read(Note) is None
+    token = replica_reads.set(True)
+    try:
+        assert router.db_for_read(Note) == 'replica1'
+        assert router.db_for_read(get_user_model()) is None
+    finally:
+        replica_reads.reset(token)
+    assert router.allow_migrate('replica1', 'notes') is False
+
+
+def test_replica_reads_not_cached(author_client, note, replica, settings):
+    """
+    Проверяю, что при промахе кеша список и заметка читаются с реплики, но
+    прочитанное с отстающей реплики не попадает в кеш под версией заметок.
+    """
+    note.title = 'Новый заголовок'
+    note.save()
+    urls = (reverse('notes:list'), reverse('notes:detail', args=(note.slug,)))
+    with CaptureQueriesContext(connections[replica]) as queries:
+        for url in urls:
+            content = author_client.get(url).content.decode()
+            assert 'Заголовок' in content
+            assert note.title not in content
+    assert any('notes_note' in query['sql'] for query in queries)
+    # Реплика догнала основную базу: кеш не отдаёт прочитанное с неё.
+    settings.DATABASE_REPLICAS = []
+    for url in urls:
+        assert note.title in author_client.get(url).content.decode()
+
+
+def test_write_pins_client_to_primary(author_client, form_data):
+    """
+    Проверяю, что после изменения заметки клиент получает cookie, по которой
+    его чтения идут в основную базу.
+    """
+    response = author_client.post(reverse('notes:add'), data=form_data)
+    assert response.cookies[REPLICA_PIN_COOKIE].value == '1'
+    assert REPLICA_PIN_COOKIE not in author_client.get(
+        reverse('notes:list')
+    ).cookies
+
+
+def test_metrics_by_route_name(
+    author_client, client, note, settings, tmp_path
+):
+    """
+    Проверяю, что /metrics отдаёт гистограммы по именам маршрутов и
+    складывает снимки других процессов из METRICS_DIR.
+    """
+    settings.METRICS_DIR = str(tmp_path)
+    metrics.registry.clear()
+    author_client.get(reverse('notes:list'))
+    author_client.get(reverse('notes:detail', args=(note.slug,)))
+    other = metrics.Registry()
+    other.observe('sql_queries', 'notes:list', 4)
+    (tmp_path / '1.json').write_text(metrics.json.dumps(other.snapshot()))
+    body = client.get(reverse('metrics')).content.decode()
+    assert 'yanote_request_duration_seconds_count{view="notes:list"} 1' in body
+    assert 'yanote_render_duration_seconds_count{view="notes:detail"} 1' in (
+        body
+    )
+    assert 'yanote_sql_queries_count{view="notes:list"} 2' in body
+    settings.METRICS_TOKEN = 'secret'
+    assert client.get(reverse('metrics')).status_code == HTTPStatus.FORBIDDEN
+    assert client.get(
+        reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret'
+    ).status_code == HTTPStatus.OK
+
+
+@pytest.mark.django_db
+def test_repeated_sql_logged_as_n_plus_one(caplog, settings):
+    """Проверяю, что повторённый за запрос SQL попадает в лог как N+1."""
+    settings.NPLUSONE_THRESHOLD = 3
+
+    def view(request):
+        for pk in range(3):
+            list(Note.objects.filter(pk=pk))
+        return HttpResponse()
+
+    metrics.MetricsMiddleware(view)(RequestFactory().get('/'))
+    assert 'N+1 в <unresolved>: 3 раз' in caplog.text
+
+
+def test_profile_flag_for_staff_only(
+    author, author_client, note, settings, tmp_path
+):
+    """
+    Проверяю, что ?profile=pstats профилирует запрос сотрудника и
+    игнорируется для обычного пользователя.
+    """
+    settings.PROFILE_DIR = tmp_path
+    url = reverse('notes:list')
+    author_client.get(url, {'profile': 'pstats'})
+    assert not ProfileDump.objects.exists()
+    author.is_staff = True
+    author.save()
+    assert author_client.get(url, {'profile': 'pstats'}).status_code == (
+        HTTPStatus.OK
+    )
+    dump = ProfileDump.objects.get()
+    assert (dump.view_name, dump.user, dump.format) == (
+        'notes:list', author, 'pstats'
+    )
+    assert pstats.Stats(str(dump.file_path)).total_calls > 0
+
+
+def test_signed_profile_header_rotates_dumps(
+    admin_client, client, settings, tmp_path
+):
+    """
+    Проверяю, что подписанный заголовок X-Profile включает профиль, старые
+    профили сверх PROFILE_KEEP удаляются вместе с файлами, а профиль
+    можно скачать из админки.
+    """
+    settings.PROFILE_DIR = tmp_path
+    settings.PROFILE_KEEP = 1
+    settings.PROFILE_INTERVAL = 0.001
+    client.get(reverse('notes:home'), HTTP_X_PROFILE='подделка')
+    assert not ProfileDump.objects.exists()
+    token = profiling.make_token('collapsed')
+    for _ in range(2):
+        client.get(reverse('notes:home'), HTTP_X_PROFILE=token)
+    dump = ProfileDump.objects.get()
+    assert dump.view_name == 'notes:home' and dump.user is None
+    assert [path.name for path in tmp_path.iterdir()] == [dump.file_name]
+    response = admin_client.get(
+        reverse('admin:notes_profiledump_download', args=(dump.pk,))
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert b''.join(response.streaming_content) == (
+        dump.file_path.read_bytes()
+    )
+
+
+def test_session_and_user_served_from_cache(
+    shared_cache, author_client, author, django_assert_num_queries
+):
+    """
+    Сессия и пользователь повторного запроса берутся из кеша, а смена
+    пароля сбрасывает закешированного пользователя и разлогинивает.
+    """
+    url = reverse('notes:success')
+    author_client.get(url)
+    with django_assert_num_queries(0):
+        response = author_client.get(url)
+    assert response.context['user'] == author
+    author.set_password('Новый-пароль-1')
+    author.save()
+    assertRedirects(
+        author_client.get(url), f'{reverse("users:login")}?next={url}'
+    )
+
+
+def test_user_not_cached_in_process_cache(author_client):
+    """
+    Без общего кеша пользователь читается из базы на каждый запрос: смену
+    пароля в другом процессе кеш процесса не увидел бы.
+    """
+    url = reverse('notes:success')
+    author_client.get(url)
+    with CaptureQueriesContext(connection) as queries:
+        author_client.get(url)
+    assert any('auth_user' in query['sql'] for query in queries)
+
+
+def test_session_cache_check(settings, shared_cache):
+    """Проверяю, что notes.sessions в кеше процесса не пропускается."""
+    assert checks.check_session_cache(None) == []
+    settings.CACHES = {
+        **settings.CACHES,
+        settings.NOTES_CACHE: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+    assert [
+        error.id for error in checks.check_session_cache(None)
+    ] == ['notes.E001']
+
+
+def test_session_changes_written_behind(shared_cache, author_client):
+    session = author_client.session
+    session['theme'] = 'dark'
+    session.save()
+    assert 'theme' not in Session.objects.get(
+        session_key=session.session_key
+    ).get_decoded()
+    assert author_client.session['theme'] == 'dark'
+    sessions.flush_sessions(force=True)
+    assert Session.objects.get(
+        session_key=session.session_key
+    ).get_decoded()['theme'] == 'dark'
+
+
+def test_login_session_written_at_once(shared_cache, client, author):
+    author.set_password('password')
+    author.save()
+    client.post(
+        reverse('users:login'),
+        {'username': author.username, 'password': 'password'},
+    )
+    assert Session.objects.get(
+        session_key=client.session.session_key
+    ).get_decoded()['_auth_user_id'] == str(author.pk)
+
+
+def test_failed_session_flush_keeps_queue(
+    shared_cache, author_client, monkeypatch
+):
+    session = author_client.session
+    session['theme'] = 'dark'
+    session.save()
+
+    def locked(*args, **kwargs):
+        raise OperationalError('database is locked')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Session.objects, 'update_or_create', locked)
+        sessions.flush_sessions(force=True)
+    assert session.session_key in sessions.pending
+    sessions.flush_sessions(force=True)
+    assert not sessions.pending
+    assert Session.objects.get(
+        session_key=session.session_key
+    ).get_decoded()['theme'] == 'dark'
+
+
+@pytest.mark.parametrize('accept, encoding', (
+    ('gzip, deflate, br', 'br'),
+    ('gzip', 'gzip'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('identity', None),
+))
+def test_html_compressed_by_accept_encoding(
+    author_client, note, accept, encoding
+):
+    response = author_client.get(
+        reverse('notes:list'), HTTP_ACCEPT_ENCODING=accept
+    )
+    assert response.get('Content-Encoding') == encoding
+    assert 'Accept-Encoding' in response['Vary']
+
+
+def test_small_responses_not_compressed(client, settings):
+    settings.RESPONSE_COMPRESS_MIN_SIZE = 10 ** 6
+    response = client.get(reverse('notes:home'), HTTP_ACCEPT_ENCODING='gzip')
+    assert not response.has_header('Content-Encoding')
+
+
+def test_collected_static_served_precompressed(client, settings, tmp_path):
+    """
+    Проверяю, что collectstatic создаёт файлы с хешем и сжатые копии,
+    а хешированные файлы отдаются сжатыми с вечным кешированием.
+    """
+    settings.STATIC_ROOT = tmp_path
+    # Без статики приложений (admin): её сжатие только замедляет тест.
+    settings.STATICFILES_FINDERS = (
+        'django.contrib.staticfiles.finders.FileSystemFinder',
+    )
+    call_command('collectstatic', interactive=False, verbosity=0)
+    url = static('vendor/bootstrap-5.1.3/bootstrap.min.css')
+    assert url != '/static/vendor/bootstrap-5.1.3/bootstrap.min.css'
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+    assert response['Content-Encoding'] == 'br'
+    assert response['Content-Type'] == 'text/css'
+    assert 'immutable' in response['Cache-Control']
+    plain = client.get(url)
+    assert not plain.has_header('Content-Encoding')
+    assert brotli.decompress(
+        b''.join(response.streaming_content)
+    ) == b''.join(plain.streaming_content)
+    assert client.get('/static/../manage.py').status_code == (
+        HTTPStatus.NOT_FOUND
+    )
+
+
+@pytest.fixture
+def async_views(settings):
+    """URL-ы с асинхронными представлениями, как под ASGI."""
+    def reload_urls(enabled):
+        settings.ASYNC_VIEWS = enabled
+        importlib.reload(notes.urls)
+        importlib.reload(yanote.urls)
+        clear_url_caches()
+
+    reload_urls(True)
+    yield
+    reload_urls(False)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_views_run_database_work_in_pool(async_views, author, note):
+    """
+    Проверяю, что асинхронные представления отвечают через AsyncClient,
+    а запросы к базе выполняются в потоках пула notes.aio.
+    """
+    threads = set()
+
+    def remember_thread(execute, sql, params, many, context):
+        threads.add(threading.current_thread().name)
+        return execute(sql, params, many, context)
+
+    client = AsyncClient()
+    client.force_login(author)
+    with connection.execute_wrapper(remember_thread):
+        detail = asyncio.run(
+            client.get(reverse('notes:detail', args=(note.slug,)))
+        )
+        listing = asyncio.run(client.get(reverse('notes:list')))
+    assert detail.status_code == listing.status_code == HTTPStatus.OK
+    assert note.title in detail.content.decode()
+    assert note.title in listing.content.decode()
+    home = asyncio.run(client.get(reverse('notes:home')))
+    assert home.status_code == HTTPStatus.OK
+    anonymous = asyncio.run(AsyncClient().get(reverse('notes:list')))
+    assert anonymous.status_code == HTTPStatus.FOUND
+    # Потоки пула обращаются к базе через свои соединения.
+    assert not threads
+
+
+@pytest.mark.django_db
+def test_warm_up_compiles_templates_and_opens_pool(settings):
+    timings = warmup.warm_up(pool=True)
+    assert set(timings) == {
+        'urls', 'templates', 'markup', 'connections', 'pool'
+    }
+    loader = engines['django'].engine.template_loaders[0]
+    assert {'base.html', 'notes/list.html', 'notes/detail.html'} <= set(
+        loader.get_template_cache
+    )
+    pool = [
+        thread for thread in threading.enumerate()
+        if thread.name.startswith('yanote-db')
+    ]
+    assert len(pool) == settings.ASYNC_DB_WORKERS
+
+
+def test_profile_imports_reports_startup(monkeypatch, tmp_path):
+    monkeypatch.setenv('YANOTE_DATABASE', str(tmp_path / 'db.sqlite3'))
+    output = StringIO()
+    call_command('profile_imports', limit=5, stdout=output)
+    report = output.getvalue()
+    for stage in ('load', 'urls', 'templates', 'connections'):
+        assert f'  {stage} ' in report
+    assert '  django ' in report
+
+
+def test_event_stream_pushes_note_changes(
+    author_client, author, form_data, settings,
+    django_capture_on_commit_callbacks,
+):
+    settings.EVENTS_HEARTBEAT_SECONDS = 0.01
+    response = author_client.get(reverse('notes:events'))
+    assert response['Content-Type'].startswith('text/event-stream')
+    stream = iter(response.streaming_content)
+    assert next(stream) == events.RETRY
+    assert next(stream) == events.HEARTBEAT
+    with django_capture_on_commit_callbacks(execute=True):
+        author_client.post(reverse('notes:add'), data=form_data)
+    created = next(stream).decode()
+    assert created.startswith('id: 1\nevent: create\n')
+    assert form_data['title'] in created
+    # CreateView сохраняет заметку ещё раз: событие update.
+    assert next(stream).decode().startswith('id: 2\nevent: update\n')
+    with django_capture_on_commit_callbacks(execute=True):
+        author_client.post(
+            reverse('notes:edit', args=(form_data['slug'],)),
+            data={**form_data, 'slug': 'renamed'},
+        )
+        author_client.post(reverse('notes:delete', args=('renamed',)))
+    changes = [next(stream).decode().split('\n') for _ in range(3)]
+    assert [change[:2] for change in changes] == [
+        ['id: 3', 'event: delete'],
+        ['id: 4', 'event: update'],
+        ['id: 5', 'event: delete'],
+    ]
+    assert [json.loads(change[2][len('data: '):]) for change in changes] == [
+        {'slug': 'new-slug', 'revision': 3},
+        {
+            'id': 1, 'slug': 'renamed', 'title': form_data['title'],
+            'revision': 4, 'url': '/note/renamed/',
+        },
+        {'slug': 'renamed', 'revision': 5},
+    ]
+    response.close()
+    assert not events.get_broker().subscribers
+
+
+def test_event_stream_resumes_from_last_event_id(
+    author_client, author, note, form_data,
+):
+    author_client.post(reverse('notes:add'), data=form_data)
+    note.delete()
+    response = author_client.get(
+        reverse('notes:events'), HTTP_LAST_EVENT_ID='1'
+    )
+    stream = iter(response.streaming_content)
+    assert next(stream) == events.RETRY
+    # Пропущенное после события 1 приходит из базы: у новой заметки
+    # только последнее изменение.
+    assert next(stream).decode().startswith('id: 3\nevent: update\n')
+    assert next(stream).decode().startswith('id: 4\nevent: delete\n')
+    response.close()
+
+
+def test_event_stream_catches_up_after_gap(author, note):
+    stream = events.EventStream(Note.objects.for_author(author), author, 0)
+    # Событие 2 обогнало событие 1: недостающее берётся из базы.
+    assert stream.accept({'id': 2}) is None
+    assert stream.catch_up()[0].startswith(b'id: 1\nevent: update\n')
+    assert stream.accept({'id': 1}) is False
+
+
+@pytest.mark.django_db(transaction=True)
+def test_event_stream_under_asgi(author_client, author, form_data):
+    """Проверяю поток событий ASGI-приложения и отписку при отключении."""
+    application = events.EventsApplication(None)
+    cookie = f'sessionid={author_client.cookies["sessionid"].value}'
+
+    async def scenario():
+        disconnected = asyncio.Event()
+        messages = asyncio.Queue()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        task = asyncio.ensure_future(application(
+            {
+                'type': 'http', 'method': 'GET', 'path': '/events/',
+                'query_string': b'', 'headers': [(b'cookie', cookie.encode())],
+            },
+            receive, messages.put,
+        ))
+        start = await messages.get()
+        assert start['status'] == HTTPStatus.OK
+        assert (await messages.get())['body'] == events.RETRY
+        await asyncio.get_running_loop().run_in_executor(
+            None, partial(author_client.post, reverse('notes:add'), form_data)
+        )
+        created = (await messages.get())['body'].decode()
+        disconnected.set()
+        await task
+        return created
+
+    assert 'event: create' in asyncio.run(scenario())
+    assert not events.get_broker().subscribers
+
+
+@pytest.mark.django_db(transaction=True)
+def test_export_streams_under_asgi(author_client, note):
+    """
+    Проверяю, что выгрузка под ASGI читает заметки не в цикле событий и
+    отдаёт их целиком.
+    """
+    application = aio.ASGIHandler()
+    cookie = f'sessionid={author_client.cookies["sessionid"].value}'
+
+    async def scenario():
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        await application(
+            {
+                'type': 'http', 'method': 'GET', 'path': '/export/',
+                'query_string': b'format=jsonl',
+                'headers': [(b'cookie', cookie.encode())],
+            },
+            receive, send,
+        )
+        return messages
+
+    start, *body = asyncio.run(scenario())
+    assert start['status'] == HTTPStatus.OK
+    lines = b''.join(message.get('body', b'') for message in body)
+    assert json.loads(lines)['slug'] == note.slug
+    assert not body[-1].get('more_body')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_list_subscribes_to_events_only_with_stream(author_client, settings):
+    """
+    Проверяю, что список подписывается на поток событий под
+    EventsApplication, а под WSGI — только с EVENTS_WSGI.
+    """
+    url = reverse('notes:list')
+    assert b'EventSource' not in author_client.get(url).content
+    settings.EVENTS_WSGI = True
+    assert b'EventSource' in author_client.get(url).content
+    settings.EVENTS_WSGI = False
+    application = events.EventsApplication(aio.ASGIHandler())
+    cookie = f'sessionid={author_client.cookies["sessionid"].value}'
+
+    async def scenario():
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        await application(
+            {
+                'type': 'http', 'method': 'GET', 'path': url,
+                'query_string': b'', 'headers': [(b'cookie', cookie.encode())],
+            },
+            receive, send,
+        )
+        return b''.join(message.get('body', b'') for message in messages)
+
+    assert b'data-events="/events/"' in asyncio.run(scenario())
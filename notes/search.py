@@ -0,0 +1,223 @@
+import math
+import re
+import unicodedata
+
+from django.db import connections
+from django.http import Http404
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .pagination import MAX_CURSOR, MIN_CURSOR
+
+FTS_TABLE = 'notes_note_fts'
+# Слова в смысле токенизатора unicode61: буквы и цифры, без «_».
+WORD_RE = re.compile(r'[^\W_]+')
+# Разделитель автора и слова в термах индекса; входит в токен (tokenchars).
+AUTHOR_SEPARATOR = '~'
+# Границы подсветки: символы, которых не бывает в тексте заметок,
+# заменяются на <mark> уже после экранирования HTML.
+MARK_START, MARK_END = '\x02', '\x03'
+SNIPPET_TOKENS = 16
+SCAN_CHUNK_SIZE = 200
+
+
+def is_supported(using):
+    """Полнотекстовый индекс FTS5 есть только в SQLite."""
+    return connections[using].vendor == 'sqlite'
+
+
+def index_terms(author_id, value):
+    """
+    Слова value с префиксом автора: «7~слово».
+
+    Индекс общий для всех авторов. Если бы в нём лежали сами слова,
+    MATCH перебирал и ранжировал бы совпадения всех авторов, и поиск
+    замедлялся бы с ростом всей базы. У каждого автора свои термы,
+    поэтому поиск читает только списки документов этого автора.
+    """
+    return ' '.join(
+        f'{author_id}{AUTHOR_SEPARATOR}{word}'
+        for word in WORD_RE.findall(value)
+    )
+
+
+def index_notes(notes, using):
+    """Добавляет или обновляет заметки в полнотекстовом индексе."""
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, title, text) '
+            'VALUES (%s, %s, %s)',
+            [
+                (
+                    note.pk,
+                    index_terms(note.author_id, note.title),
+                    index_terms(note.author_id, note.text),
+                )
+                for note in notes
+            ]
+        )
+
+
+def unindex_notes(ids, using):
+    """Удаляет заметки из полнотекстового индекса."""
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(pk,) for pk in ids]
+        )
+
+
+def query_words(query):
+    """Слова запроса: каждое — список слов токенизатора подряд."""
+    return [words for words in map(WORD_RE.findall, query.split()) if words]
+
+
+def build_match(query, author_id):
+    """
+    Превращает пользовательский запрос в выражение MATCH по термам автора.
+
+    Каждое слово запроса становится фразой из термов index_terms и ищется
+    по префиксу, поэтому синтаксис FTS5 в запросе не приводит к ошибкам.
+    """
+    return ' '.join(
+        '"{}"*'.format(index_terms(author_id, ' '.join(words)))
+        for words in query_words(query)
+    )
+
+
+def fold(word):
+    """Слово, как его сравнивает unicode61 remove_diacritics."""
+    return ''.join(
+        char for char in unicodedata.normalize('NFKD', word.lower())
+        if not unicodedata.combining(char)
+    )
+
+
+def mark_words(value, prefixes):
+    """Выделяет в value слова, начинающиеся с одного из prefixes."""
+    return WORD_RE.sub(
+        lambda match: (
+            f'{MARK_START}{match[0]}{MARK_END}'
+            if fold(match[0]).startswith(prefixes) else match[0]
+        ),
+        value,
+    )
+
+
+def make_snippet(text, prefixes, size=SNIPPET_TOKENS):
+    """
+    Фрагмент текста из size слов вокруг первого найденного слова.
+
+    В индексе лежат термы автора, а не текст, поэтому highlight и snippet
+    FTS5 здесь не подходят; фрагменты строятся для одной страницы выдачи.
+    """
+    words = list(WORD_RE.finditer(text))
+    first = next(
+        (
+            index for index, match in enumerate(words)
+            if fold(match[0]).startswith(prefixes)
+        ),
+        0,
+    )
+    window = words[max(first - size // 4, 0):][:size]
+    if not window:
+        return ''
+    start, end = window[0].start(), window[-1].end()
+    return (
+        ('…' if start else '') + mark_words(text[start:end], prefixes)
+        + ('…' if end < len(text) else '')
+    )
+
+
+def highlight(value):
+    """Экранирует фрагмент текста и подсвечивает найденные слова."""
+    return mark_safe(
+        escape(value)
+        .replace(MARK_START, '<mark>')
+        .replace(MARK_END, '</mark>')
+    )
+
+
+def parse_cursor(value):
+    """Курсор выдачи — пара (rank, id) последнего показанного результата."""
+    if not value:
+        return None
+    try:
+        rank, pk = value.split('_')
+        rank, pk = float(rank), int(pk)
+    except ValueError:
+        raise Http404('Некорректный курсор поиска.')
+    if not math.isfinite(rank) or not MIN_CURSOR <= pk <= MAX_CURSOR:
+        raise Http404('Некорректный курсор поиска.')
+    return rank, pk
+
+
+def make_cursor(note):
+    return f'{note.rank!r}_{note.pk}'
+
+
+def scan_notes(queryset, words, after, limit):
+    """
+    Запасной вариант для других СУБД: без ранжирования и индекса.
+
+    Текст хранится сжатым, и база не может искать в нём, поэтому
+    заметки просматриваются по порядку id и проверяются на месте.
+    """
+    words = [word.lower() for word in words]
+    queryset = queryset.order_by('id')
+    if after is not None:
+        queryset = queryset.filter(id__gt=after[1])
+    notes = []
+    for note in queryset.iterator(chunk_size=SCAN_CHUNK_SIZE):
+        title, text = note.title.lower(), note.text.lower()
+        if all(word in title or word in text for word in words):
+            notes.append(note)
+            if len(notes) == limit:
+                break
+    return notes
+
+
+def search_notes(queryset, author, query, cursor=None, limit=20):
+    """
+    Ищет query среди заметок автора author из queryset, лучшие
+    совпадения первыми.
+
+    Возвращает список заметок с атрибутами title_html и snippet и курсор
+    следующей страницы (None, если результатов больше нет).
+    """
+    match = build_match(query, author.pk)
+    if not match:
+        return [], None
+    after = parse_cursor(cursor)
+    if is_supported(queryset.db):
+        where = [f'{FTS_TABLE}.rowid = notes_note.id', f'{FTS_TABLE} MATCH %s']
+        params = [match]
+        if after is not None:
+            where.append(
+                f'({FTS_TABLE}.rank > %s '
+                f'OR ({FTS_TABLE}.rank = %s AND notes_note.id > %s))'
+            )
+            params += [after[0], after[0], after[1]]
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=where,
+            params=params,
+            select={'rank': f'{FTS_TABLE}.rank'},
+        ).order_by('rank', 'id')
+        notes = list(queryset[:limit + 1])
+    else:
+        notes = scan_notes(queryset, query.split(), after, limit + 1)
+    prefixes = tuple(
+        fold(word) for words in query_words(query) for word in words
+    )
+    for note in notes[:limit]:
+        note.title_html = highlight(mark_words(note.title, prefixes))
+        note.snippet = highlight(make_snippet(note.text, prefixes))
+        if not hasattr(note, 'rank'):
+            note.rank = 0.0
+    next_cursor = make_cursor(notes[limit - 1]) if len(notes) > limit else None
+    return notes[:limit], next_cursor
@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends import cached_db
+from django.contrib.sessions.models import Session
+from django.db import DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+# Изменённые сессии, ещё не записанные в базу: ключ → (данные, срок).
+pending = {}
+lock = threading.RLock()
+flushed = time.monotonic()
+
+
+class SessionStore(cached_db.SessionStore):
+    """
+    Сессии в кеше SESSION_CACHE_ALIAS с отложенной записью в базу.
+
+    Новая сессия и смена пользователя в ней (вход, смена пароля)
+    сохраняются в базу сразу, а остальные изменения попадают в кеш и в
+    очередь, которую flush_sessions записывает в django_session раз в
+    SESSION_WRITE_BEHIND_SECONDS.
+    Чтение идёт из кеша; база нужна, только если ключ из кеша вытеснен.
+    Очередь сбрасывается по окончании запросов, поэтому при остановке
+    процесса теряются не больше SESSION_WRITE_BEHIND_SECONDS последних
+    изменений, и то лишь при потере самого кеша.
+    Кеш должен быть общим для всех процессов (YANOTE_CACHE_DIR), иначе
+    проверка notes.E001 не даст запустить проект.
+    """
+
+    def load(self):
+        data = None
+        if self.session_key is not None:
+            with lock:
+                entry = pending.get(self.session_key)
+            if entry is not None and self.cache_key not in self._cache:
+                data = self.decode(entry[0])
+        if data is None:
+            data = super().load()
+        self._stored_auth = auth_keys(data)
+        return data
+
+    def save(self, must_create=False):
+        data = self._get_session()
+        if (
+            must_create or self.session_key is None
+            or not settings.SESSION_WRITE_BEHIND_SECONDS
+            # login() меняет ключ и лишь потом записывает пользователя.
+            or auth_keys(data) != getattr(self, '_stored_auth', None)
+        ):
+            with lock:
+                super().save(must_create)
+                # Старые данные из очереди не должны затереть новые.
+                pending.pop(self.session_key, None)
+            self._stored_auth = auth_keys(data)
+            return
+        self._cache.set(self.cache_key, data, self.get_expiry_age())
+        with lock:
+            pending[self.session_key] = (
+                self.encode(data), self.get_expiry_date()
+            )
+
+    def delete(self, session_key=None):
+        # Под блокировкой: сброс очереди не вернёт удалённую сессию в базу.
+        with lock:
+            pending.pop(session_key or self.session_key, None)
+            super().delete(session_key)
+
+
+def auth_keys(data):
+    """Пользователь сессии: при его смене сессия пишется в базу сразу."""
+    return data.get(SESSION_KEY), data.get(HASH_SESSION_KEY)
+
+
+def flush_sessions(sender=None, force=False, **kwargs):
+    """
+    Записывает очередь сессий в базу, если прошло достаточно времени.
+
+    Записи уходят из очереди только после коммита. Если база недоступна
+    или занята, очередь остаётся до следующей попытки, а ошибка пишется
+    в лог, а не в ответ на запрос, после которого вызван сброс.
+    """
+    global flushed
+    due = flushed + settings.SESSION_WRITE_BEHIND_SECONDS
+    if not pending or not (force or time.monotonic() >= due):
+        return
+    with lock:
+        flushed = time.monotonic()
+        entries = list(pending.items())
+        try:
+            with transaction.atomic():
+                for key, (data, expire_date) in entries:
+                    Session.objects.update_or_create(
+                        session_key=key,
+                        defaults={
+                            'session_data': data, 'expire_date': expire_date,
+                        },
+                    )
+        except DatabaseError:
+            logger.exception(
+                'Сессии не записаны в базу, осталось в очереди: %d',
+                len(pending),
+            )
+            return
+        for key, entry in entries:
+            if pending.get(key) is entry:
+                del pending[key]
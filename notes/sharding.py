@@ -0,0 +1,490 @@
+import bisect
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, models, transaction
+
+from . import search
+from .cache import bump_notes_version, notes_cache
+
+# База с пользователями, каталогом размещения и реестром slug.
+DIRECTORY_DB = 'default'
+# Модели, строки которых живут на шарде своего автора.
+SHARDED_MODELS = (
+    'note', 'tombstone', 'changecounter', 'tag', 'notetag', 'authorstats',
+)
+VIRTUAL_NODES = 64
+PLACEMENT_KEY = 'notes:shard:{}'
+# Slug, занятые в реестре внутри текущего блока reserving.
+_reservations = ContextVar('slug_reservations', default=None)
+
+
+def sharding_enabled():
+    return bool(settings.NOTE_SHARDS)
+
+
+class HashRing:
+    """
+    Консистентное хеширование: у каждого шарда VIRTUAL_NODES точек на
+    кольце, ключ принадлежит ближайшей точке по часовой стрелке. При
+    добавлении шарда к нему переезжает лишь около 1/N ключей.
+    """
+
+    def __init__(self, shards, virtual_nodes=VIRTUAL_NODES):
+        self.points = sorted(
+            (self.hash(f'{shard}#{node}'), shard)
+            for shard in shards
+            for node in range(virtual_nodes)
+        )
+        self.keys = [point for point, _ in self.points]
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def shard_for(self, key):
+        index = bisect.bisect(self.keys, self.hash(str(key)))
+        return self.points[index % len(self.points)][1]
+
+
+_rings = {}
+
+
+def get_ring():
+    shards = tuple(settings.NOTE_SHARDS)
+    if shards not in _rings:
+        _rings[shards] = HashRing(shards)
+    return _rings[shards]
+
+
+def shard_for_author(author_id):
+    """
+    Шард, на котором хранятся заметки автора.
+
+    Размещение фиксируется в каталоге ShardPlacement при первом обращении,
+    поэтому новый шард в NOTE_SHARDS не теряет данные: авторов на него
+    переносит команда rebalance_shards. Каталог кешируется в кеше заметок
+    на SHARD_PLACEMENT_TIMEOUT.
+    """
+    from .models import ShardPlacement
+
+    cache = notes_cache()
+    key = PLACEMENT_KEY.format(author_id)
+    shard = cache.get(key)
+    if shard is None:
+        placement, _ = ShardPlacement.objects.using(
+            DIRECTORY_DB
+        ).get_or_create(
+            author_id=author_id,
+            defaults={'shard': get_ring().shard_for(author_id)},
+        )
+        shard = placement.shard
+        cache.set(key, shard, settings.SHARD_PLACEMENT_TIMEOUT)
+    return shard
+
+
+def is_sharded(model):
+    return (
+        model._meta.app_label == 'notes'
+        and model._meta.model_name in SHARDED_MODELS
+    )
+
+
+class ShardRouter:
+    """
+    Отправляет запросы к заметкам автора на его шард из NOTE_SHARDS.
+
+    Автор берётся из подсказки author_id (её добавляет
+    NoteQuerySet.for_author) или из экземпляра модели. Остальные модели
+    живут в DIRECTORY_DB. Без NOTE_SHARDS роутер ничего не решает.
+    """
+
+    def route(self, model, **hints):
+        if not sharding_enabled():
+            return None
+        if not is_sharded(model):
+            return DIRECTORY_DB
+        author_id = hints.get('author_id')
+        instance = hints.get('instance')
+        if author_id is None and instance is not None:
+            if isinstance(instance, get_user_model()):
+                author_id = instance.pk
+            else:
+                author_id = getattr(instance, 'author_id', None)
+        if author_id is None:
+            return None
+        return shard_for_author(author_id)
+
+    db_for_read = route
+    db_for_write = route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Заметки на шардах ссылаются на пользователей из DIRECTORY_DB.
+        if sharding_enabled():
+            return True
+        return None
+
+
+def reserve_slugs(notes, ignore_conflicts=False):
+    """
+    Резервирует slug заметок в общем реестре.
+
+    Уникальный индекс каждого шарда видит только свои заметки, поэтому
+    slug сначала занимается в SlugRegistry. Slug, уже записанные за
+    автором заметки, остаются за ним: повтор внутри автора не пропустит
+    индекс шарда, а пакет может занять slug, который сам же освобождает.
+    Если slug занят другим автором, выбрасывает IntegrityError; с
+    ignore_conflicts возвращает только заметки, чьи slug принадлежат их
+    авторам. Новые записи реестра удаляются при ошибке блока reserving.
+    """
+    from .models import SlugRegistry
+
+    registry = SlugRegistry.objects.using(DIRECTORY_DB)
+    owners = dict(
+        registry.filter(
+            slug__in=[note.slug for note in notes]
+        ).values_list('slug', 'author_id')
+    )
+    if not ignore_conflicts and any(
+        owners.get(note.slug, note.author_id) != note.author_id
+        for note in notes
+    ):
+        raise IntegrityError('Slug занят заметкой другого автора.')
+    new = [note for note in notes if note.slug not in owners]
+    with transaction.atomic(using=DIRECTORY_DB):
+        registry.bulk_create(
+            (
+                SlugRegistry(slug=note.slug, author_id=note.author_id)
+                for note in new
+            ),
+            ignore_conflicts=ignore_conflicts,
+        )
+    if not ignore_conflicts:
+        reserved = _reservations.get()
+        if reserved is not None:
+            reserved += [note.slug for note in new]
+        return notes
+    owners = dict(
+        registry.filter(
+            slug__in=[note.slug for note in notes]
+        ).values_list('slug', 'author_id')
+    )
+    return [note for note in notes if owners[note.slug] == note.author_id]
+
+
+def drop_reservations(slugs):
+    """Сразу удаляет из реестра slug, занятые неудавшейся записью."""
+    from .models import SlugRegistry
+
+    if slugs:
+        SlugRegistry.objects.using(DIRECTORY_DB).filter(
+            slug__in=slugs
+        ).delete()
+
+
+def release_slugs(slugs, using):
+    """
+    Освобождает slug удалённых или переименованных заметок на using.
+
+    Реестр живёт в DIRECTORY_DB, поэтому освобождение откладывается до
+    коммита транзакции на using: при её откате slug остаются заняты.
+    """
+    if sharding_enabled() and slugs:
+        transaction.on_commit(
+            partial(free_slugs, list(slugs), using), using=using
+        )
+
+
+def free_slugs(slugs, using):
+    """Удаляет из реестра slug, которых больше нет у заметок на using."""
+    from .models import Note, SlugRegistry
+
+    used = Note.objects.using(using).filter(
+        slug__in=slugs
+    ).values_list('slug', flat=True)
+    SlugRegistry.objects.using(DIRECTORY_DB).filter(
+        slug__in=set(slugs) - set(used)
+    ).delete()
+
+
+@contextmanager
+def reserving():
+    """
+    Блок, slug из которого удаляются из реестра при исключении.
+
+    Запись реестра в DIRECTORY_DB не входит в транзакцию шарда. Slug,
+    занятые во вложенном блоке, при его успехе переходят во внешний:
+    если тот откатится, они тоже освободятся.
+    """
+    reserved = []
+    token = _reservations.set(reserved)
+    try:
+        yield
+    except BaseException:
+        drop_reservations(reserved)
+        raise
+    finally:
+        _reservations.reset(token)
+    outer = _reservations.get()
+    if outer is not None:
+        outer += reserved
+
+
+@contextmanager
+def atomic(using):
+    """transaction.atomic на using, откат которой освобождает и slug."""
+    with reserving(), transaction.atomic(using=using):
+        yield
+
+
+@contextmanager
+def reserved_slug(note):
+    """Держит новый slug заметки в реестре; при ошибке записи отпускает."""
+    if not sharding_enabled() or note.slug == getattr(
+        note, '_loaded_slug', None
+    ):
+        yield
+        return
+    with reserving():
+        reserve_slugs([note])
+        yield
+
+
+def delete_author_notes(sender, instance, **kwargs):
+    """
+    Удаляет данные автора с его шарда перед удалением пользователя.
+
+    Каскад Django видит только DIRECTORY_DB, а заметки лежат на шарде.
+    """
+    from .models import (
+        AuthorStats, ChangeCounter, Note, ShardPlacement, Tag, Tombstone,
+    )
+
+    if not sharding_enabled():
+        return
+    shard = shard_for_author(instance.pk)
+    slugs = list(
+        Note.objects.using(shard).filter(
+            author_id=instance.pk
+        ).values_list('slug', flat=True)
+    )
+    drop_notes(shard, instance.pk)
+    for model in (Tombstone, ChangeCounter, Tag, AuthorStats):
+        model.objects.using(shard).filter(author_id=instance.pk).delete()
+    release_slugs(slugs, shard)
+    ShardPlacement.objects.using(DIRECTORY_DB).filter(
+        author_id=instance.pk
+    ).delete()
+    notes_cache().delete(PLACEMENT_KEY.format(instance.pk))
+
+
+def sync_slug_registry():
+    """Заносит в реестр slug всех заметок на всех шардах."""
+    from .models import Note, SlugRegistry
+
+    registry = SlugRegistry.objects.using(DIRECTORY_DB)
+    for shard in (DIRECTORY_DB, *settings.NOTE_SHARDS):
+        rows = Note.objects.using(shard).values_list('slug', 'author_id')
+        batch = []
+        for slug, author_id in rows.iterator():
+            batch.append(SlugRegistry(slug=slug, author_id=author_id))
+            if len(batch) >= 1000:
+                registry.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        registry.bulk_create(batch, ignore_conflicts=True)
+
+
+def drop_notes(using, author_id, slugs=None):
+    """Удаляет заметки автора на using в обход ленты изменений."""
+    from .models import Note
+
+    notes = Note.objects.using(using).filter(author_id=author_id)
+    if slugs is not None:
+        notes = notes.filter(slug__in=slugs)
+    search.unindex_notes(list(notes.values_list('id', flat=True)), using)
+    models.QuerySet.delete(notes)
+
+
+def copy_rows(model, source, target, author_id, since=0, until=None):
+    """
+    Копирует строки автора с номерами изменений в (since, until].
+
+    Номера изменений и slug сохраняются как есть, поэтому копирование идёт
+    мимо NoteQuerySet.bulk_create. Заметки с теми же slug на target
+    заменяются: так повторное копирование безопасно.
+    """
+    from .models import Note
+
+    rows = model.objects.using(source).filter(
+        author_id=author_id, revision__gt=since
+    )
+    if until is not None:
+        rows = rows.filter(revision__lte=until)
+    objs = list(rows)
+    for obj in objs:
+        obj.pk = None
+    if model is Note:
+        drop_notes(target, author_id, [obj.slug for obj in objs])
+    models.QuerySet.bulk_create(model.objects.using(target), objs)
+    if model is Note:
+        search.index_notes(
+            Note.objects.using(target).filter(
+                author_id=author_id, revision__gt=since
+            ),
+            using=target,
+        )
+
+
+def copy_tags(source, target, author_id):
+    """
+    Копирует теги автора со счётчиками и связи с заметками, сопоставляя
+    их по имени тега и slug заметки: id заметок на target другие.
+    """
+    from .models import Note, NoteTag, Tag
+
+    models.QuerySet.delete(
+        Tag.objects.using(target).filter(author_id=author_id)
+    )
+    tags = list(Tag.objects.using(source).filter(author_id=author_id))
+    for tag in tags:
+        tag.pk = None
+    models.QuerySet.bulk_create(Tag.objects.using(target), tags)
+    tag_ids = dict(
+        Tag.objects.using(target).filter(
+            author_id=author_id
+        ).values_list('name', 'id')
+    )
+    note_ids = dict(
+        Note.objects.using(target).filter(
+            author_id=author_id
+        ).values_list('slug', 'id')
+    )
+    NoteTag.objects.using(target).bulk_create(
+        NoteTag(note_id=note_ids[slug], tag_id=tag_ids[name])
+        for slug, name in NoteTag.objects.using(source).filter(
+            tag__author_id=author_id
+        ).values_list('note__slug', 'tag__name')
+    )
+
+
+def move_author(author_id, source, target):
+    """
+    Переносит заметки автора с шарда source на target без остановки.
+
+    Сначала без блокировок копируется всё, что было на момент начала.
+    Затем в транзакции, которая блокирует счётчик автора на source,
+    докопируются изменения, сделанные за это время, переключается каталог
+    и удаляются строки на source. Запись автора ждёт только этот шаг;
+    в нём же целиком копируются теги и статистика автора — их немного.
+
+    Каталог переключается в транзакции на DIRECTORY_DB, которая
+    фиксируется после target и до source: при любой ошибке в этом шаге он
+    не указывает на откаченный target, а если не зафиксируется удаление
+    на source, на нём останутся лишь копии перенесённых строк.
+    """
+    from .models import (
+        AuthorStats, ChangeCounter, Note, ShardPlacement, Tag, Tombstone,
+    )
+
+    def latest(model):
+        return model.objects.using(source).filter(
+            author_id=author_id
+        ).aggregate(models.Max('revision'))['revision__max'] or 0
+
+    snapshot = {model: latest(model) for model in (Note, Tombstone)}
+    with transaction.atomic(using=target):
+        for model, until in snapshot.items():
+            copy_rows(model, source, target, author_id, until=until)
+    with transaction.atomic(using=source), transaction.atomic(
+        using=DIRECTORY_DB
+    ), transaction.atomic(using=target):
+        counters = ChangeCounter.objects.using(source).filter(
+            author_id=author_id
+        )
+        # UPDATE держит блокировку записи до конца транзакции.
+        counters.update(value=models.F('value'))
+        drop_notes(target, author_id, list(
+            Tombstone.objects.using(source).filter(
+                author_id=author_id, revision__gt=snapshot[Tombstone]
+            ).values_list('slug', flat=True)
+        ))
+        for model, since in snapshot.items():
+            copy_rows(model, source, target, author_id, since=since)
+        copy_tags(source, target, author_id)
+        value = counters.values_list('value', flat=True).first()
+        if value is not None:
+            ChangeCounter.objects.using(target).update_or_create(
+                author_id=author_id, defaults={'value': value}
+            )
+        models.QuerySet.delete(
+            AuthorStats.objects.using(target).filter(author_id=author_id)
+        )
+        models.QuerySet.bulk_create(
+            AuthorStats.objects.using(target),
+            AuthorStats.objects.using(source).filter(author_id=author_id),
+        )
+        ShardPlacement.objects.using(DIRECTORY_DB).update_or_create(
+            author_id=author_id, defaults={'shard': target}
+        )
+        transaction.on_commit(
+            partial(
+                notes_cache().set, PLACEMENT_KEY.format(author_id), target,
+                settings.SHARD_PLACEMENT_TIMEOUT,
+            ),
+            using=DIRECTORY_DB,
+        )
+        drop_notes(source, author_id)
+        for model in (Tombstone, ChangeCounter, Tag, AuthorStats):
+            models.QuerySet.delete(
+                model.objects.using(source).filter(author_id=author_id)
+            )
+    bump_notes_version(author_id)
+
+
+def place_unsharded_authors():
+    """
+    Записывает в каталог DIRECTORY_DB для авторов, чьи заметки остались
+    там с тех пор, когда шардов не было: rebalance перенесёт их на шарды.
+    """
+    from .models import Note, ShardPlacement
+
+    placed = ShardPlacement.objects.using(DIRECTORY_DB).values('author_id')
+    authors = Note.objects.using(DIRECTORY_DB).exclude(
+        author_id__in=placed
+    ).values_list('author_id', flat=True).distinct()
+    ShardPlacement.objects.using(DIRECTORY_DB).bulk_create(
+        (
+            ShardPlacement(author_id=author_id, shard=DIRECTORY_DB)
+            for author_id in authors
+        ),
+        ignore_conflicts=True,
+    )
+    for author_id in authors:
+        notes_cache().delete(PLACEMENT_KEY.format(author_id))
+
+
+def rebalance(stdout=None):
+    """Переносит авторов, чей шард по кольцу отличается от текущего."""
+    from .models import ShardPlacement
+
+    ring = get_ring()
+    moved = 0
+    placements = ShardPlacement.objects.using(DIRECTORY_DB).order_by('pk')
+    for author_id, shard in list(placements.values_list('author_id', 'shard')):
+        target = ring.shard_for(author_id)
+        if target == shard:
+            continue
+        try:
+            move_author(author_id, shard, target)
+        except IntegrityError as error:
+            if stdout:
+                stdout.write(f'Автор {author_id} не перенесён: {error}')
+            continue
+        moved += 1
+        if stdout:
+            stdout.write(f'Автор {author_id}: {shard} → {target}')
+    return moved
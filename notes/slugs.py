@@ -0,0 +1,121 @@
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
+from pytils.translit import slugify
+
+from .sharding import DIRECTORY_DB, sharding_enabled
+
+# Сколько раз пробуем сохранить заметку, если slug успели занять.
+SLUG_ATTEMPTS = 5
+# Место под суффикс вида «-123» при обрезке длинного slug.
+SUFFIX_RESERVE = 10
+DEFAULT_SLUG = 'note'
+
+
+def base_slug(title, max_length):
+    return slugify(title)[:max_length] or DEFAULT_SLUG
+
+
+def candidates(base, max_length):
+    """Варианты slug по порядку: title, title-2, title-3…"""
+    yield base
+    number = 2
+    while True:
+        suffix = f'-{number}'
+        yield base[:max_length - len(suffix)] + suffix
+        number += 1
+
+
+def prefix_filter(base, max_length):
+    """
+    Условие на slug, которые могут совпасть с кандидатами для base.
+
+    Все кандидаты начинаются с одного префикса, поэтому хватает одного
+    запроса. Диапазон вместо startswith нужен, чтобы работал уникальный
+    индекс по slug: LIKE в SQLite регистронезависим и индекс не использует.
+    """
+    prefix = base[:max_length - SUFFIX_RESERVE]
+    return Q(slug__gte=prefix, slug__lt=prefix + '\uffff')
+
+
+def taken_slugs(queryset, base, max_length):
+    """Занятые slug, которые могут совпасть с кандидатами для base."""
+    return set(
+        queryset.filter(prefix_filter(base, max_length))
+        .values_list('slug', flat=True)
+    )
+
+
+def slug_queryset(model, using=None):
+    """
+    Выборка, по которой проверяется занятость slug.
+
+    С шардами уникальный индекс одной базы видит не все заметки, поэтому
+    занятые slug берутся из общего реестра SlugRegistry.
+    """
+    if sharding_enabled():
+        from .models import SlugRegistry
+
+        return SlugRegistry.objects.using(DIRECTORY_DB)
+    return model._default_manager.using(using)
+
+
+def slug_owners(model, condition, author):
+    """
+    Занятые slug, подходящие под condition: slug → id заметки.
+
+    Slug заметок других авторов на других шардах сопоставляются с
+    кортежем ('author', id автора), который не совпадёт ни с одним id.
+    """
+    if not sharding_enabled():
+        return dict(
+            model._default_manager.filter(condition).values_list('slug', 'id')
+        )
+    rows = slug_queryset(model).filter(condition).values_list(
+        'slug', 'author_id'
+    )
+    owners = {
+        slug: ('author', author_id)
+        for slug, author_id in rows if author_id != author.pk
+    }
+    owners.update(
+        model._default_manager.for_author(author).filter(
+            condition, slug__in=[slug for slug, _ in rows]
+        ).values_list('slug', 'id')
+    )
+    return owners
+
+
+def pick_slug(base, taken, max_length):
+    """Первый свободный кандидат для base."""
+    return next(
+        slug for slug in candidates(base, max_length) if slug not in taken
+    )
+
+
+def save_with_unique_slug(note, save):
+    """
+    Назначает заметке свободный slug и сохраняет её вызовом save().
+
+    Если параллельный запрос занял тот же slug, сохранение в точке
+    сохранения откатывается с IntegrityError и повторяется со следующим
+    свободным вариантом.
+    """
+    max_length = note._meta.get_field('slug').max_length
+    base = base_slug(note.title, max_length)
+    using = router.db_for_write(type(note), instance=note)
+    queryset = slug_queryset(type(note), using)
+    if sharding_enabled():
+        queryset = queryset.exclude(slug=getattr(note, '_loaded_slug', None))
+    elif note.pk is not None:
+        queryset = queryset.exclude(pk=note.pk)
+    for attempt in range(1, SLUG_ATTEMPTS + 1):
+        note.slug = pick_slug(
+            base, taken_slugs(queryset, base, max_length), max_length
+        )
+        try:
+            with transaction.atomic(using=using):
+                save()
+            return
+        except IntegrityError:
+            if attempt == SLUG_ATTEMPTS:
+                raise
@@ -0,0 +1,138 @@
+from collections import defaultdict
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Length
+
+from .cache import bump_auth_stamp, bump_notes_version
+from .fields import Compressed
+
+
+def stored_size(note):
+    """
+    Сколько байт текст заметки занимает в базе, как LENGTH(text).
+
+    None, если текст не загружен: при сохранении он не меняется.
+    """
+    if 'text' not in note.__dict__:
+        return None
+    text = note.__dict__['text']
+    if isinstance(text, Compressed):
+        return len(text)
+    return len(type(note)._meta.get_field('text').get_prep_value(text))
+
+
+def stored_sizes(note_ids, using):
+    """Размеры текстов в базе: {id заметки: (id автора, байт)}."""
+    from .models import Note
+
+    return {
+        pk: (author_id, size)
+        for pk, author_id, size in Note.objects.using(using).filter(
+            pk__in=note_ids
+        ).values_list('id', 'author_id', Length('text'))
+    }
+
+
+def add_notes(notes, using):
+    """Учитывает созданные заметки."""
+    deltas = defaultdict(lambda: [0, 0])
+    for note in notes:
+        deltas[note.author_id][0] += 1
+        deltas[note.author_id][1] += stored_size(note) or 0
+    update_stats(deltas, using)
+
+
+def change_notes(notes, old_sizes, using):
+    """Учитывает новый размер текста изменённых заметок."""
+    deltas = defaultdict(lambda: [0, 0])
+    for note in notes:
+        size = stored_size(note)
+        if size is not None and note.pk in old_sizes:
+            deltas[note.author_id][1] += size - old_sizes[note.pk][1]
+    update_stats(deltas, using)
+
+
+def remove_notes(old_sizes, using):
+    """Учитывает удаление заметок с размерами из stored_sizes."""
+    deltas = defaultdict(lambda: [0, 0])
+    for author_id, size in old_sizes.values():
+        deltas[author_id][0] -= 1
+        deltas[author_id][1] -= size
+    update_stats(deltas, using)
+
+
+def update_stats(deltas, using):
+    """
+    Меняет статистику авторов на deltas[id автора] = [заметок, байт].
+
+    Вызывается в транзакции записи заметок после ChangeCounter.allocate:
+    строка счётчика автора уже заблокирована, поэтому изменения одного
+    автора не перемешиваются. После коммита сбрасывается закешированный
+    пользователь (notes.auth.get_user): статистика читается вместе с ним.
+    """
+    from .models import AuthorStats
+
+    for author_id, (count, size) in deltas.items():
+        if not count and not size:
+            continue
+        stats = AuthorStats.objects.using(using).filter(author_id=author_id)
+        changes = {
+            'note_count': F('note_count') + count,
+            'text_bytes': F('text_bytes') + size,
+        }
+        if not stats.update(**changes):
+            stats.get_or_create(author_id=author_id)
+            stats.update(**changes)
+        transaction.on_commit(
+            partial(bump_auth_stamp, author_id), using=using
+        )
+
+
+def reconcile(author_ids, using):
+    """
+    Пересчитывает статистику авторов author_ids по их заметкам на using и
+    исправляет расхождения. Возвращает id исправленных авторов.
+
+    Счётчики изменений авторов блокируются, как при записи заметок,
+    поэтому пересчёт не расходится с записью, идущей в это же время.
+    """
+    from .models import AuthorStats, ChangeCounter, Note
+
+    with transaction.atomic(using=using):
+        ChangeCounter.objects.using(using).filter(
+            author_id__in=author_ids
+        ).update(value=F('value'))
+        actual = {
+            author_id: (count, size or 0)
+            for author_id, count, size in Note.objects.using(using).filter(
+                author_id__in=author_ids
+            ).values('author_id').annotate(
+                count=Count('id'), size=Sum(Length('text'))
+            ).order_by().values_list('author_id', 'count', 'size')
+        }
+        stored = {
+            author_id: (count, size)
+            for author_id, count, size in AuthorStats.objects.using(
+                using
+            ).filter(author_id__in=author_ids).values_list(
+                'author_id', 'note_count', 'text_bytes'
+            )
+        }
+        drifted = [
+            author_id for author_id in author_ids
+            if actual.get(author_id, (0, 0)) != stored.get(author_id, (0, 0))
+        ]
+        for author_id in drifted:
+            count, size = actual.get(author_id, (0, 0))
+            AuthorStats.objects.using(using).update_or_create(
+                author_id=author_id,
+                defaults={'note_count': count, 'text_bytes': size},
+            )
+            transaction.on_commit(
+                partial(bump_auth_stamp, author_id), using=using
+            )
+    for author_id in drifted:
+        bump_notes_version(author_id)
+    return drifted
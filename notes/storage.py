@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.contrib.staticfiles.utils import matches_patterns
+from django.core.files.base import ContentFile
+
+from .compression import ENCODINGS, compress
+
+COMPRESSIBLE_PATTERNS = ('*.css', '*.js', '*.svg', '*.txt', '*.json')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Статика с хешем содержимого в имени и заранее сжатыми копиями.
+
+    collectstatic кладёт рядом с каждым текстовым файлом от
+    STATIC_COMPRESS_MIN_SIZE байт варианты .br и .gz с максимальным
+    сжатием; StaticAsset отдаёт подходящий клиенту.
+    """
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            # collectstatic ещё не запускали (разработка, тесты): ссылки
+            # ведут на файлы без хеша.
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in {*paths, *self.hashed_files.values()}:
+            if matches_patterns(name, COMPRESSIBLE_PATTERNS):
+                self.compress_file(name)
+
+    def compress_file(self, name):
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < settings.STATIC_COMPRESS_MIN_SIZE:
+            return
+        for encoding, suffix in ENCODINGS.items():
+            compressed = compress(content, encoding, best=True)
+            if len(compressed) >= len(content):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
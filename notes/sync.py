@@ -0,0 +1,57 @@
+import heapq
+
+from django.http import Http404
+
+from .fields import decompress
+from .models import Tombstone
+from .pagination import MAX_CURSOR, MIN_CURSOR
+
+NOTE_FIELDS = ('slug', 'title', 'text', 'revision', 'updated')
+
+
+def parse_token(value):
+    """Токен ленты — номер последнего полученного клиентом изменения."""
+    if not value:
+        return 0
+    try:
+        token = int(value)
+    except ValueError:
+        raise Http404('Некорректный токен ленты изменений.')
+    if not MIN_CURSOR <= token <= MAX_CURSOR:
+        raise Http404('Некорректный токен ленты изменений.')
+    return token
+
+
+def changes_since(notes, author, since, limit, fields=NOTE_FIELDS):
+    """
+    Изменения заметок автора с номером больше since.
+
+    notes — выборка заметок автора, fields — поля заметок в ответе (с
+    revision). Изменённые заметки и отметки об удалении читаются по
+    индексам (author, revision) не более чем по limit + 1 строке и
+    сливаются в порядке номеров изменений.
+    """
+    changed = notes.filter(revision__gt=since).order_by('revision').values(
+        *fields
+    )[:limit + 1]
+    # Отметки читаются из той же базы, что и заметки (шард или реплика).
+    deleted = Tombstone.objects.using(notes.db).filter(
+        author=author, revision__gt=since
+    ).order_by('revision').values('slug', 'revision')[:limit + 1]
+    page = list(heapq.merge(
+        (('note', row) for row in changed),
+        (('deleted', row) for row in deleted),
+        key=lambda item: item[1]['revision'],
+    ))
+    has_more = len(page) > limit
+    page = page[:limit]
+    for kind, row in page:
+        if kind == 'note' and 'text' in row:
+            # values() не проходит через дескриптор модели.
+            row['text'] = decompress(row['text'])
+    return {
+        'notes': [row for kind, row in page if kind == 'note'],
+        'deleted': [row for kind, row in page if kind == 'deleted'],
+        'next': str(page[-1][1]['revision'] if page else since),
+        'has_more': has_more,
+    }
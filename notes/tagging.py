@@ -0,0 +1,111 @@
+from collections import Counter, defaultdict
+
+from django.db.models import F
+
+# Сколько тегов можно поставить одной заметке.
+MAX_TAGS = 20
+SEPARATOR = ','
+
+
+def parse_tags(value):
+    """
+    Имена тегов из строки через запятую: без пробелов по краям, в нижнем
+    регистре, без повторов, в порядке ввода.
+    """
+    names = (
+        ' '.join(name.split()).lower() for name in value.split(SEPARATOR)
+    )
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def format_tags(names):
+    return f'{SEPARATOR} '.join(names)
+
+
+def tag_ids(author_id, names, using):
+    """Словарь {имя: id} тегов автора; недостающие теги создаются."""
+    from .models import Tag
+
+    tags = Tag.objects.using(using).filter(author_id=author_id)
+    ids = dict(tags.filter(name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        Tag.objects.using(using).bulk_create(
+            (Tag(author_id=author_id, name=name) for name in missing),
+            ignore_conflicts=True,
+        )
+        ids.update(tags.filter(name__in=missing).values_list('name', 'id'))
+    return ids
+
+
+def update_counts(deltas, using):
+    """Меняет Tag.note_count на deltas[id тега]: запрос на каждую разницу."""
+    from .models import Tag
+
+    by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(tag_id)
+    for delta, ids in by_delta.items():
+        Tag.objects.using(using).filter(pk__in=ids).update(
+            note_count=F('note_count') + delta
+        )
+
+
+def apply_tags(notes, using):
+    """
+    Записывает новые теги заметок (note.tag_names) на базе using.
+
+    Вызывается в транзакции сохранения заметок: связи и счётчики тегов
+    меняются на разницу со старыми тегами, и счётчик всегда равен числу
+    связей. Заметки без tag_names не трогаются.
+    """
+    from .models import NoteTag
+
+    pending = [note for note in notes if note.tag_names is not None]
+    if not pending:
+        return
+    linked = {
+        (note_id, tag_id): pk
+        for pk, note_id, tag_id in NoteTag.objects.using(using).filter(
+            note_id__in=[note.pk for note in pending]
+        ).values_list('pk', 'note_id', 'tag_id')
+    }
+    by_author = defaultdict(list)
+    for note in pending:
+        by_author[note.author_id].append(note)
+    wanted = set()
+    for author_id, author_notes in by_author.items():
+        ids = tag_ids(author_id, {
+            name for note in author_notes for name in note.tag_names
+        }, using)
+        wanted |= {
+            (note.pk, ids[name])
+            for note in author_notes for name in note.tag_names
+        }
+    added = wanted - linked.keys()
+    removed = linked.keys() - wanted
+    NoteTag.objects.using(using).bulk_create(
+        NoteTag(note_id=note_id, tag_id=tag_id) for note_id, tag_id in added
+    )
+    NoteTag.objects.using(using).filter(
+        pk__in=[linked[link] for link in removed]
+    ).delete()
+    deltas = Counter(tag_id for _, tag_id in added)
+    deltas.subtract(tag_id for _, tag_id in removed)
+    update_counts(deltas, using)
+    for note in pending:
+        note._tag_list = sorted(note.tag_names)
+        note.tag_names = None
+
+
+def forget_notes(note_ids, using):
+    """Уменьшает счётчики тегов удаляемых заметок; связи удалит каскад."""
+    from .models import NoteTag
+
+    deltas = Counter(
+        NoteTag.objects.using(using).filter(
+            note_id__in=note_ids
+        ).values_list('tag_id', flat=True)
+    )
+    update_counts({tag_id: -count for tag_id, count in deltas.items()}, using)
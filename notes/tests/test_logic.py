@@ -57,11 +57,21 @@ class TestNoteCreate(TestCase):
         note = Note.objects.get()
         self.assertEqual(note.slug, 'zagolovok-zametki')
 
-    def test_slug_not_unique_raises_validation_error(self):
+    def test_generated_slug_gets_numeric_suffix(self):
+        """
+        Проверяю, что при совпадении сгенерированного slug с существующим к
+        нему добавляется числовой суффикс.
+        """
         del self.form_data['slug']
         self.auth_client.post(self.url, data=self.form_data)
-        self.assertFalse(NoteForm(data=self.form_data).is_valid())
-        self.assertEqual(Note.objects.count(), 1)
+        self.assertTrue(NoteForm(data=self.form_data).is_valid())
+        self.auth_client.post(self.url, data=self.form_data)
+        self.auth_client.post(self.url, data=self.form_data)
+        self.assertQuerysetEqual(
+            Note.objects.order_by('id').values_list('slug', flat=True),
+            ['zagolovok-zametki', 'zagolovok-zametki-2',
+             'zagolovok-zametki-3'],
+        )
 
 
 class TestNoteEditDelete(TestCase):
@@ -1,15 +1,30 @@
+from django.conf import settings
 from django.urls import path
 
 from notes import views
+from notes.aio import as_async_view
+
+
+def read_view(view_class):
+    """Асинхронный вариант представления под ASGI, см. ASYNC_VIEWS."""
+    if settings.ASYNC_VIEWS:
+        return as_async_view(view_class)
+    return view_class.as_view()
+
 
 app_name = 'notes'
 
 urlpatterns = [
-    path('', views.Home.as_view(), name='home'),
+    path('', read_view(views.Home), name='home'),
     path('add/', views.NoteCreate.as_view(), name='add'),
     path('edit/<slug:slug>/', views.NoteUpdate.as_view(), name='edit'),
-    path('note/<slug:slug>/', views.NoteDetail.as_view(), name='detail'),
+    path('note/<slug:slug>/', read_view(views.NoteDetail), name='detail'),
     path('delete/<slug:slug>/', views.NoteDelete.as_view(), name='delete'),
-    path('notes/', views.NotesList.as_view(), name='list'),
+    path('notes/', read_view(views.NotesList), name='list'),
+    path('search/', views.NoteSearch.as_view(), name='search'),
+    path('export/', views.NoteExport.as_view(), name='export'),
+    path('api/notes/', views.NoteBatchApi.as_view(), name='api'),
+    path('changes/', views.NoteChanges.as_view(), name='changes'),
+    path('events/', views.NoteEvents.as_view(), name='events'),
     path('done/', views.NoteSuccess.as_view(), name='success'),
 ]
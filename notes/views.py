@@ -1,14 +1,51 @@
+import hashlib
+import json
+import mimetypes
+from http import HTTPStatus
+from pathlib import Path
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.db import router
+from django.db.models import Count, Max
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse,
+    StreamingHttpResponse,
+)
 from django.urls import reverse_lazy
+from django.utils._os import safe_join
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers,
+)
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from django.utils.functional import SimpleLazyObject
 from django.views import generic
 
+from .batch import BatchConflict, BatchError, NoteBatch
+from .cache import get_note, get_notes_version, notes_cache, versioned_key
+from .compression import ENCODINGS, negotiate
+from .db import reading_replicas
+from .events import (
+    LAST_EVENT_ID_HEADER, STREAM_HEADERS, EventStream, events_url,
+    parse_last_event_id,
+)
+from .export import JsonlWriter, ZipWriter, aexport_notes, export_notes
 from .forms import NoteForm
-from .models import Note
+from .metrics import render_metrics
+from .models import Note, Tag
+from .pagination import KeysetPage, paginate_keyset
+from .search import search_notes
+from .sync import changes_since, parse_token
 
 
 class Home(generic.TemplateView):
     """Домашняя страница."""
     template_name = 'notes/home.html'
+    replica_reads = True
 
 
 class NoteSuccess(LoginRequiredMixin, generic.TemplateView):
@@ -23,7 +60,65 @@ class NoteBase(LoginRequiredMixin):
 
     def get_queryset(self):
         """Пользователь может работать только со своими заметками."""
-        return self.model.objects.filter(author=self.request.user)
+        return self.model.objects.for_author(self.request.user)
+
+    def get_object(self, queryset=None):
+        """Заметка по slug из адреса; повторные запросы идут мимо базы."""
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, '_note'):
+            self._note = get_note(
+                self.request.user.pk, self.kwargs[self.slug_url_kwarg],
+                self.load_object,
+            )
+        return self._note
+
+    def load_object(self):
+        note = super().get_object()
+        # Заметку, прочитанную с реплики, из кеша возьмут и для изменения:
+        # сохранение и удаление должны идти в базу для записи.
+        note._state.db = router.db_for_write(
+            self.model, author_id=note.author_id
+        )
+        # Теги кешируются вместе с заметкой.
+        note.tag_list()
+        return note
+
+
+class ConditionalGetMixin:
+    """
+    Отвечает 304 Not Modified, если у клиента актуальная версия страницы.
+
+    Валидаторы считаются одним запросом до рендеринга шаблона.
+    """
+
+    def get_validators(self):
+        """Возвращает (last_modified, ключ для ETag) или (None, None)."""
+        raise NotImplementedError
+
+    def get_etag(self, key):
+        return quote_etag(hashlib.sha1(
+            f'{self.request.user.pk}:{self.request.user.username}:{key}:'
+            f'{self.request.GET.urlencode()}'.encode()
+        ).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        last_modified, key = self.get_validators()
+        etag = self.get_etag(key) if key is not None else None
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=(
+                int(last_modified.timestamp()) if last_modified else None
+            ),
+        )
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if last_modified and not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        if etag and not response.has_header('ETag'):
+            response['ETag'] = etag
+        return response
 
 
 class NoteCreate(NoteBase, generic.CreateView):
@@ -49,11 +144,287 @@ class NoteDelete(NoteBase, generic.DeleteView):
     template_name = 'notes/delete.html'
 
 
-class NotesList(NoteBase, generic.ListView):
+class NotesList(NoteBase, ConditionalGetMixin, generic.ListView):
     """Список всех заметок пользователя."""
     template_name = 'notes/list.html'
+    context_object_name = 'note_list'
+    replica_reads = True
+    per_page = 50
+    # Шаблону списка нужны только эти поля, text не загружаем.
+    list_fields = ('id', 'slug', 'title')
+
+    def get_queryset(self):
+        return super().get_queryset().only(*self.list_fields)
 
+    def get_page(self):
+        name = self.request.GET.get('tag')
+        if not name:
+            return paginate_keyset(
+                self.object_list, self.request.GET, self.per_page
+            )
+        tag = Tag.objects.for_author(self.request.user).filter(
+            name=name
+        ).first()
+        if tag is None:
+            return KeysetPage(object_list=[])
+        # Страница по индексу связей (tag, note): сортировка по note_id
+        # связи, а не по (author, id) заметок, иначе SQLite перебирает
+        # все заметки автора.
+        return paginate_keyset(
+            Note.objects.with_tag(tag).only(*self.list_fields),
+            self.request.GET, self.per_page,
+            ordering=('note_tags__note',),
+        )
 
-class NoteDetail(NoteBase, generic.DetailView):
+    def get_validators(self):
+        # Пока версия заметок не менялась, валидаторы берутся из кеша.
+        key = versioned_key(self.request.user.pk, 'list-validators')
+        stats = notes_cache().get(key)
+        if stats is None:
+            # Удаление не меняет MAX(updated), поэтому в ETag входит и COUNT.
+            stats = super().get_queryset().aggregate(
+                last_modified=Max('updated'), count=Count('id')
+            )
+            if not reading_replicas():
+                notes_cache().set(
+                    key, stats, settings.NOTES_FRAGMENT_TIMEOUT
+                )
+        # Без Last-Modified: по одному If-Modified-Since удаление не видно.
+        return None, f'{stats["last_modified"]}:{stats["count"]}'
+
+    def get_context_data(self, **kwargs):
+        # Страница вычисляется лениво: если фрагмент списка уже есть в кеше,
+        # шаблон к ней не обращается и запроса к заметкам не будет.
+        page = SimpleLazyObject(self.get_page)
+        return super().get_context_data(
+            object_list=SimpleLazyObject(lambda: page.object_list),
+            page=page,
+            tag=self.request.GET.get('tag', ''),
+            # Счётчики хранятся в Tag.note_count: один запрос по индексу
+            # (author, name), и тоже только при промахе кеша фрагмента.
+            tags=Tag.objects.for_author(self.request.user).filter(
+                note_count__gt=0
+            ).order_by('name').only('name', 'note_count'),
+            events_url=events_url(self.request),
+            **kwargs
+        )
+
+
+class NoteDetail(NoteBase, ConditionalGetMixin, generic.DetailView):
     """Заметка подробно."""
     template_name = 'notes/detail.html'
+    replica_reads = True
+
+    def get_validators(self):
+        try:
+            note = self.get_object()
+        except Http404:
+            return None, None
+        # Шапка показывает статистику всех заметок автора: версия заметок
+        # меняется при любой их записи, и 304 не оставит её устаревшей.
+        # Last-Modified заметки её не учитывает, поэтому не отдаётся.
+        return None, (
+            f'{note.pk}:{note.updated}:'
+            f'{get_notes_version(self.request.user.pk)}'
+        )
+
+
+class NoteSearch(NoteBase, generic.ListView):
+    """Полнотекстовый поиск по заметкам пользователя."""
+    template_name = 'notes/search.html'
+    per_page = 20
+
+    def get_queryset(self):
+        return search_notes(
+            super().get_queryset(),
+            self.request.user,
+            self.request.GET.get('q', ''),
+            cursor=self.request.GET.get('cursor'),
+            limit=self.per_page,
+        )
+
+    def get_context_data(self, **kwargs):
+        notes, next_cursor = self.object_list
+        return super().get_context_data(
+            object_list=notes,
+            next_cursor=next_cursor,
+            query=self.request.GET.get('q', ''),
+            **kwargs
+        )
+
+
+class NoteExport(NoteBase, generic.View):
+    """Выгрузка всех заметок пользователя в JSONL или ZIP с Markdown."""
+    formats = {
+        'jsonl': (JsonlWriter, 'application/x-ndjson', 'notes.jsonl'),
+        'zip': (ZipWriter, 'application/zip', 'notes.zip'),
+    }
+
+    def get(self, request, *args, **kwargs):
+        try:
+            writer_class, content_type, filename = self.formats[
+                request.GET.get('format', 'jsonl')
+            ]
+        except KeyError:
+            raise Http404('Неизвестный формат выгрузки.')
+        if isinstance(request, ASGIRequest):
+            # Под ASGI поток отдаёт notes.aio.ASGIHandler, читая заметки
+            # в пуле run_db, а не в цикле событий.
+            response = StreamingHttpResponse((), content_type=content_type)
+            response.async_content = aexport_notes(
+                writer_class(), self.get_queryset()
+            )
+        else:
+            response = StreamingHttpResponse(
+                export_notes(writer_class(), self.get_queryset()),
+                content_type=content_type,
+            )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"'
+        )
+        return response
+
+
+class NoteBatchApi(NoteBase, generic.View):
+    """
+    Пакетное создание, изменение и удаление заметок.
+
+    Принимает JSON {"operations": [...]}, где операция — это
+    {"action": "create", "data": {...}},
+    {"action": "update", "slug": ..., "data": {...}} или
+    {"action": "delete", "slug": ...}; data содержит поля NoteForm.
+    """
+    http_method_names = ('post',)
+    raise_exception = True
+
+    def post(self, request, *args, **kwargs):
+        try:
+            payload = json.loads(request.body)
+            batch = NoteBatch(request.user, payload['operations'])
+            applied, results = batch.apply()
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse(
+                {'error': 'Ожидается JSON с ключом operations.'},
+                status=HTTPStatus.BAD_REQUEST,
+            )
+        except BatchConflict as error:
+            return JsonResponse(
+                {'error': str(error)}, status=HTTPStatus.CONFLICT
+            )
+        except BatchError as error:
+            return JsonResponse(
+                {'error': str(error)}, status=HTTPStatus.BAD_REQUEST
+            )
+        return JsonResponse(
+            {'applied': applied, 'results': results},
+            status=HTTPStatus.OK if applied else HTTPStatus.BAD_REQUEST,
+        )
+
+
+class NoteChanges(NoteBase, generic.View):
+    """
+    Лента изменений для синхронизации: заметки, изменённые после токена
+    since, и slug удалённых заметок.
+    """
+    raise_exception = True
+    per_page = 500
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(changes_since(
+            self.get_queryset(),
+            request.user,
+            parse_token(request.GET.get('since')),
+            self.per_page,
+        ))
+
+
+class NoteEvents(NoteBase, generic.View):
+    """
+    Поток server-sent events об изменениях заметок пользователя: create,
+    update и delete, heartbeat и продолжение с Last-Event-ID.
+
+    Под WSGI поток занимает поток сервера; под ASGI те же события отдаёт
+    notes.events.EventsApplication без участия этого представления.
+    """
+    http_method_names = ('get',)
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        # Генератор, а не сам поток: response.close() закроет его и
+        # отпишет подписчика от брокера.
+        response = StreamingHttpResponse(iter(EventStream(
+            self.get_queryset(), request.user,
+            parse_last_event_id(request.headers.get(LAST_EVENT_ID_HEADER)),
+        )))
+        for header, value in STREAM_HEADERS.items():
+            response[header] = value
+        return response
+
+
+class Metrics(generic.View):
+    """
+    Метрики запросов всех процессов в формате Prometheus.
+
+    Если задан METRICS_TOKEN, нужен заголовок Authorization: Bearer <токен>.
+    """
+    http_method_names = ('get',)
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token and not constant_time_compare(
+            request.headers.get('Authorization', ''), f'Bearer {token}'
+        ):
+            return HttpResponseForbidden()
+        return HttpResponse(
+            render_metrics(), content_type='text/plain; version=0.0.4'
+        )
+
+
+class StaticAsset(generic.View):
+    """
+    Файлы STATIC_ROOT после collectstatic.
+
+    Если клиент принимает brotli или gzip, отдаётся заранее сжатая копия.
+    Имена с хешем содержимого из манифеста кешируются навсегда
+    (immutable), остальные — на STATIC_MAX_AGE секунд.
+    """
+    http_method_names = ('get', 'head')
+
+    def get(self, request, path):
+        try:
+            full_path = Path(safe_join(settings.STATIC_ROOT, path))
+        except SuspiciousFileOperation:
+            raise Http404
+        if not full_path.is_file():
+            raise Http404
+        variants = [
+            encoding for encoding, suffix in ENCODINGS.items()
+            if full_path.with_name(full_path.name + suffix).is_file()
+        ]
+        encoding = negotiate(
+            request.headers.get('Accept-Encoding', ''), variants
+        )
+        if encoding:
+            full_path = full_path.with_name(
+                full_path.name + ENCODINGS[encoding]
+            )
+        response = FileResponse(
+            full_path.open('rb'),
+            content_type=(
+                mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            ),
+        )
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if variants:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        if path in staticfiles_storage.hashed_files.values():
+            patch_cache_control(
+                response, public=True,
+                max_age=settings.STATIC_IMMUTABLE_MAX_AGE, immutable=True,
+            )
+        else:
+            patch_cache_control(
+                response, public=True, max_age=settings.STATIC_MAX_AGE
+            )
+        return response
@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.http import HttpRequest
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.urls import NoReverseMatch, URLResolver, get_resolver, reverse
+from django.utils import translation
+
+from . import aio
+from .markup import render_markdown
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд поток пула ждёт остальных, открывая соединения.
+POOL_TIMEOUT = 10
+
+
+def url_names(patterns=None, namespace=''):
+    """Имена всех маршрутов вместе с пространствами имён."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_names(
+                pattern.url_patterns,
+                f'{namespace}{pattern.namespace}:'
+                if pattern.namespace else namespace,
+            )
+        elif pattern.name:
+            yield f'{namespace}{pattern.name}'
+
+
+def reverse_urls():
+    """
+    Разворачивает каждый маршрут: словари reverse всех пространств имён
+    заполняются один раз до первого запроса.
+    """
+    names = set(url_names())
+    for name in names:
+        try:
+            reverse(name)
+        except NoReverseMatch:
+            # Маршрут с параметрами, но словари уже заполнены.
+            pass
+    return len(names)
+
+
+def template_names(engine):
+    for directory in engine.dirs:
+        directory = Path(directory)
+        for path in sorted(directory.rglob('*.html')):
+            yield path.relative_to(directory).as_posix()
+
+
+def warm_templates():
+    """
+    Компилирует шаблоны из DIRS в кеш загрузчика (cached loader включён
+    при DEBUG = False) и рендерит каждый один раз: так загружаются
+    библиотеки тегов и каталоги переводов.
+    """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.META.update(SERVER_NAME='localhost', SERVER_PORT='80')
+    request.user = AnonymousUser()
+    count = 0
+    with translation.override(settings.LANGUAGE_CODE):
+        for engine in engines.all():
+            if not isinstance(engine, DjangoTemplates):
+                continue
+            for name in template_names(engine):
+                template = engine.get_template(name)
+                count += 1
+                try:
+                    template.render({}, request)
+                except Exception:
+                    # Без контекста часть шаблонов не дорисуется, но
+                    # скомпилированный шаблон уже в кеше.
+                    logger.debug('Шаблон %s не отрендерен', name)
+    return count
+
+
+def open_connections():
+    """
+    Открывает соединение с каждой базой в текущем потоке: импортируются
+    модули бэкенда, а SQLite читает схему.
+    """
+    for connection in connections.all():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    return len(connections.all())
+
+
+def warm_pool():
+    """
+    Открывает постоянные соединения во всех потоках пула notes.aio.
+
+    Каждая задача ждёт остальных на барьере, поэтому пул создаёт все
+    ASYNC_DB_WORKERS потоков, и соединение получает каждый.
+    """
+    workers = settings.ASYNC_DB_WORKERS
+    barrier = threading.Barrier(workers)
+
+    def open_in_worker():
+        open_connections()
+        barrier.wait(POOL_TIMEOUT)
+
+    executor = aio.get_executor()
+    for future in [executor.submit(open_in_worker) for _ in range(workers)]:
+        future.result()
+    return workers
+
+
+def warm_up(connect=True, pool=False):
+    """
+    Прогрев процесса до первого запроса; возвращает время этапов.
+
+    Безопасен до fork (gunicorn --preload): соединения, открытые для
+    проверки баз, закрываются. С pool=True после этого открываются
+    постоянные соединения потоков notes.aio — это уже для процесса,
+    который будет обслуживать запросы.
+    """
+    timings = {}
+
+    def run(stage, func):
+        started = time.perf_counter()
+        count = func()
+        timings[stage] = time.perf_counter() - started
+        logger.info(
+            'Прогрев %s: %d за %.3f с', stage, count, timings[stage]
+        )
+
+    run('urls', reverse_urls)
+    run('templates', warm_templates)
+    run('markup', lambda: len(render_markdown('*warm-up*')))
+    if connect:
+        run('connections', open_connections)
+        connections.close_all()
+    if pool:
+        run('pool', warm_pool)
+    return timings
@@ -9,8 +9,25 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from django.conf import settings
+
+from notes.aio import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yanote.settings')
+# Асинхронные представления notes, см. ASYNC_VIEWS в settings.py.
+os.environ.setdefault('YANOTE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+from notes.events import EventsApplication  # noqa: E402
+
+# Поток событий обслуживается в цикле событий, остальное — Django.
+application = EventsApplication(application)
+
+if settings.WARMUP:
+    from notes.warmup import warm_up
+
+    # uvicorn загружает приложение внутри цикла событий, где синхронные
+    # запросы к базе запрещены: соединения открываются только в потоках
+    # пула notes.aio, которые и будут работать с базой.
+    warm_up(connect=False, pool=settings.ASYNC_VIEWS)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 from django.urls import reverse_lazy
@@ -22,11 +23,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'notes.metrics.MetricsMiddleware',
+    'notes.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'notes.auth.CachedAuthenticationMiddleware',
+    'notes.profiling.ProfilingMiddleware',
+    'notes.db.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -44,6 +49,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'notes.context_processors.notes_cache',
             ],
         },
     },
@@ -55,10 +61,149 @@ WSGI_APPLICATION = 'yanote.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('YANOTE_DATABASE', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# Реплики только для чтения, например копии файла базы:
+# YANOTE_REPLICAS=/srv/replica1.sqlite3,/srv/replica2.sqlite3
+DATABASE_REPLICAS = []
+for number, path in enumerate(
+    filter(None, os.getenv('YANOTE_REPLICAS', '').split(',')), start=1
+):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+# Шарды для заметок по авторам, например
+# YANOTE_SHARDS=/srv/shard1.sqlite3,/srv/shard2.sqlite3. Пользователи,
+# сессии и каталог размещения остаются в default. Новые авторы
+# распределяются по шардам консистентным хешированием; после добавления
+# шарда запустите manage.py rebalance_shards. Шардам нужен общий кеш
+# (YANOTE_CACHE_DIR): в нём лежит каталог размещения, который
+# rebalance_shards переключает для всех процессов.
+NOTE_SHARDS = []
+for number, path in enumerate(
+    filter(None, os.getenv('YANOTE_SHARDS', '').split(',')), start=1
+):
+    DATABASES[f'shard{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+    }
+    NOTE_SHARDS.append(f'shard{number}')
+
+# Сколько секунд шард автора хранится в кеше. Столько же процесс, который
+# прочитал каталог до переноса автора, может писать на прежний шард.
+SHARD_PLACEMENT_TIMEOUT = 60
+
+DATABASE_ROUTERS = ['notes.sharding.ShardRouter', 'notes.db.ReplicaRouter']
+
+# Сколько секунд после записи клиент читает только из основной базы.
+REPLICA_PIN_SECONDS = 5
+
+# PRAGMA для каждого нового соединения с SQLite, см. notes.db.
+SQLITE_PRAGMAS = {}
+
+DB_HEALTH_CHECKS = False
+
+# Под ASGI (yanote/asgi.py включает YANOTE_ASYNC_VIEWS) главная, список и
+# страница заметки асинхронные, а работа с базой идёт в пуле из
+# ASYNC_DB_WORKERS потоков, см. notes.aio.
+ASYNC_VIEWS = os.getenv('YANOTE_ASYNC_VIEWS') == '1'
+ASYNC_DB_WORKERS = int(os.getenv('YANOTE_ASYNC_DB_WORKERS', 8))
+
+# Поток событий notes:events, см. notes.events. Брокер по умолчанию
+# работает в памяти процесса: об изменениях из других процессов подписчик
+# узнаёт только при переподключении или следующем событии своего процесса.
+# Для нескольких процессов задайте брокер с тем же интерфейсом поверх
+# внешней очереди.
+EVENTS_BROKER = 'notes.events.LocalBroker'
+EVENTS_HEARTBEAT_SECONDS = 15
+# Сколько событий ждёт отправки одному подписчику; при переполнении поток
+# догоняет из базы.
+EVENTS_QUEUE_SIZE = 100
+# Список заметок подписывается на поток, только если его обслуживает
+# EventsApplication (yanote/asgi.py). Под WSGI каждый подписчик держит
+# поток сервера; True включает подписку и там.
+EVENTS_WSGI = False
+
+# yanote/wsgi.py и asgi.py прогревают процесс до первого запроса (маршруты,
+# шаблоны, соединения), см. notes.warmup. YANOTE_WARMUP=0 отключает.
+# Что дольше всего импортируется при старте: manage.py profile_imports.
+WARMUP = os.getenv('YANOTE_WARMUP', '1') == '1'
+
+# Метрики запросов, см. notes.metrics. Чтобы /metrics видел все процессы
+# сервера, задайте общий каталог YANOTE_METRICS_DIR.
+METRICS_DIR = os.getenv('YANOTE_METRICS_DIR')
+METRICS_FLUSH_SECONDS = 5
+METRICS_TOKEN = os.getenv('YANOTE_METRICS_TOKEN', '')
+# Сколько повторов одного SQL за запрос считать признаком N+1.
+NPLUSONE_THRESHOLD = 10
+
+# Профилирование запросов по требованию, см. notes.profiling: сотрудник
+# добавляет ?profile=pstats или ?profile=collapsed, либо клиент передаёт
+# заголовок X-Profile, подписанный notes.profiling.make_token и
+# действующий PROFILE_TOKEN_MAX_AGE секунд. PROFILE_SAMPLE_RATE — доля запросов,
+# профилируемых без флага. Хранятся PROFILE_KEEP последних профилей.
+PROFILE_DIR = os.getenv('YANOTE_PROFILE_DIR', BASE_DIR / 'profiles')
+PROFILE_SAMPLE_RATE = float(os.getenv('YANOTE_PROFILE_SAMPLE_RATE', 0))
+PROFILE_KEEP = 100
+PROFILE_INTERVAL = 0.005
+PROFILE_TOKEN_MAX_AGE = 60 * 60
+
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'notes': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'notes',
+    },
+}
+
+# Для нескольких процессов задайте YANOTE_CACHE_DIR: фрагменты и версии
+# заметок будут храниться в общем файловом кеше. Без него команды, которые
+# меняют заметки (import_notes, render_notes, reconcile_stats,
+# rebalance_shards, seed_notes), запускаются только с --local-cache при
+# остановленных серверах.
+NOTES_CACHE_DIR = os.getenv('YANOTE_CACHE_DIR')
+if NOTES_CACHE_DIR:
+    CACHES['notes'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': NOTES_CACHE_DIR,
+    }
+
+NOTES_CACHE = 'notes'
+
+NOTES_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+# Кеш объектов заметок для страниц по slug: сколько хранить в общем кеше
+# и сколько последних заметок держать в памяти процесса.
+NOTES_OBJECT_TIMEOUT = 60 * 60
+NOTES_OBJECT_CACHE_SIZE = 1000
+
+# Тексты заметок от этого размера в байтах хранятся сжатыми zlib.
+NOTE_TEXT_COMPRESS_THRESHOLD = 1024
+NOTE_TEXT_COMPRESS_LEVEL = 6
+
+# С общим кешем (YANOTE_CACHE_DIR) сессии хранятся в кеше заметок, а в
+# базу изменения пишутся пачкой не чаще раза в SESSION_WRITE_BEHIND_SECONDS
+# (0 — писать сразу). Без него выход или смена пароля в одном процессе не
+# дошли бы до остальных, поэтому сессии читаются из базы.
+SESSION_ENGINE = (
+    'notes.sessions' if NOTES_CACHE_DIR
+    else 'django.contrib.sessions.backends.db'
+)
+SESSION_CACHE_ALIAS = NOTES_CACHE
+SESSION_WRITE_BEHIND_SECONDS = 5
+
+# Пользователь читается вместе со статистикой заметок для шапки.
+AUTHENTICATION_BACKENDS = ['notes.auth.StatsModelBackend']
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -83,6 +228,24 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+STATICFILES_DIRS = [BASE_DIR / 'static']
+
+STATIC_ROOT = os.getenv('YANOTE_STATIC_ROOT', BASE_DIR / 'static_root')
+
+# Имена файлов с хешем содержимого и сжатые копии .br и .gz файлов от
+# STATIC_COMPRESS_MIN_SIZE байт создаются при collectstatic.
+STATICFILES_STORAGE = 'notes.storage.CompressedManifestStaticFilesStorage'
+STATIC_COMPRESS_MIN_SIZE = 256
+
+# Файлы с хешем в имени кешируются навсегда, остальные — на минуту.
+STATIC_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+STATIC_MAX_AGE = 60
+
+# Ответы от этого размера сжимаются brotli или gzip (CompressionMiddleware).
+RESPONSE_COMPRESS_MIN_SIZE = 1024
+RESPONSE_BROTLI_QUALITY = 5
+RESPONSE_GZIP_LEVEL = 6
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = reverse_lazy('users:login')
@@ -0,0 +1,32 @@
+"""
+Профиль для продакшена:
+python manage.py ... --settings=yanote.settings_production
+или DJANGO_SETTINGS_MODULE=yanote.settings_production.
+"""
+from .settings import *  # noqa: F401, F403
+from .settings import DATABASES
+
+DATABASES['default'].update({
+    # Постоянные соединения: не открывать файл базы на каждый запрос.
+    'CONN_MAX_AGE': 600,
+    'OPTIONS': {
+        # Ожидание блокировки на уровне драйвера, в секундах.
+        'timeout': 5,
+    },
+})
+
+SQLITE_PRAGMAS = {
+    # Читатели не блокируют писателя, а писатель — читателей.
+    'journal_mode': 'WAL',
+    # В режиме WAL fsync только на контрольных точках; база не
+    # повреждается при сбое, теряются лишь последние транзакции.
+    'synchronous': 'NORMAL',
+    # Кеш страниц 64 МиБ (отрицательное значение — в КиБ).
+    'cache_size': -64000,
+    # Чтение через mmap до 256 МиБ файла базы.
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+DB_HEALTH_CHECKS = True
@@ -1,12 +1,21 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.forms import UserCreationForm
 from django.urls import include, path
 from django.views.generic import CreateView
 
+from notes.views import Metrics, StaticAsset
+
 urlpatterns = [
     path('', include('notes.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', Metrics.as_view(), name='metrics'),
+    path(
+        f'{settings.STATIC_URL.lstrip("/")}<path:path>',
+        StaticAsset.as_view(),
+        name='static',
+    ),
 ]
 
 auth_urls = ([
@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yanote.settings')
 
 application = get_wsgi_application()
+
+if settings.WARMUP:
+    from notes.warmup import warm_up
+
+    # Безопасно до fork: с gunicorn --preload прогрев делается один раз
+    # в мастере, а рабочие процессы получают его готовым.
+    warm_up()